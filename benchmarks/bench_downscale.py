@@ -0,0 +1,124 @@
+"""
+Benchmark thu nhỏ frame: LANCZOS cả frame mỗi tick (cách cũ) so với thu nhỏ k/8 chỉ các vùng thay đổi.
+Chạy headless (SyntheticCaptureBackend), không cần màn hình:
+    python benchmarks/bench_downscale.py [--frames 60] [--max-dimension 1920]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Add project root to path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageChops
+from src.client.client_capture import CapturedFrame, SyntheticCaptureBackend
+from src.client.client_regions import TileChangeDetector
+from src.client.client_screenshot import ClientScreenshot
+
+try:
+    LANCZOS = Image.Resampling.LANCZOS
+except AttributeError:
+    LANCZOS = Image.ANTIALIAS
+
+RESOLUTIONS = (("1440p", 2560, 1440), ("4K", 3840, 2160))
+
+
+def _ms(samples):
+    samples = sorted(samples)
+    return sum(samples) / len(samples) * 1000.0, samples[len(samples) // 2] * 1000.0
+
+
+def bench_legacy(width, height, max_dimension, frames):
+    """Cách cũ: to_image + LANCZOS cả frame + tạo lại buffer, rồi mới so sánh trên ảnh đã thu nhỏ."""
+    backend = SyntheticCaptureBackend(width, height)
+    detector = TileChangeDetector(tile_size=64)
+    scale = float(max_dimension) / max(width, height)
+    size = (int(width * scale), int(height * scale))
+    samples = []
+    for _ in range(frames):
+        frame = backend.grab()
+        start = time.perf_counter()
+        small = CapturedFrame.from_image(frame.to_image().resize(size, LANCZOS))
+        rects = detector.detect(None, small.array)
+        for rect in rects or ():
+            small.to_image(rect)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_pipeline(width, height, max_dimension, frames):
+    """Cách mới: stage capture của ClientScreenshot (so sánh trên buffer gốc, thu nhỏ k/8 từng vùng)."""
+    shot = ClientScreenshot(max_dimension=max_dimension, detect_delta=True,
+                            backend=SyntheticCaptureBackend(width, height))
+    shot._capture_stage()  # FULL đầu tiên (đo riêng bên dưới)
+    samples = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        shot._capture_stage()
+        samples.append(time.perf_counter() - start)
+    return samples, shot
+
+
+def bench_full_frame(width, height, max_dimension, frames):
+    """Chi phí thu nhỏ một FULL frame (keyframe): LANCZOS so với k/8."""
+    backend = SyntheticCaptureBackend(width, height)
+    shot = ClientScreenshot(max_dimension=max_dimension, backend=backend)
+    frame = backend.grab()
+    scaler = shot._scaler_for(frame.size)
+    scale = float(max_dimension) / max(width, height)
+    size = (int(width * scale), int(height * scale))
+    legacy, fast = [], []
+    for _ in range(max(3, frames // 10)):
+        start = time.perf_counter()
+        frame.to_image().resize(size, LANCZOS)
+        legacy.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        scaler.region(frame)
+        fast.append(time.perf_counter() - start)
+    return legacy, fast, scaler
+
+
+def check_consistency(shot):
+    """Ảnh manager ghép từ các vùng đã thu nhỏ phải trùng với thu nhỏ cả frame hiện tại."""
+    backend = shot.backend
+    canvas = None
+    shot.force_full_frame()
+    for _ in range(10):
+        job = shot._capture_stage()
+        if job is None:
+            continue
+        if job.is_full:
+            canvas = job.regions[0][1].copy()
+        else:
+            for rect, img in job.regions:
+                canvas.paste(img, rect[:2])
+    frame = CapturedFrame(backend._buffer, backend.width, backend.height)
+    _, truth = shot._scaler_for(frame.size).region(frame)
+    return ImageChops.difference(canvas, truth).getbbox() is None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--max-dimension", type=int, default=1920)
+    args = parser.parse_args()
+
+    print(f"max_dimension={args.max_dimension}, {args.frames} frame / phép đo (trung bình / trung vị, ms)")
+    print(f"{'':6} {'tick cũ (LANCZOS)':>20} {'tick mới (k/8)':>18} {'FULL cũ':>12} {'FULL mới':>12}  tỉ lệ   khớp pixel")
+    for name, width, height in RESOLUTIONS:
+        legacy = _ms(bench_legacy(width, height, args.max_dimension, args.frames))
+        samples, shot = bench_pipeline(width, height, args.max_dimension, args.frames)
+        fast = _ms(samples)
+        full_legacy, full_fast, scaler = bench_full_frame(width, height, args.max_dimension, args.frames)
+        full_legacy, full_fast = _ms(full_legacy), _ms(full_fast)
+        exact = "có" if check_consistency(shot) else "KHÔNG"
+        print(f"{name:6} {legacy[0]:10.1f} / {legacy[1]:6.1f} {fast[0]:9.1f} / {fast[1]:6.1f} "
+              f"{full_legacy[0]:12.1f} {full_fast[0]:12.1f}  {scaler.k}/8   {exact}")
+
+
+if __name__ == "__main__":
+    main()
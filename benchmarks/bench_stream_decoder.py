@@ -0,0 +1,125 @@
+"""
+Benchmark tách PDU ở receiver: vòng lặp cũ (bytes(buf) + tính lại độ dài + del buf[:n] mỗi PDU)
+so với PDUStreamDecoder dùng chung. Không cần mạng, dữ liệu được cắt sẵn như khi đi qua TPKT/MCS:
+    python benchmarks/bench_stream_decoder.py [--rounds 5] [--chunk 1460]
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+
+# Add project root to path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.common.network.constants import (
+    SHARE_CTRL_HDR_FMT, SHARE_HDR_SIZE, FRAGMENT_FLAG,
+    PDU_TYPE_FULL, PDU_TYPE_CONTROL, PDU_TYPE_INPUT, PDU_TYPE_CURSOR,
+)
+from src.common.network.pdu_builder import PDUBuilder
+from src.common.network.stream_decoder import PDUStreamDecoder
+
+
+def legacy_total_length(data: bytes) -> int:
+    """Bản rút gọn của _get_pdu_total_length cũ (đủ cho các loại PDU trong benchmark)."""
+    if len(data) < SHARE_HDR_SIZE:
+        raise ValueError("Không đủ dữ liệu cho header chung")
+    seq, ts_ms, ptype, flags = struct.unpack_from(SHARE_CTRL_HDR_FMT, data)
+    offset = SHARE_HDR_SIZE
+    if flags & FRAGMENT_FLAG:
+        return len(data)
+    try:
+        if ptype == PDU_TYPE_FULL:
+            if len(data) < offset + 12: raise ValueError("Thiếu header FULL")
+            return offset + 12 + struct.unpack_from(">I", data, offset + 8)[0]
+        elif ptype == PDU_TYPE_CONTROL or ptype == PDU_TYPE_INPUT:
+            if len(data) < offset + 4: raise ValueError("Thiếu header CONTROL/INPUT")
+            return offset + 4 + struct.unpack_from(">I", data, offset)[0]
+        elif ptype == PDU_TYPE_CURSOR:
+            if len(data) < offset + 12: raise ValueError("Thiếu header CURSOR")
+            return offset + 12 + struct.unpack_from(">I", data, offset + 8)[0]
+        raise ValueError(f"Loại PDU không xác định: {ptype}")
+    except struct.error:
+        raise ValueError("Không đủ dữ liệu để đọc độ dài PDU")
+
+
+def run_legacy(chunks):
+    buf = bytearray()
+    out = 0
+    for chunk in chunks:
+        buf.extend(chunk)
+        while buf:
+            try:
+                total = legacy_total_length(bytes(buf))
+            except ValueError:
+                break
+            if len(buf) < total:
+                break
+            pdu = buf[:total]
+            del buf[:total]
+            out += len(pdu)
+    return out
+
+
+def run_decoder(chunks):
+    decoder = PDUStreamDecoder()
+    out = 0
+    for chunk in chunks:
+        for pdu in decoder.feed(chunk):
+            out += len(pdu)
+    return out
+
+
+def split(stream: bytes, size: int):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def scenarios(chunk):
+    payload = os.urandom(60000)
+    small = [PDUBuilder.build_cursor_pdu(i, i % 1920, i % 1080) if i % 3 else
+             PDUBuilder.build_control_pdu(i, b"ping:%d" % i) for i in range(2000)]
+    big_full = PDUBuilder.build_full_frame_pdu(1, os.urandom(2 * 1024 * 1024), 3840, 2160)
+    return (
+        # Cụm PDU nhỏ (cursor / control) dồn vào một lần đọc
+        ("burst PDU nhỏ", [b"".join(small)] * 5),
+        # FULL ~60 KB không phân mảnh, đến theo từng đoạn nhỏ
+        (f"FULL 60KB / {chunk}B", split(b"".join(
+            PDUBuilder.build_full_frame_pdu(i, payload, 1280, 720) for i in range(10)), chunk)),
+        # FULL 2 MB phân mảnh 64000 byte, mỗi fragment một MCS frame
+        ("FULL 2MB phân mảnh", [frag for _, frag in PDUBuilder.fragmentize(big_full, 64000)]),
+    )
+
+
+def _best(fn, chunks, rounds):
+    best = None
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn(chunks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--chunk", type=int, default=1460, help="kích thước mỗi lần nhận (byte)")
+    args = parser.parse_args()
+
+    print(f"{args.rounds} lần / phép đo, lấy lần nhanh nhất")
+    print(f"{'':22} {'MB':>7} {'cũ (MB/s)':>11} {'mới (MB/s)':>11} {'nhanh hơn':>10}  khớp")
+    for name, chunks in scenarios(args.chunk):
+        size = sum(len(c) for c in chunks)
+        legacy, out_legacy = _best(run_legacy, chunks, args.rounds)
+        fast, out_fast = _best(run_decoder, chunks, args.rounds)
+        mb = size / 1e6
+        same = "có" if out_legacy == out_fast == size else "KHÔNG"
+        print(f"{name:22} {mb:7.2f} {mb / legacy:11.1f} {mb / fast:11.1f} {legacy / fast:9.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
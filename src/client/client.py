@@ -8,6 +8,7 @@ import os
 import socket
 import time
 import threading
+import json
 from PyQt6.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit, QFrame, QMessageBox, QSizePolicy, QScrollArea
 from PyQt6.QtCore import Qt, pyqtSignal
 import pygetwindow as gw
@@ -17,13 +18,17 @@ import win32process
 import psutil
 
 # Import client components
-from src.client.client_constants import CLIENT_ID, CA_FILE
+from src.client.client_constants import (
+    CLIENT_ID, CA_FILE, CMD_BITMAP_CACHE, BITMAP_CACHE_MAX_ENTRIES, CMD_SELECT_MONITOR, CMD_MONITOR_LIST,
+    CMD_WATCHERS, CMD_KEYFRAME, CMD_COLOR_MODE, CMD_VIEWPORT
+)
 from src.client.client_network.client_network import ClientNetwork
-from src.client.client_screenshot import ClientScreenshot
+from src.client.client_displays import ClientDisplays, parse_monitor_selection, parse_viewport
 from src.client.client_network.client_sender import ClientSender
 from src.client.client_input import ClientInputHandler
 from src.client.client_cursor import ClientCursorTracker
 from src.client.client_permissions import ClientPermissions
+from src.common.network.constants import CODEC_JPEG
 
 # Import UI components
 from src.gui.ui_components import DARK_BG, CARD_BG, TEXT_LIGHT, SUBTEXT, SPOTIFY_GREEN
@@ -67,15 +72,28 @@ class Client:
             cafile=CA_FILE, 
             logger=self.logger
         )
-        # Screen sharing: mặc định 1 frame/3s, có thể tăng tốc khi CONTROL
+        # Screen sharing: fps tự điều chỉnh theo mức hoạt động trong khoảng (sàn, trần) của từng chế độ
         self.base_screen_fps = fps or 0.33
-        self.control_screen_fps = 2.0  # CONTROL mode: nhanh hơn (~2 fps)
-        self.screenshot = ClientScreenshot(fps=self.base_screen_fps, quality=85, max_dimension=1920)
+        self.view_fps_range = (min(0.2, self.base_screen_fps), self.base_screen_fps)  # VIEW: tối đa = fps cấu hình
+        self.control_fps_range = (1.0, 10.0)  # CONTROL: nhanh khi đang thao tác, ~1 fps khi đứng im
+        # Ngân sách bitrate đi kèm FPS của từng chế độ
+        self.base_screen_bitrate = 1_000_000     # VIEW: 1 Mbps
+        self.control_screen_bitrate = 6_000_000  # CONTROL: 6 Mbps
+        # Mỗi màn hình một luồng video riêng, chỉ màn hình manager đang xem mới được chụp
+        self.screenshot = ClientDisplays(fps=self.base_screen_fps, quality=85, max_dimension=1920,
+                                         target_bitrate=self.base_screen_bitrate)
         self.sender = ClientSender(self.network) # Truyền network
+        self.screenshot.link_stats = self.sender.get_link_stats
+        self.screenshot.on_cache_ops = self._on_cache_ops
+        self.screenshot.on_copy_rect = self._on_copy_rect
         # Input control: Vẫn real-time, không phụ thuộc vào screenshot FPS
         self.input_handler = ClientInputHandler(logger=self.logger)
-        # Cursor tracking: Giảm FPS xuống 5 (đủ để thấy cursor di chuyển)
-        self.cursor_tracker = ClientCursorTracker(self.network, fps=5, logger=self.logger)
+        self.input_handler.set_monitors(self.screenshot.monitor_layout())
+        self.input_handler.on_activity = self.screenshot.notify_input
+        # Cursor tracking: theo sự kiện chuột, tối đa 60 PDU/s khi chuột di chuyển, đứng yên thì không gửi
+        self.cursor_tracker = ClientCursorTracker(self.network, fps=60, logger=self.logger)
+        # ROI encode: vùng quanh con trỏ (vị trí tracker vừa gửi) + cửa sổ đang focus (window tracker)
+        self.screenshot.cursor_position = lambda: self.cursor_tracker.last_pos
 
         self.screenshot_thread = None
         self.monitor_thread = None # [THÊM] Thread giám sát
@@ -223,6 +241,8 @@ class Client:
     def enable_screen_sharing(self):
         """Bật chức năng chia sẻ màn hình"""
         self.screen_sharing_enabled = True
+        # Manager đã lỡ các frame (và op bitmap cache) trong lúc tắt -> đồng bộ lại bằng keyframe
+        self.screenshot.force_full_frame()
         self.logger("[Client] ✅ Đã BẬT screen sharing")
     
     def disable_screen_sharing(self):
@@ -414,6 +434,9 @@ class Client:
                 hwnd = win32gui.GetForegroundWindow()
                 if hwnd:
                     window_title = win32gui.GetWindowText(hwnd)
+                    # Cửa sổ đang focus là vùng ưu tiên khi encode (thu nhỏ -> không ưu tiên gì)
+                    rect = win32gui.GetWindowRect(hwnd)
+                    self.screenshot.set_focus_window(None if win32gui.IsIconic(hwnd) else rect)
                     
                     # Lấy process name
                     _, pid = win32process.GetWindowThreadProcessId(hwnd)
@@ -441,8 +464,8 @@ class Client:
                         # Gửi qua INPUT channel
                         self.network.send_input_pdu(window_data)
                 
-                # Check mỗi 2 giây (không cần quá thường xuyên)
-                time.sleep(2)
+                # Check mỗi 0.5 giây (ROI theo kịp khi đổi / kéo cửa sổ; title chỉ gửi khi đổi)
+                time.sleep(0.5)
                 
             except Exception as e:
                 if self.window_tracker_running:
@@ -451,19 +474,37 @@ class Client:
         
         self.logger("[WindowTracker] Đã dừng window tracker")
 
-    def _on_frame(self, width, height, jpg_bytes, bbox, img, seq, ts_ms):
+    def _on_frame(self, width, height, jpg_bytes, bbox, img, seq, ts_ms, codec=CODEC_JPEG, monitor=0, viewport=None):
         # Kiểm tra xem screen sharing có được bật không
         if not self.screen_sharing_enabled:
             if seq % 100 == 0:  # Log thỉnh thoảng
                 self.logger(f"[Client] 🚫 Screen sharing bị tắt, không gửi frame")
             return
 
-        # Gửi frame định kỳ dù chưa có manager; server sẽ chỉ forward khi có viewer/controller
+        # Không ai xem thì server báo "watchers:0" và capture tạm dừng; server cũ không báo -> vẫn gửi như trước
         frame_type = "FULL" if bbox is None else "RECT"
         if seq % 30 == 0:
             self.logger(f"[Client] 📹 Gửi {frame_type} frame #{seq}, size: {len(jpg_bytes)} bytes (in_session={self.in_session})")
 
-        return self.sender.enqueue_frame(width, height, jpg_bytes, bbox, seq, ts_ms)
+        return self.sender.enqueue_frame(width, height, jpg_bytes, bbox, seq, ts_ms, codec, monitor=monitor,
+                                         viewport=viewport)
+
+    def _on_copy_rect(self, width, height, src, dst, seq, monitor=0):
+        if not self.screen_sharing_enabled:
+            return
+        return self.sender.enqueue_copy_rect(width, height, src, dst, seq, monitor=monitor)
+
+    def _on_cache_ops(self, width, height, tile_size, ops, seq, monitor=0):
+        if not self.screen_sharing_enabled:
+            return
+        return self.sender.enqueue_cache_ops(width, height, tile_size, ops, seq, monitor=monitor)
+
+    def _send_monitor_layout(self):
+        # Manager cần bố cục để chọn màn hình / ghép "tất cả màn hình"
+        try:
+            self.network.send_control_pdu(CMD_MONITOR_LIST + json.dumps(self.screenshot.monitor_layout()))
+        except Exception as e:
+            self.logger(f"[Client] ⚠️ Không gửi được danh sách màn hình: {e}")
 
     def _on_control_pdu(self, pdu: dict):
         msg = pdu.get("message", "")
@@ -488,9 +529,10 @@ class Client:
             self.logger(f"[Client] ==> Manager {manager_id} đang xem màn hình (VIEW mode)")
             self.in_session = True
             self.connected_managers.add(manager_id)
-            self._set_capture_fps(self.base_screen_fps)
+            self._set_capture_fps(self.view_fps_range, self.base_screen_bitrate)
             self._log_connected_managers()
-            self.screenshot.force_full_frame()
+            # Keyframe cho viewer mới do server yêu cầu riêng (keyframe:all), gộp với các viewer khác
+            self._send_monitor_layout()
         
         # Xử lý lệnh CONTROL mới (xem + điều khiển)
         elif msg.startswith("control_started"):
@@ -499,15 +541,15 @@ class Client:
             self.in_session = True
             self.remote_control_enabled = True  # Bật điều khiển từ xa
             self.connected_managers.add(manager_id)
-            self._set_capture_fps(self.control_screen_fps)
+            self._set_capture_fps(self.control_fps_range, self.control_screen_bitrate, progressive=True)
             self._log_connected_managers()
-            self.screenshot.force_full_frame()
+            self._send_monitor_layout()
             
         elif msg == "session_ended":
             self.logger("[Client] Session ended")
             self.in_session = False
             self.connected_managers.clear()
-            self._set_capture_fps(self.base_screen_fps)
+            self._set_capture_fps(self.view_fps_range, self.base_screen_bitrate)
         
         # Xử lý kết thúc VIEW
         elif msg.startswith("view_ended"):
@@ -517,7 +559,7 @@ class Client:
                 self.connected_managers.discard(manager_id)
             if not self.connected_managers:
                 self.in_session = False
-                self._set_capture_fps(self.base_screen_fps)
+                self._set_capture_fps(self.view_fps_range, self.base_screen_bitrate)
             self._log_connected_managers()
         
         # Xử lý kết thúc CONTROL
@@ -529,7 +571,7 @@ class Client:
             if manager_id:
                 self.connected_managers.discard(manager_id)
             if not self.connected_managers:
-                self._set_capture_fps(self.base_screen_fps)
+                self._set_capture_fps(self.view_fps_range, self.base_screen_bitrate)
             self._log_connected_managers()
 
         # Một số server có thể gửi *_stopped thay vì *_ended
@@ -540,7 +582,7 @@ class Client:
                 self.connected_managers.discard(manager_id)
             if not self.connected_managers:
                 self.in_session = False
-                self._set_capture_fps(self.base_screen_fps)
+                self._set_capture_fps(self.view_fps_range, self.base_screen_bitrate)
             self._log_connected_managers()
 
         elif msg.startswith("control_stopped"):
@@ -551,12 +593,58 @@ class Client:
                 self.connected_managers.discard(manager_id)
             if not self.connected_managers:
                 self.in_session = False
-                self._set_capture_fps(self.base_screen_fps)
+                self._set_capture_fps(self.view_fps_range, self.base_screen_bitrate)
             self._log_connected_managers()
             
         elif msg == "request_refresh":
             if self.in_session:
-                self.screenshot.force_full_frame()
+                self.screenshot.request_keyframe()
+                self.cursor_tracker.reset_shapes()
+
+        # Viewer cần FULL frame (mới vào / mất ảnh nền): "keyframe:<monitor|all>"
+        elif msg.startswith(CMD_KEYFRAME):
+            target = msg[len(CMD_KEYFRAME):].strip()
+            self.screenshot.request_keyframe(int(target) if target.isdigit() else None)
+            if not target.isdigit():
+                # Viewer mới: chưa có cache hình dạng con trỏ
+                self.cursor_tracker.reset_shapes()
+
+        # Chế độ màu (đường truyền yếu): manager đổi lúc đang xem, áp dụng từ keyframe kế tiếp
+        elif msg.startswith(CMD_COLOR_MODE):
+            mode = msg[len(CMD_COLOR_MODE):].strip()
+            self.screenshot.set_color_mode(mode)
+            self.logger(f"[Client] 🎨 Chế độ màu = {self.screenshot.color_mode}")
+
+        # Dung lượng bitmap cache server đã thương lượng với các manager đang xem
+        elif msg.startswith(CMD_BITMAP_CACHE):
+            try:
+                entries = min(int(msg.split(":", 1)[1]), BITMAP_CACHE_MAX_ENTRIES)
+            except (IndexError, ValueError):
+                entries = 0
+            self.screenshot.set_bitmap_cache(entries)
+            self.logger(f"[Client] 🧩 Bitmap cache = {entries} ô")
+
+        # Số manager đang xem / điều khiển: 0 -> tạm dừng chụp màn hình, > 0 -> chạy lại từ FULL frame
+        elif msg.startswith(CMD_WATCHERS):
+            self._set_watched(msg[len(CMD_WATCHERS):])
+
+        # Các màn hình mà ít nhất một manager đang xem (server đã gộp)
+        elif msg.startswith(CMD_SELECT_MONITOR):
+            try:
+                ids = parse_monitor_selection(msg[len(CMD_SELECT_MONITOR):])
+            except ValueError:
+                ids = [0]
+            watched = self.screenshot.set_watched(ids)
+            self.logger(f"[Client] 🖥️ Chụp màn hình: {watched}")
+
+        # Viewport của manager: chỉ chụp / encode vùng đang hiển thị, ở đúng kích thước hiển thị
+        elif msg.startswith(CMD_VIEWPORT):
+            try:
+                monitor, region, size = parse_viewport(msg[len(CMD_VIEWPORT):])
+                self.screenshot.set_viewport(monitor, region, size)
+                self.logger(f"[Client] 🔍 Viewport màn hình {'all' if monitor is None else monitor}: {region}, {size}")
+            except ValueError:
+                pass
         
         # === Thêm commands để bật/tắt screen sharing ===
         elif msg == "enable_screen_sharing":
@@ -571,14 +659,34 @@ class Client:
         elif msg == "disable_remote_control":
             self.disable_remote_control()
 
-    def _set_capture_fps(self, fps_value: float):
-        """Điều chỉnh FPS capture động cho các chế độ VIEW/CONTROL."""
+    def _set_capture_fps(self, fps_range, bitrate: int = None, progressive: bool = False):
+        """
+        Điều chỉnh khoảng FPS (sàn, trần) (và ngân sách bitrate nếu có) capture cho các chế độ VIEW/CONTROL.
+        progressive: CONTROL gửi nhanh ở chất lượng thấp rồi refine vùng đã đứng yên.
+        """
         try:
-            self.screenshot.fps = max(fps_value, 0.05)
-            self.logger(f"[Client] 🎞️ Cập nhật FPS capture = {self.screenshot.fps} fps")
+            min_fps, max_fps = fps_range
+            self.screenshot.set_fps_range(max(min_fps, 0.05), max(max_fps, 0.05))
+            if bitrate is not None:
+                self.screenshot.target_bitrate = bitrate
+            self.screenshot.progressive = progressive
+            self.logger(f"[Client] 🎞️ Cập nhật FPS capture = {min_fps:g}-{max_fps:g} fps, "
+                        f"bitrate = {self.screenshot.target_bitrate // 1000} kbps"
+                        f"{', progressive' if progressive else ''}")
         except Exception as e:
             self.logger(f"[Client] ⚠️ Không thể cập nhật FPS: {e}")
 
+    def _set_watched(self, count_text):
+        try:
+            watched = int(count_text) > 0
+        except ValueError:
+            watched = True  # Không đọc được -> an toàn: vẫn chụp
+        if watched == (not self.screenshot.paused):
+            return
+        self.screenshot.set_paused(not watched)
+        self.cursor_tracker.paused = not watched
+        self.logger(f"[Client] {'▶️ Có manager đang xem, tiếp tục chụp màn hình' if watched else '⏸️ Không ai xem, tạm dừng chụp màn hình'}")
+
     def _log_connected_managers(self):
         managers = ", ".join(sorted(self.connected_managers)) if self.connected_managers else "(none)"
         self.logger(f"[Client] 🔗 Managers đang kết nối: {managers}")
@@ -6,6 +6,7 @@ import threading
 import time
 import os
 import sys
+import json
 
 # [THÊM] Thư viện lấy tiêu đề cửa sổ
 try:
@@ -16,10 +17,14 @@ except ImportError:
 
 from src.client.client_network.client_network import ClientNetwork
 from src.client.client_network.client_sender import ClientSender
-from src.client.client_screenshot import ClientScreenshot
+from src.client.client_displays import ClientDisplays, parse_monitor_selection, parse_viewport
 from src.client.client_input import ClientInputHandler
 from src.client.client_cursor import ClientCursorTracker
-from src.client.client_constants import CLIENT_ID, CA_FILE
+from src.client.client_constants import (
+    CLIENT_ID, CA_FILE, CMD_BITMAP_CACHE, BITMAP_CACHE_MAX_ENTRIES, CMD_SELECT_MONITOR, CMD_MONITOR_LIST,
+    CMD_WATCHERS, CMD_KEYFRAME, CMD_COLOR_MODE, CMD_VIEWPORT
+)
+from src.common.network.constants import CODEC_JPEG
 
 
 class ClientBackend:
@@ -45,9 +50,14 @@ class ClientBackend:
             cafile=CA_FILE, 
             logger=self.logger
         )
-        self.screenshot = ClientScreenshot(fps=fps, quality=65, max_dimension=1280)
+        self.screenshot = ClientDisplays(fps=fps, quality=65, max_dimension=1280)
         self.sender = ClientSender(self.network)
+        self.screenshot.link_stats = self.sender.get_link_stats
+        self.screenshot.on_cache_ops = self._on_cache_ops
+        self.screenshot.on_copy_rect = self._on_copy_rect
         self.input_handler = ClientInputHandler(logger=self.logger)
+        self.input_handler.set_monitors(self.screenshot.monitor_layout())
+        self.input_handler.on_activity = self.screenshot.notify_input
         self.cursor_tracker = ClientCursorTracker(self.network, fps=30, logger=self.logger)
 
         self.screenshot_thread = None
@@ -165,9 +175,18 @@ class ClientBackend:
             
             time.sleep(2)
 
-    def _on_frame(self, width, height, jpg_bytes, bbox, img, seq, ts_ms):
+    def _on_frame(self, width, height, jpg_bytes, bbox, img, seq, ts_ms, codec=CODEC_JPEG, monitor=0, viewport=None):
         if self.in_session:
-            return self.sender.enqueue_frame(width, height, jpg_bytes, bbox, seq, ts_ms)
+            return self.sender.enqueue_frame(width, height, jpg_bytes, bbox, seq, ts_ms, codec, monitor=monitor,
+                                             viewport=viewport)
+
+    def _on_copy_rect(self, width, height, src, dst, seq, monitor=0):
+        if self.in_session:
+            return self.sender.enqueue_copy_rect(width, height, src, dst, seq, monitor=monitor)
+
+    def _on_cache_ops(self, width, height, tile_size, ops, seq, monitor=0):
+        if self.in_session:
+            return self.sender.enqueue_cache_ops(width, height, tile_size, ops, seq, monitor=monitor)
 
     def _on_control_pdu(self, pdu: dict):
         msg = pdu.get("message", "")
@@ -178,6 +197,8 @@ class ClientBackend:
             self.logger(f"[ClientBackend] ==> Manager {manager_id} đã kết nối! Bắt đầu gửi video.")
             self.in_session = True
             self.screenshot.force_full_frame()
+            self.cursor_tracker.reset_shapes()
+            self.network.send_control_pdu(CMD_MONITOR_LIST + json.dumps(self.screenshot.monitor_layout()))
             
         elif msg == "session_ended":
             self.logger("[ClientBackend] Session ended")
@@ -185,7 +206,44 @@ class ClientBackend:
             
         elif msg == "request_refresh":
             if self.in_session:
-                self.screenshot.force_full_frame()
+                self.screenshot.request_keyframe()
+                self.cursor_tracker.reset_shapes()
+
+        elif msg.startswith(CMD_KEYFRAME):
+            target = msg[len(CMD_KEYFRAME):].strip()
+            self.screenshot.request_keyframe(int(target) if target.isdigit() else None)
+            if not target.isdigit():
+                # Viewer mới: chưa có cache hình dạng con trỏ
+                self.cursor_tracker.reset_shapes()
+
+        elif msg.startswith(CMD_COLOR_MODE):
+            self.screenshot.set_color_mode(msg[len(CMD_COLOR_MODE):].strip())
+
+        elif msg.startswith(CMD_BITMAP_CACHE):
+            try:
+                entries = int(msg.split(":", 1)[1])
+            except (IndexError, ValueError):
+                entries = 0
+            self.screenshot.set_bitmap_cache(min(entries, BITMAP_CACHE_MAX_ENTRIES))
+
+        elif msg.startswith(CMD_SELECT_MONITOR):
+            try:
+                ids = parse_monitor_selection(msg[len(CMD_SELECT_MONITOR):])
+            except ValueError:
+                ids = [0]
+            self.screenshot.set_watched(ids)
+
+        elif msg.startswith(CMD_VIEWPORT):
+            try:
+                self.screenshot.set_viewport(*parse_viewport(msg[len(CMD_VIEWPORT):]))
+            except ValueError:
+                pass
+
+        elif msg.startswith(CMD_WATCHERS):
+            # Không ai xem -> tạm dừng chụp / gửi, có người xem lại -> bắt đầu bằng FULL frame
+            paused = msg[len(CMD_WATCHERS):].strip() == "0"
+            self.screenshot.set_paused(paused)
+            self.cursor_tracker.paused = paused
         
     def _on_disconnected(self):
         self.logger("[ClientBackend] _on_disconnected được gọi.")
@@ -0,0 +1,79 @@
+# client/client_bitmap_cache.py
+
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from src.client.client_capture import CapturedFrame
+
+Rect = Tuple[int, int, int, int]
+
+
+def tile_key(frame: CapturedFrame, rect: Rect) -> bytes:
+    """Hash nội dung một ô (kèm kích thước, để ô ở mép màn hình không trùng ô đầy đủ)."""
+    l, u, r, b = rect
+    arr = frame.array
+    data = arr[u:b, l:r].tobytes() if arr is not None else frame.to_image(rect).tobytes()
+    h = hashlib.blake2b(data, digest_size=16)
+    h.update(f"{r - l}x{b - u}".encode())
+    return h.digest()
+
+
+def frame_tile_keys(frame: CapturedFrame, boxes, tile_size: int) -> Dict[Rect, bytes]:
+    """Hash tất cả các ô lưới (tile_size) nằm trong các vùng boxes (đã căn theo lưới)."""
+    width, height = frame.size
+    keys: Dict[Rect, bytes] = {}
+    for l, u, r, b in boxes:
+        for y in range(u, b, tile_size):
+            for x in range(l, r, tile_size):
+                tile = (x, y, min(x + tile_size, width), min(y + tile_size, height))
+                if tile not in keys:
+                    keys[tile] = tile_key(frame, tile)
+    return keys
+
+
+class BitmapCache:
+    """
+    Bộ nhớ đệm ô ảnh phía client (giống bitmap cache của RDP).
+    Client giữ LRU: hash ô -> slot. Manager giữ bảng slot -> ô ảnh đã giải mã.
+    Client quyết định hoàn toàn việc thay thế (slot nào bị ghi đè) và gửi số slot trong
+    CACHE PDU, nên hai bên luôn nhất quán miễn là cùng dung lượng (được thương lượng qua server)
+    và manager nhận các CACHE PDU theo đúng thứ tự trên kênh video.
+    """
+
+    def __init__(self, capacity: int = 0):
+        self.capacity = max(0, int(capacity))
+        self._lru: "OrderedDict[bytes, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def reset(self, capacity: Optional[int] = None) -> None:
+        if capacity is not None:
+            self.capacity = max(0, int(capacity))
+        self._lru.clear()
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._lru
+
+    def lookup(self, key: bytes) -> Optional[int]:
+        """Trả về slot nếu manager đang giữ ô này (và đánh dấu vừa dùng)."""
+        slot = self._lru.get(key)
+        if slot is None:
+            self.misses += 1
+            return None
+        self._lru.move_to_end(key)
+        self.hits += 1
+        return slot
+
+    def insert(self, key: bytes) -> int:
+        """Cấp slot cho ô mới: slot trống kế tiếp, hoặc slot của ô ít dùng nhất (LRU)."""
+        if len(self._lru) < self.capacity:
+            slot = len(self._lru)
+        else:
+            _, slot = self._lru.popitem(last=False)
+        self._lru[key] = slot
+        return slot
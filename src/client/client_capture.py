@@ -0,0 +1,220 @@
+# client/client_capture.py
+
+from typing import Dict, List, Optional, Tuple
+from PIL import Image, ImageDraw
+
+try:
+    from mss import mss
+except ImportError:  # Máy không có mss (ví dụ CI headless) -> chỉ dùng được SyntheticCaptureBackend
+    mss = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class CapturedFrame:
+    """
+    Một frame thô từ backend, giữ nguyên buffer gốc (BGRA từ mss) mà không copy.
+    - array: mảng numpy HxWxC xem trực tiếp trên buffer (None nếu không có numpy)
+    - to_image(box): chỉ tạo ảnh PIL cho vùng thực sự cần encode
+    Buffer chỉ hợp lệ tới lần grab() kế tiếp của backend.
+    """
+
+    def __init__(self, raw, width: int, height: int, rawmode: str = "BGRX", bpp: int = 4):
+        self.raw = memoryview(raw)
+        self.width = width
+        self.height = height
+        self.rawmode = rawmode  # "BGRX" (mss) hoặc "RGB" (ảnh PIL đã resize)
+        self.bpp = bpp
+        self.stride = width * bpp
+        self._array = None
+
+    @classmethod
+    def from_image(cls, img: Image.Image) -> "CapturedFrame":
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        w, h = img.size
+        return cls(img.tobytes(), w, h, rawmode="RGB", bpp=3)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def array(self):
+        if self._array is None and np is not None:
+            self._array = np.frombuffer(self.raw, dtype=np.uint8).reshape(self.height, self.width, self.bpp)
+        return self._array
+
+    def to_image(self, box: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        """Tạo ảnh PIL (RGB, có sở hữu dữ liệu) cho toàn frame hoặc một vùng (l, u, r, b)."""
+        if box is None:
+            box = (0, 0, self.width, self.height)
+        l, u, r, b = box
+        # Đọc vùng trực tiếp từ buffer với stride của cả frame (không cắt ảnh lớn)
+        start = u * self.stride + l * self.bpp
+        end = (b - 1) * self.stride + r * self.bpp
+        return Image.frombytes("RGB", (r - l, b - u), self.raw[start:end], "raw", self.rawmode, self.stride, 1)
+
+    def crop(self, box: Tuple[int, int, int, int]) -> "CapturedFrame":
+        """Frame mới (buffer liền, có sở hữu) cho một vùng (l, u, r, b); backend chụp được vùng thì không cần."""
+        l, u, r, b = box
+        row = (r - l) * self.bpp
+        raw = b"".join(self.raw[y * self.stride + l * self.bpp:y * self.stride + l * self.bpp + row]
+                       for y in range(u, b))
+        return CapturedFrame(raw, r - l, b - u, rawmode=self.rawmode, bpp=self.bpp)
+
+
+# Màn hình dùng khi không liệt kê được (capture vẫn thử chụp mss monitors[1] trong vòng lặp)
+DEFAULT_MONITOR = {"id": 0, "left": 0, "top": 0, "width": 1920, "height": 1080}
+
+
+def list_monitors() -> List[Dict[str, int]]:
+    """
+    Liệt kê các màn hình vật lý: [{"id", "left", "top", "width", "height"}].
+    id 0 = mss monitors[1] (màn hình chính); tọa độ theo desktop ảo (có thể âm).
+    Không liệt kê được (thiếu mss, lỗi mss, không có màn hình) -> một màn hình mặc định.
+    """
+    if mss is None:
+        return [dict(DEFAULT_MONITOR)]
+    try:
+        with mss() as sct:
+            # monitors[0] là desktop ảo bao tất cả màn hình -> bỏ qua
+            monitors = [{"id": i, "left": m["left"], "top": m["top"], "width": m["width"], "height": m["height"]}
+                        for i, m in enumerate(sct.monitors[1:])]
+    except Exception as e:
+        print(f"[Capture] Không liệt kê được màn hình ({e}), dùng màn hình mặc định")
+        monitors = []
+    return monitors or [dict(DEFAULT_MONITOR)]
+
+
+class CaptureBackend:
+    """Giao diện chung cho các nguồn chụp màn hình."""
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def native_size(self) -> Optional[Tuple[int, int]]:
+        """Kích thước màn hình nguồn (None = chưa biết, lấy từ frame đầy đủ gần nhất)."""
+        return None
+
+    def grab(self, region: Optional[Tuple[int, int, int, int]] = None) -> CapturedFrame:
+        """Chụp cả màn hình, hoặc chỉ vùng (l, u, r, b) theo tọa độ màn hình (viewport của manager)."""
+        raise NotImplementedError
+
+
+class MSSCaptureBackend(CaptureBackend):
+    """
+    Giữ một phiên mss() lâu dài thay vì mở/đóng context cho mỗi frame.
+    mss không an toàn đa luồng nên phiên được mở lười (lazy) trong luồng gọi grab() đầu tiên.
+    """
+
+    def __init__(self, monitor_index: int = 1):
+        self.monitor_index = monitor_index # Thường là monitors[1] trên Windows/mss
+        self._sct = None
+
+    def open(self) -> None:
+        if self._sct is None:
+            if mss is None:
+                raise RuntimeError("mss chưa được cài đặt")
+            self._sct = mss()
+
+    def close(self) -> None:
+        if self._sct is not None:
+            try:
+                self._sct.close()
+            except Exception:
+                pass
+            self._sct = None
+
+    def native_size(self) -> Optional[Tuple[int, int]]:
+        self.open()
+        monitor = self._sct.monitors[self.monitor_index]
+        return monitor["width"], monitor["height"]
+
+    def grab(self, region: Optional[Tuple[int, int, int, int]] = None) -> CapturedFrame:
+        self.open()
+        monitor = self._sct.monitors[self.monitor_index]
+        if region is not None:
+            # Chụp thẳng vùng viewport (BitBlt nhỏ hơn), không chụp cả màn hình rồi cắt
+            l, u, r, b = region
+            monitor = {"left": monitor["left"] + l, "top": monitor["top"] + u, "width": r - l, "height": b - u}
+        sct_img = self._sct.grab(monitor)
+        # sct_img.raw là bytearray BGRA; dùng trực tiếp, không gọi .bgra (tạo bản copy)
+        return CapturedFrame(sct_img.raw, sct_img.width, sct_img.height)
+
+
+class SyntheticCaptureBackend(CaptureBackend):
+    """
+    Framebuffer giả lập để benchmark pipeline headless (Linux CI, không có màn hình).
+    Mỗi frame: nền "desktop" tĩnh + đồng hồ nhấp nháy ở góc phải dưới + ô "con trỏ" di chuyển.
+    Buffer đầu ra được tái sử dụng giữa các lần grab.
+    """
+
+    def __init__(self, width: int = 1920, height: int = 1080, cursor_size: int = 24):
+        self.width = width
+        self.height = height
+        self.cursor_size = cursor_size
+        self.frame_index = 0
+
+        self._base = self._render_desktop(width, height).tobytes("raw", "BGRX")
+        self._buffer = bytearray(self._base)
+
+    @staticmethod
+    def _render_desktop(width: int, height: int) -> Image.Image:
+        img = Image.new("RGB", (width, height), (32, 44, 64))
+        draw = ImageDraw.Draw(img)
+        # Một "cửa sổ" với các dòng giống văn bản
+        draw.rectangle((width // 8, height // 8, width * 7 // 8, height * 7 // 8), fill=(250, 250, 250))
+        for i, y in enumerate(range(height // 8 + 20, height * 7 // 8 - 20, 18)):
+            line_w = (width * 3 // 4 - 40) * (3 + (i * 7) % 5) // 8
+            draw.rectangle((width // 8 + 20, y, width // 8 + 20 + line_w, y + 8), fill=(40, 40, 40))
+        # Thanh taskbar
+        draw.rectangle((0, height - 40, width, height), fill=(20, 20, 20))
+        return img
+
+    def _fill_rect(self, l: int, u: int, r: int, b: int, bgrx: bytes) -> None:
+        stride = self.width * 4
+        row = bgrx * (r - l)
+        for y in range(u, b):
+            start = y * stride + l * 4
+            self._buffer[start:start + len(row)] = row
+
+    def _restore_rect(self, l: int, u: int, r: int, b: int) -> None:
+        stride = self.width * 4
+        for y in range(u, b):
+            start = y * stride + l * 4
+            end = start + (r - l) * 4
+            self._buffer[start:end] = self._base[start:end]
+
+    def _cursor_box(self, index: int) -> Tuple[int, int, int, int]:
+        span_x = max(1, self.width - self.cursor_size)
+        span_y = max(1, self.height - self.cursor_size)
+        x = (index * 37) % span_x
+        y = (index * 23) % span_y
+        return x, y, x + self.cursor_size, y + self.cursor_size
+
+    def native_size(self) -> Optional[Tuple[int, int]]:
+        return self.width, self.height
+
+    def grab(self, region: Optional[Tuple[int, int, int, int]] = None) -> CapturedFrame:
+        i = self.frame_index
+        self.frame_index += 1
+
+        # Xóa con trỏ ở vị trí cũ (khôi phục nền) rồi vẽ ở vị trí mới
+        if i > 0:
+            self._restore_rect(*self._cursor_box(i - 1))
+        self._fill_rect(*self._cursor_box(i), b"\x00\x00\x00\xff")
+
+        # Đồng hồ: đổi màu mỗi frame ở góc taskbar
+        shade = (i * 40) % 256
+        clock = (self.width - 100, self.height - 32, self.width - 20, self.height - 8)
+        self._fill_rect(*clock, bytes((shade, shade, 255 - shade, 255)))
+
+        frame = CapturedFrame(self._buffer, self.width, self.height)
+        return frame.crop(region) if region is not None else frame
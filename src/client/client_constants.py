@@ -35,4 +35,16 @@ ALL_CHANNELS = (
 
 # --- Lệnh Gửi đi (Client -> Server) ---
 CMD_REGISTER = f"register:client"
-CMD_DISCONNECT = "disconnect"
\ No newline at end of file
+CMD_DISCONNECT = "disconnect"
+CMD_MONITOR_LIST = "monitors:"  # Bố cục màn hình của client: "monitors:[{"id": 0, "left": 0, ...}, ...]"
+
+# --- Lệnh Nhận về (Server -> Client) ---
+CMD_BITMAP_CACHE = "bitmap_cache:"  # Dung lượng bitmap cache đã thương lượng: "bitmap_cache:2048" (0 = tắt)
+CMD_SELECT_MONITOR = "monitor:"  # Các màn hình manager đang xem: "monitor:0,1" hoặc "monitor:all"
+CMD_KEYFRAME = "keyframe:"  # Viewer cần FULL frame: "keyframe:0" hoặc "keyframe:all" (các yêu cầu gần nhau được gộp)
+CMD_COLOR_MODE = "colormode:"  # Chế độ màu của luồng video: "colormode:full" / "rgb16" / "palette8" / "gray"
+CMD_VIEWPORT = "viewport:"  # Vùng / kích thước manager đang hiển thị: "viewport:0:0.25,0,0.75,0.5:960x540" (0x0 = không giới hạn)
+CMD_WATCHERS = "watchers:"  # Số manager đang xem / điều khiển (0 = không ai xem -> tạm dừng chụp màn hình)
+
+# --- Bitmap cache ---
+BITMAP_CACHE_MAX_ENTRIES = 4096  # Số ô 64x64 tối đa client theo dõi (chỉ giữ hash, không giữ ảnh)
@@ -4,61 +4,116 @@ import threading
 import time
 import pyautogui
 from typing import Optional, Tuple
+from src.client.client_cursor_shape import CursorShapeSource
+
+try:
+    from pynput import mouse as pynput_mouse
+except ImportError:  # Không nghe được sự kiện chuột -> quay về hỏi vị trí định kỳ
+    pynput_mouse = None
 
 class ClientCursorTracker(threading.Thread):
     """
-    Theo dõi vị trí con trỏ chuột và gửi PDU Cursor khi có thay đổi.
+    Theo dõi con trỏ chuột và gửi PDU Cursor khi có thay đổi.
+    - Sự kiện di chuột (pynput) đánh thức luồng; sự kiện dồn dập được gộp về vị trí mới nhất,
+      gửi tối đa fps lần / giây. Chuột đứng yên -> không gửi gì.
+    - Không có pynput / listener lỗi: hỏi vị trí POLL_FPS lần / giây, cũng chỉ gửi khi đổi.
+    Hình dạng con trỏ (I-beam, resize, ...) đi kèm PDU khi đổi: lần đầu gửi ảnh, sau đó chỉ gửi id cache.
     """
-    
-    def __init__(self, network, fps: int = 5, logger=None):  # Giảm từ 15 xuống 5 FPS
+
+    POLL_FPS = 20               # Tần số hỏi vị trí khi không có sự kiện chuột
+    SHAPE_POLL_INTERVAL = 0.25  # Chuột đứng yên vẫn kiểm tra hình dạng (con trỏ bận, ...) theo chu kỳ này
+
+    def __init__(self, network, fps: int = 60, logger=None):
         super().__init__(daemon=True, name="CursorTracker")
         self.network = network
-        self.fps = fps
+        self.fps = fps  # Số PDU vị trí tối đa mỗi giây
         self.logger = logger or print
         self.running = False
-        
+        self.paused = False  # Không manager nào xem -> không gửi vị trí con trỏ
+
         try:
             self.screen_width, self.screen_height = pyautogui.size()
         except Exception:
             self.screen_width, self.screen_height = 1920, 1080
 
-        self.last_norm_pos: Tuple[float, float] = (0.0, 0.0)
+        self.last_pos: Optional[Tuple[int, int]] = None # Vị trí (pixel) đã gửi gần nhất
         self.last_cursor_shape: Optional[bytes] = None # Dữ liệu hình dạng con trỏ (nếu có)
+        self.shapes = CursorShapeSource()
+        self._moved = threading.Event()
+        self._listener = None
+
+    def _on_move(self, x, y):
+        # Luồng listener: chỉ đánh thức, vị trí được đọc lại lúc gửi (sự kiện dồn dập -> gộp)
+        self._moved.set()
+
+    def _start_listener(self) -> bool:
+        if pynput_mouse is None:
+            return False
+        try:
+            self._listener = pynput_mouse.Listener(on_move=self._on_move)
+            self._listener.start()
+            return True
+        except Exception as e:
+            self.logger(f"[CursorTracker] Không nghe được sự kiện chuột ({e}), chuyển sang hỏi định kỳ")
+            self._listener = None
+            return False
 
     def run(self):
         self.running = True
-        interval = 1.0 / self.fps
-        self.logger(f"[CursorTracker] Đã khởi động, FPS: {self.fps}")
-        
+        event_driven = self._start_listener()
+        min_interval = 1.0 / self.fps
+        wait = self.SHAPE_POLL_INTERVAL if event_driven else 1.0 / min(self.fps, self.POLL_FPS)
+        self.logger(f"[CursorTracker] Đã khởi động ({'sự kiện chuột' if event_driven else 'hỏi định kỳ'}), tối đa {self.fps} PDU/s")
+        last_send = 0.0
+
         while self.running:
-            start_time = time.perf_counter()
-            
-            try:
-                # 1. Lấy vị trí chuột
-                x, y = pyautogui.position()
-                
-                # 2. Chuẩn hóa vị trí (0.0 đến 1.0)
-                # Đảm bảo không vượt quá biên 
-                x_norm = max(0.0, min(1.0, x / self.screen_width))
-                y_norm = max(0.0, min(1.0, y / self.screen_height))
-                
-                new_pos = (x_norm, y_norm)
-                
-                # 3. Kiểm tra thay đổi (ví dụ: thay đổi > 1% màn hình)
-                if abs(new_pos[0] - self.last_norm_pos[0]) > 0.01 or \
-                   abs(new_pos[1] - self.last_norm_pos[1]) > 0.01: 
-
-                    # 4. Gửi PDU Cursor (shape_bytes = None)
-                    self.network.send_cursor_pdu(x_norm, y_norm, cursor_shape_bytes=None)
-                    self.last_norm_pos = new_pos
-                    # print(f"[CursorTracker] Gửi vị trí: {x_norm:.2f}, {y_norm:.2f}")  # Bỏ log để giảm spam
+            self._moved.wait(wait)
+            self._moved.clear()
+            if not self.running:
+                break
+            if self.paused:
+                continue
+
+            # Vừa gửi chưa được 1/fps giây -> chờ nốt rồi lấy vị trí mới nhất (các sự kiện trong lúc chờ được gộp)
+            delay = last_send + min_interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+                self._moved.clear()
 
+            try:
+                if self._send_if_changed():
+                    last_send = time.perf_counter()
             except Exception as e:
                 if self.running:
                     self.logger(f"[CursorTracker] Lỗi theo dõi chuột: {e}")
 
-            elapsed = time.perf_counter() - start_time
-            time.sleep(max(0, interval - elapsed))
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _send_if_changed(self) -> bool:
+        # 1. Lấy vị trí chuột và hình dạng (None = không đổi)
+        x, y = pyautogui.position()
+        shape = self.shapes.poll()
+        if not shape and (x, y) == self.last_pos:
+            return False
+
+        # 2. Chuẩn hóa vị trí (0.0 đến 1.0), đảm bảo không vượt quá biên
+        x_norm = max(0.0, min(1.0, x / self.screen_width))
+        y_norm = max(0.0, min(1.0, y / self.screen_height))
+
+        # 3. Gửi PDU Cursor (kênh cursor, không xếp hàng sau frame video)
+        self.network.send_cursor_pdu(x_norm, y_norm, cursor_shape_bytes=shape)
+        self.last_pos = (x, y)
+        if shape:
+            self.last_cursor_shape = shape
+        return True
+
+    def reset_shapes(self):
+        """Manager mới / mất đồng bộ: gửi lại hình dạng hiện tại (kèm ảnh) ở tick kế tiếp."""
+        self.shapes.reset()
+        self._moved.set()
 
     def stop(self):
-        self.running = False
\ No newline at end of file
+        self.running = False
+        self._moved.set()
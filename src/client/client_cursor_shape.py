@@ -0,0 +1,129 @@
+# client/client_cursor_shape.py
+
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+from PIL import Image, ImageChops
+
+from src.common.network.pdu_builder import PDUBuilder
+from src.common.network.constants import (
+    CURSOR_SHAPE_DEFINE, CURSOR_SHAPE_USE, CURSOR_SHAPE_HIDDEN, CURSOR_SHAPE_CACHE_SIZE,
+)
+
+try:
+    import win32api
+    import win32con
+    import win32gui
+    import win32ui
+except ImportError:  # Không phải Windows / thiếu pywin32 -> không gửi hình dạng, manager vẽ mũi tên mặc định
+    win32gui = None
+
+CURSOR_SHOWING = 0x0001
+SM_CXCURSOR, SM_CYCURSOR = 13, 14
+
+# (w, h, hot_x, hot_y, bytes RGBA)
+CursorShape = Tuple[int, int, int, int, bytes]
+
+
+def current_cursor_handle() -> Optional[int]:
+    """Handle của con trỏ hiện tại, 0 = đang ẩn, None = không lấy được."""
+    if win32gui is None:
+        return None
+    flags, handle, _ = win32gui.GetCursorInfo()
+    return int(handle) if flags & CURSOR_SHOWING and handle else 0
+
+
+def render_cursor(handle: int) -> Optional[CursorShape]:
+    """
+    Vẽ con trỏ lên nền đen và nền trắng rồi suy ra kênh alpha từ độ chênh lệch
+    (cách này xử lý được cả con trỏ màu lẫn con trỏ mask đen trắng kiểu cũ).
+    Điểm bị đảo màu (XOR, ví dụ I-beam cổ điển) được vẽ thành màu đen.
+    """
+    if win32gui is None:
+        return None
+    _, hot_x, hot_y, hbm_mask, hbm_color = win32gui.GetIconInfo(handle)
+    for hbm in (hbm_mask, hbm_color):
+        if hbm:
+            win32gui.DeleteObject(hbm)
+    w, h = win32api.GetSystemMetrics(SM_CXCURSOR), win32api.GetSystemMetrics(SM_CYCURSOR)
+
+    screen_dc = win32gui.GetDC(0)
+    src_dc = win32ui.CreateDCFromHandle(screen_dc)
+    mem_dc = src_dc.CreateCompatibleDC()
+    bmp = win32ui.CreateBitmap()
+    try:
+        bmp.CreateCompatibleBitmap(src_dc, w, h)
+        mem_dc.SelectObject(bmp)
+        shots = []
+        for background in (0x000000, 0xFFFFFF):
+            mem_dc.FillSolidRect((0, 0, w, h), background)
+            win32gui.DrawIconEx(mem_dc.GetSafeHdc(), 0, 0, handle, w, h, 0, None, win32con.DI_NORMAL)
+            shots.append(Image.frombuffer("RGB", (w, h), bmp.GetBitmapBits(True), "raw", "BGRX", 0, 1))
+    finally:
+        mem_dc.DeleteDC()
+        src_dc.DeleteDC()
+        win32gui.ReleaseDC(0, screen_dc)
+        win32gui.DeleteObject(bmp.GetHandle())
+
+    on_black, on_white = shots
+    # Điểm trong suốt: trắng - đen = 255 -> alpha 0; điểm đục: bằng nhau -> alpha 255
+    alpha = ImageChops.invert(ImageChops.subtract(on_white, on_black).convert("L"))
+    inverted = ImageChops.subtract(on_black, on_white).convert("L").point(lambda v: 255 if v else 0)
+    color = Image.composite(Image.new("RGB", (w, h)), on_black, inverted)
+    rgba = color.copy()
+    rgba.putalpha(ImageChops.lighter(alpha, inverted))
+    return w, h, min(hot_x, w - 1), min(hot_y, h - 1), rgba.tobytes()
+
+
+class CursorShapeSource:
+    """
+    Theo dõi hình dạng con trỏ và tạo phần shape cho CURSOR PDU.
+    - Chỉ vẽ lại khi handle con trỏ đổi; hình dạng được băm để nhận ra hình đã gửi (kể cả khác handle)
+    - Hình mới: DEFINE kèm ảnh (một lần), hình đã gửi: USE + id 2 byte
+    - id bị thay thế theo LRU; manager ghi đè id đó khi nhận DEFINE mới
+    reset() khi manager có thể chưa có cache (viewer mới / keyframe) -> các hình được gửi lại.
+    """
+
+    def __init__(self, capacity: int = CURSOR_SHAPE_CACHE_SIZE):
+        self.capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()  # digest -> id (cuối = dùng gần nhất)
+        self._rendered = {}        # handle -> (digest, CursorShape)
+        self._last_handle = None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._ids.clear()
+            self._last_handle = None
+
+    def poll(self) -> Optional[bytes]:
+        """Phần shape cho CURSOR PDU nếu hình dạng đổi từ lần gọi trước, ngược lại None."""
+        handle = current_cursor_handle()
+        with self._lock:
+            if handle is None or handle == self._last_handle:
+                return None
+            if handle == 0:
+                self._last_handle = handle
+                return PDUBuilder.build_cursor_shape(CURSOR_SHAPE_HIDDEN, 0)
+
+            entry = self._rendered.get(handle)
+            if entry is None:
+                shape = render_cursor(handle)
+                if shape is None:
+                    return None
+                entry = (hashlib.blake2b(repr(shape[:4]).encode() + shape[4], digest_size=8).digest(), shape)
+                if len(self._rendered) >= 4 * self.capacity:
+                    self._rendered.clear()  # Handle tạo động (con trỏ động / ứng dụng) -> không giữ mãi
+                self._rendered[handle] = entry
+            self._last_handle = handle
+
+            digest, (w, h, hot_x, hot_y, rgba) = entry
+            shape_id = self._ids.get(digest)
+            if shape_id is not None:
+                self._ids.move_to_end(digest)
+                return PDUBuilder.build_cursor_shape(CURSOR_SHAPE_USE, shape_id)
+            shape_id = len(self._ids) if len(self._ids) < self.capacity else self._ids.popitem(last=False)[1]
+            self._ids[digest] = shape_id
+            return PDUBuilder.build_cursor_shape(CURSOR_SHAPE_DEFINE, shape_id, w, h, hot_x, hot_y, zlib.compress(rgba))
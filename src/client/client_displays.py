@@ -0,0 +1,326 @@
+# client/client_displays.py
+
+import threading
+import time
+from src.client.client_capture import MSSCaptureBackend, list_monitors, DEFAULT_MONITOR
+from src.client.client_screenshot import ClientScreenshot
+from src.common.network.constants import MAX_MONITORS
+
+
+def parse_monitor_selection(text):
+    """"0,2" -> [0, 2]; "all" -> None (tất cả màn hình)."""
+    text = text.strip()
+    if text == "all":
+        return None
+    return [int(p) for p in text.split(",") if p.strip().isdigit()]
+
+
+def parse_viewport(text):
+    """
+    "1:0.25,0,0.75,0.5:960x540" -> (1, (0.25, 0.0, 0.75, 0.5), (960, 540)); màn hình "all" -> None.
+    Kích thước 0x0 = không giới hạn (None). ValueError nếu sai định dạng.
+    """
+    monitor, region, size = text.strip().split(":")
+    monitor = None if monitor == "all" else int(monitor)
+    region = tuple(float(v) for v in region.split(","))
+    if len(region) != 4:
+        raise ValueError(f"viewport không hợp lệ: {text}")
+    w, h = (int(v) for v in size.lower().split("x"))
+    return monitor, region, ((w, h) if w > 0 and h > 0 else None)
+
+
+def _fanout(name):
+    # Thuộc tính đặt cho mọi màn hình cùng lúc, đọc từ màn hình chính
+    def getter(self):
+        return getattr(self.streams[self.primary_id], name)
+
+    def setter(self, value):
+        for stream in self.streams.values():
+            setattr(stream, name, value)
+
+    return property(getter, setter)
+
+
+class ClientDisplays:
+    """
+    Chụp nhiều màn hình, mỗi màn hình một luồng độc lập (ClientScreenshot riêng:
+    detector, bitmap cache, rate controller, pipeline encode) với id màn hình gắn vào mọi PDU video.
+    Chỉ các màn hình manager đang xem mới có luồng capture -> màn hình không ai xem không tốn CPU;
+    không manager nào xem (set_paused) thì dừng toàn bộ luồng capture.
+    Giao diện giống ClientScreenshot để Client dùng thay thế trực tiếp.
+    """
+
+    fps = _fanout("fps")
+    quality = _fanout("quality")
+    max_dimension = _fanout("max_dimension")
+    detect_delta = _fanout("detect_delta")
+    detect_moves = _fanout("detect_moves")
+    content_aware = _fanout("content_aware")
+    progressive = _fanout("progressive")
+    on_cache_ops = _fanout("on_cache_ops")
+    on_copy_rect = _fanout("on_copy_rect")
+
+    def __init__(self, fps=0.33, quality=85, max_dimension=1920, target_bitrate=2_000_000,
+                 monitors=None, backend_factory=None, **kwargs):
+        """
+        monitors: Danh sách màn hình (mặc định list_monitors()), mỗi phần tử {"id", "left", "top", "width", "height"}
+        backend_factory: Hàm monitor -> CaptureBackend (mặc định MSSCaptureBackend, Synthetic để benchmark)
+        target_bitrate: Ngân sách bit/s chung, chia đều cho các màn hình đang được xem
+        Các tham số còn lại được chuyển nguyên cho ClientScreenshot của từng màn hình.
+        """
+        self.monitors = (monitors if monitors is not None else list_monitors())[:MAX_MONITORS] \
+            or [dict(DEFAULT_MONITOR)]
+        factory = backend_factory or (lambda m: MSSCaptureBackend(monitor_index=m["id"] + 1))
+        self.streams = {
+            m["id"]: ClientScreenshot(fps=fps, quality=quality, max_dimension=max_dimension,
+                                      target_bitrate=target_bitrate, backend=factory(m),
+                                      monitor_id=m["id"], **kwargs)
+            for m in self.monitors
+        }
+        self.primary_id = self.monitors[0]["id"]
+        self.watched = {self.primary_id}  # Mặc định chỉ màn hình chính (như client cũ)
+        self.paused = False
+
+        # ROI (tọa độ màn hình ảo): cửa sổ đang focus + vùng quanh con trỏ, đổi sang tọa độ từng màn hình
+        self.focus_window = None      # (l, u, r, b) hoặc None = không biết
+        self.cursor_position = None   # callable -> (x, y) hoặc None
+        self.ROI_CURSOR_RADIUS = 128
+        for m in self.monitors:
+            self.streams[m["id"]].roi_provider = self._roi_provider(m)
+
+        self._target_bitrate = target_bitrate
+        self._cache_entries = 0
+        self._link_stats = None
+        self._callback = None
+        self._threads = {}
+        self._pending = set()  # Màn hình chờ luồng cũ thoát hẳn rồi mới chạy lại
+        self._lock = threading.Lock()
+        self._stop = False
+
+    # --- Thuộc tính gộp ---
+    @property
+    def stop(self):
+        return self._stop
+
+    @stop.setter
+    def stop(self, value):
+        self._stop = value
+        if value:
+            for stream in self.streams.values():
+                stream.stop = True
+
+    @property
+    def target_bitrate(self):
+        return self._target_bitrate
+
+    @target_bitrate.setter
+    def target_bitrate(self, bitrate):
+        self._target_bitrate = bitrate
+        self._rebalance()
+
+    @property
+    def link_stats(self):
+        return self._link_stats
+
+    @link_stats.setter
+    def link_stats(self, stats):
+        # Sender dùng chung: mỗi màn hình được tính một phần throughput tương ứng
+        self._link_stats = stats
+        for stream in self.streams.values():
+            stream.rate.link_stats = None if stats is None else self._shared_link_stats
+
+    def _shared_link_stats(self):
+        sent, backlog = self._link_stats()
+        return sent // max(1, len(self.watched)), backlog
+
+    def monitor_layout(self):
+        """Bố cục màn hình gửi cho manager (ghép "tất cả màn hình" và ánh xạ input)."""
+        return [dict(m) for m in self.monitors]
+
+    def force_full_frame(self):
+        for stream in self.streams.values():
+            stream.force_full_frame()
+
+    def request_keyframe(self, monitor=None):
+        """Viewer cần keyframe của một màn hình (None = mọi màn hình đang xem)."""
+        for m_id in list(self.watched) if monitor is None else [monitor]:
+            if m_id in self.streams:
+                self.streams[m_id].request_keyframe()
+
+    def set_fps_range(self, min_fps, max_fps):
+        for stream in self.streams.values():
+            stream.set_fps_range(min_fps, max_fps)
+
+    def notify_input(self):
+        # Input không gắn với màn hình cụ thể (phím) -> tăng tốc mọi màn hình đang xem
+        for m_id in list(self.watched):
+            self.streams[m_id].notify_input()
+
+    def set_focus_window(self, rect):
+        """Cửa sổ đang focus (tọa độ màn hình ảo, None = không biết) -> ưu tiên chất lượng / tần số gửi."""
+        self.focus_window = tuple(rect) if rect else None
+
+    def _roi_provider(self, monitor):
+        def provider():
+            rects = []
+            if self.focus_window is not None:
+                rects.append(self.focus_window)
+            pos = self.cursor_position() if self.cursor_position is not None else None
+            if pos is not None:
+                x, y = pos
+                radius = self.ROI_CURSOR_RADIUS
+                rects.append((x - radius, y - radius, x + radius, y + radius))
+            if not rects:
+                return None  # Chưa có thông tin -> mọi vùng như nhau
+            # Rỗng (ROI ở màn hình khác) -> cả màn hình này là nền
+            left, top = monitor["left"], monitor["top"]
+            return [(l - left, u - top, r - left, b - top) for l, u, r, b in rects
+                    if r > left and l < left + monitor["width"] and b > top and u < top + monitor["height"]]
+        return provider
+
+    @property
+    def color_mode(self):
+        return self.streams[self.primary_id].color_mode
+
+    def set_color_mode(self, mode):
+        """Chế độ màu áp dụng cho mọi màn hình (mỗi màn hình đang xem tự gửi keyframe)."""
+        for stream in self.streams.values():
+            stream.set_color_mode(mode)
+
+    def set_viewport(self, monitor, region=None, size=None):
+        """
+        Viewport của manager (xem parse_viewport). Một màn hình: chỉ chụp vùng region, thu nhỏ vừa size;
+        các màn hình khác về mặc định. "all" (monitor None): ảnh ghép cả desktop ảo hiển thị trong size
+        -> mỗi màn hình được giới hạn theo phần của nó trong khung ghép (không cắt vùng).
+        """
+        if monitor is not None:
+            for m_id, stream in self.streams.items():
+                stream.set_viewport(region, size) if m_id == monitor else stream.set_viewport()
+            return
+        scale = None
+        if size:
+            left = min(m["left"] for m in self.monitors)
+            top = min(m["top"] for m in self.monitors)
+            width = max(m["left"] + m["width"] for m in self.monitors) - left
+            height = max(m["top"] + m["height"] for m in self.monitors) - top
+            scale = min(size[0] / float(width), size[1] / float(height))
+        for m in self.monitors:
+            share = (max(1, int(m["width"] * scale)), max(1, int(m["height"] * scale))) if scale else None
+            self.streams[m["id"]].set_viewport(None, share)
+
+    def set_bitmap_cache(self, capacity):
+        """Dung lượng đã thương lượng là của cả client -> chia đều cho các màn hình đang xem."""
+        self._cache_entries = max(0, int(capacity))
+        self._rebalance(force=True)
+
+    def get_stage_timings(self):
+        return {m_id: self.streams[m_id].get_stage_timings() for m_id in sorted(self.watched)}
+
+    def _rebalance(self, force=False):
+        share = max(1, len(self.watched))
+        for m_id in self.watched:
+            stream = self.streams[m_id]
+            stream.target_bitrate = self._target_bitrate // share
+            capacity = self._cache_entries // share
+            if force or stream._cache_capacity != capacity:
+                stream.set_bitmap_cache(capacity)
+
+    # --- Chọn màn hình ---
+    def set_watched(self, ids=None):
+        """
+        Chọn các màn hình cần chụp (None = tất cả). Id không tồn tại bị bỏ qua,
+        rỗng -> màn hình chính. Màn hình mới được xem bắt đầu bằng FULL frame.
+        """
+        stale = []
+        with self._lock:
+            wanted = set(self.streams) if ids is None else {i for i in ids if i in self.streams}
+            wanted = wanted or {self.primary_id}
+            removed = self.watched - wanted
+            added = wanted - self.watched
+            self.watched = wanted
+            for m_id in removed:
+                self.streams[m_id].stop = True
+            self._rebalance()
+            if self._callback is not None and not self._stop and not self.paused:
+                stale = [self._start_stream(m_id) for m_id in added]
+        self._join_stale(stale)
+        return sorted(wanted)
+
+    def set_paused(self, paused):
+        """
+        Không manager nào xem -> dừng mọi luồng capture / encode (không tốn CPU, không gửi gì).
+        Có người xem trở lại -> chạy lại các màn hình đang chọn, bắt đầu bằng FULL frame.
+        """
+        stale = []
+        with self._lock:
+            if paused == self.paused:
+                return
+            self.paused = paused
+            for m_id in self.watched:
+                if paused:
+                    self.streams[m_id].stop = True
+                elif self._callback is not None and not self._stop:
+                    stale.append(self._start_stream(m_id))
+        self._join_stale(stale)
+
+    def _start_stream(self, m_id):
+        """
+        Chạy luồng capture cho một màn hình (gọi khi đang giữ self._lock).
+        Luồng cũ của màn hình đó vừa được dừng nhưng chưa thoát hẳn -> không chạy thêm vòng
+        thứ hai trên cùng ClientScreenshot, đánh dấu chờ và trả về luồng cũ để caller join
+        sau khi nhả lock; _start_pending() sẽ chạy lại khi luồng cũ đã thoát.
+        """
+        old = self._threads.get(m_id)
+        if old is not None and old.is_alive():
+            self._pending.add(m_id)
+            return old
+        self._pending.discard(m_id)
+        stream = self.streams[m_id]
+        stream.stop = False
+        stream.force_full_frame()
+        t = threading.Thread(target=stream.capture_loop, args=(self._callback,), daemon=True)
+        self._threads[m_id] = t
+        t.start()
+        return None
+
+    def _start_pending(self):
+        """Chạy lại các màn hình đang chờ mà luồng cũ đã thoát (luồng còn sống thì để lần sau)."""
+        with self._lock:
+            if self._callback is None or self._stop or self.paused:
+                return
+            for m_id in list(self._pending):
+                if m_id in self.watched:
+                    self._start_stream(m_id)
+                else:
+                    self._pending.discard(m_id)
+
+    def _join_stale(self, threads):
+        """Chờ các luồng cũ thoát (ngoài lock, không chặn luồng điều khiển khác) rồi chạy lại màn hình chờ."""
+        threads = [t for t in threads if t is not None]
+        for t in threads:
+            t.join(timeout=3.0)
+        if threads:
+            self._start_pending()
+
+    def capture_loop(self, callback):
+        """Chạy các luồng capture của màn hình đang xem cho tới khi stop."""
+        with self._lock:
+            self._callback = callback
+            stale = [self._start_stream(m_id) for m_id in (self.watched if not self.paused else ())]
+        self._join_stale(stale)
+        while not self._stop:
+            time.sleep(0.1)
+            if self._pending:
+                self._start_pending()  # Luồng cũ join quá hạn -> thử lại khi nó đã thoát
+
+        with self._lock:
+            self._callback = None
+            self._pending.clear()
+            for stream in self.streams.values():
+                stream.stop = True
+            threads = list(self._threads.values())
+        for t in threads:
+            t.join(timeout=3.0)
+        with self._lock:
+            # Luồng chưa thoát kịp vẫn được giữ lại để lần chạy sau không khởi động chồng lên nó
+            self._threads = {m_id: t for m_id, t in self._threads.items() if t.is_alive()}
@@ -0,0 +1,65 @@
+# client/client_framerate.py
+
+import math
+import threading
+import time
+from typing import Optional
+
+
+class FrameRateGovernor:
+    """
+    Chọn fps capture theo mức hoạt động thay vì một giá trị cố định:
+    - màn hình thay đổi: tăng nhanh (nhân đôi mỗi tick, vùng thay đổi lớn -> nhảy thẳng lên mức tương ứng)
+    - có input từ manager: lên trần ngay và giữ INPUT_HOLD giây (phản hồi thao tác điều khiển)
+    - màn hình đứng im: giảm dần theo hàm mũ về sàn (chu kỳ bán rã DECAY_HALF_LIFE giây)
+    Sàn / trần được đặt theo chế độ (VIEW / CONTROL); sàn = trần -> fps cố định như trước.
+    """
+
+    RAMP_UP = 2.0            # Hệ số tăng mỗi tick có thay đổi
+    DECAY_HALF_LIFE = 2.0    # Giây để fps (phần trên sàn) giảm một nửa khi đứng im
+    INPUT_HOLD = 3.0         # Giây giữ fps trần sau input cuối cùng
+    FULL_ACTIVITY = 0.05     # Vùng thay đổi >= 5% màn hình (cuộn, video) -> trần ngay
+
+    def __init__(self, min_fps: float = 0.33, max_fps: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.min_fps = self.max_fps = self.fps = 0.0
+        self._last_update = None
+        self._last_input = 0.0
+        self.set_range(min_fps, max_fps)
+
+    def set_range(self, min_fps: float, max_fps: Optional[float] = None) -> None:
+        """Sàn / trần fps của chế độ hiện tại (max_fps None = fps cố định)."""
+        with self._lock:
+            self.min_fps = max(0.01, float(min_fps))
+            self.max_fps = max(self.min_fps, float(max_fps if max_fps is not None else min_fps))
+            self.fps = min(max(self.fps, self.min_fps), self.max_fps)
+
+    @property
+    def fixed(self) -> bool:
+        return self.max_fps <= self.min_fps
+
+    def record_input(self) -> None:
+        """Manager vừa gửi input (chuột / phím)."""
+        with self._lock:
+            self._last_input = time.time()
+            self.fps = self.max_fps
+
+    def record_tick(self, changed_fraction: float) -> float:
+        """
+        Gọi sau mỗi lần capture với tỉ lệ diện tích thay đổi (0 = đứng im, 1 = cả màn hình).
+        Trả về fps cho tick kế tiếp.
+        """
+        now = time.time()
+        with self._lock:
+            dt = now - self._last_update if self._last_update is not None else 0.0
+            self._last_update = now
+            if now - self._last_input < self.INPUT_HOLD:
+                self.fps = self.max_fps
+            elif changed_fraction > 0:
+                level = self.min_fps + (self.max_fps - self.min_fps) * min(1.0, changed_fraction / self.FULL_ACTIVITY)
+                self.fps = max(level, self.fps * self.RAMP_UP)
+            elif dt > 0:
+                excess = self.fps - self.min_fps
+                self.fps = self.min_fps + excess * math.pow(0.5, dt / self.DECAY_HALF_LIFE)
+            self.fps = min(max(self.fps, self.min_fps), self.max_fps)
+            return self.fps
@@ -25,6 +25,31 @@ class ClientInputHandler:
         # Track last mouse position để debug
         self.last_mouse_x = 0
         self.last_mouse_y = 0
+        # Bố cục màn hình [{"id", "left", "top", "width", "height"}] (None = chỉ màn hình chính)
+        self.monitors = None
+        # Gọi mỗi khi có input hợp lệ (tăng fps capture trong lúc điều khiển)
+        self.on_activity = None
+
+    def set_monitors(self, monitors):
+        self.monitors = monitors
+
+    def _target_rect(self, ev: dict):
+        """
+        Vùng (left, top, w, h) mà tọa độ chuẩn hóa tham chiếu tới:
+        màn hình manager đang xem, "all" = desktop ảo bao mọi màn hình, mặc định = màn hình chính.
+        """
+        monitor = ev.get("monitor")
+        if self.monitors and monitor == "all":
+            l = min(m["left"] for m in self.monitors)
+            u = min(m["top"] for m in self.monitors)
+            r = max(m["left"] + m["width"] for m in self.monitors)
+            b = max(m["top"] + m["height"] for m in self.monitors)
+            return l, u, r - l, b - u
+        if self.monitors and isinstance(monitor, int):
+            for m in self.monitors:
+                if m["id"] == monitor:
+                    return m["left"], m["top"], m["width"], m["height"]
+        return 0, 0, self.screen_width, self.screen_height
 
     def handle_input_pdu(self, pdu: dict):
         """
@@ -43,6 +68,9 @@ class ClientInputHandler:
         
         print(f"[ClientInputHandler] 🎮 Xử lý input event: {ev.get('type')}")
         
+        if self.on_activity is not None:
+            self.on_activity()
+
         # CRITICAL: Wrap toàn bộ logic trong try-catch để không crash
         try:
             t = ev.get("type")
@@ -58,12 +86,13 @@ class ClientInputHandler:
                     self.logger(f"[InputHandler] ⚠️ Tọa độ không hợp lệ: x={norm_x}, y={norm_y}")
                     return
                 
-                abs_x = int(norm_x * self.screen_width)
-                abs_y = int(norm_y * self.screen_height)
+                left, top, width, height = self._target_rect(ev)
+                abs_x = left + int(norm_x * width)
+                abs_y = top + int(norm_y * height)
                 
                 # [QUAN TRỌNG] Kẹp giá trị để không crash pyautogui
-                abs_x = max(0, min(abs_x, self.screen_width - 1))
-                abs_y = max(0, min(abs_y, self.screen_height - 1))
+                abs_x = max(left, min(abs_x, left + width - 1))
+                abs_y = max(top, min(abs_y, top + height - 1))
                 
                 # Update last position
                 self.last_mouse_x = abs_x
@@ -5,11 +5,11 @@ import socket
 import ssl
 from queue import Queue, Empty
 from time import time
+from src.common.network.constants import FRAMING_V1
 from src.common.network.x224_handshake import X224Handshake, CONFIRM_MAGIC
 from src.common.network.security_layer_tls import create_client_context, client_wrap_socket
 from src.common.network.pdu_builder import PDUBuilder
-from src.common.network.mcs_layer import MCSLite
-from src.common.network.tpkt_layer import TPKTLayer
+from src.common.network.tpkt_layer import TPKTLayer, SegmentWriter
 from src.client.client_network.client_receiver import ClientReceiver
 from src.client.client_constants import (
     CLIENT_ID, CA_FILE, 
@@ -31,6 +31,7 @@ class ClientNetwork:
         self.logger = logger or print
         
         self.client = None # Sẽ là SSLSocket
+        self.framing = FRAMING_V1 # Framing thỏa thuận với server (v2: FULL frame không cần chia fragment)
         self.receiver = None
         self.running = False
         
@@ -40,6 +41,7 @@ class ClientNetwork:
         self.builder = PDUBuilder()
         self.seq = 0
         self.lock = threading.Lock() # Dùng cho self.seq và self.client
+        self._writer = SegmentWriter() # Buffer gửi dùng lại (dùng trong self.lock)
 
         # Callbacks cho lớp Client (UI/Glue)
         self.on_input_pdu = None
@@ -67,13 +69,13 @@ class ClientNetwork:
             raw_sock.connect((self.host, self.port))
 
             # 2. Thực hiện X224 Handshake
-            resp = X224Handshake.client_send_connect(raw_sock, self.client_id, timeout=timeout)
+            resp, self.framing = X224Handshake.client_negotiate(raw_sock, self.client_id, timeout=timeout)
             
             if not (isinstance(resp, bytes) and resp.startswith(CONFIRM_MAGIC)):
                 self.logger(f"[ClientNetwork] Handshake X224 thất bại, resp: {resp}")
                 raw_sock.close()
                 return False
-            self.logger("[ClientNetwork] Handshake X224 thành công.")
+            self.logger(f"[ClientNetwork] Handshake X224 thành công (framing v{self.framing}).")
 
             # 3. Tạo TLS Context
             tls_context = create_client_context(cafile=self.cafile, check_hostname=False)
@@ -108,7 +110,7 @@ class ClientNetwork:
         self.running = True
         
         # Khởi tạo Receiver
-        self.receiver = ClientReceiver(self.client, self.pdu_queue, self._on_receiver_done)
+        self.receiver = ClientReceiver(self.client, self.pdu_queue, self._on_receiver_done, framing=self.framing)
         self.receiver.start()
         
         # Khởi tạo PDU loop
@@ -187,6 +189,10 @@ class ClientNetwork:
     # --- Public API cho ClientSender và Client ---
 
     def send_mcs_pdu(self, channel_id: int, pdu_bytes: bytes):
+        self.send_mcs_segments(channel_id, [pdu_bytes])
+
+    def send_mcs_segments(self, channel_id: int, segments):
+        """Gửi một PDU dạng danh sách đoạn (header, payload memoryview, ...) mà không nối chuỗi trước."""
         # Kiểm tra running flag và socket validity trước khi send
         if not self.running:
             return
@@ -204,8 +210,7 @@ class ClientNetwork:
                 return
         
         try:
-            mcs_frame = MCSLite.build(channel_id, pdu_bytes)
-            tpkt_packet = TPKTLayer.pack(mcs_frame)
+            header = TPKTLayer.frame_header(channel_id, sum(len(seg) for seg in segments), self.framing)
             
             with self.lock:
                 # Check lại lần nữa vì có thể bị disconnect trong lúc build packet
@@ -213,7 +218,9 @@ class ClientNetwork:
                     return
                 
                 totalsent = 0
-                data_to_send = tpkt_packet
+                # SSLSocket không có sendmsg: chép header + các đoạn vào buffer dùng lại đúng một lần,
+                # các lần gửi dở sau đó chỉ cắt view (không copy)
+                data_to_send = self._writer.join([header] + segments)
                 retry_count = 0
                 max_retries = 3
                 
@@ -1,19 +1,13 @@
 # client/client_network/client_receiver.py
 
 import threading
-import struct
 import ssl
 from collections import defaultdict
+from src.common.network.constants import FRAMING_V1
 from src.common.network.mcs_layer import MCSLite
 from src.common.network.pdu_parser import PDUParser
-from src.common.network.tpkt_layer import TPKTLayer
-from src.common.network.constants import (
-    SHARE_CTRL_HDR_FMT, SHARE_HDR_SIZE,
-    FRAGMENT_FLAG, FRAGMENT_HDR_FMT, FRAGMENT_HDR_SIZE,
-    PDU_TYPE_FULL, PDU_TYPE_RECT, PDU_TYPE_CONTROL, PDU_TYPE_INPUT,
-    PDU_TYPE_FILE_START, PDU_TYPE_FILE_CHUNK, PDU_TYPE_FILE_END, 
-    PDU_TYPE_FILE_ACK, PDU_TYPE_FILE_NAK
-)
+from src.common.network.stream_decoder import PDUStreamDecoder
+from src.common.network.tpkt_layer import TPKTReader
 # Thay đổi import
 from src.client.client_constants import ALL_CHANNELS
 
@@ -24,87 +18,22 @@ class ClientReceiver(threading.Thread):
     Đọc TPKT từ SSL socket -> feed vào MCS -> xử lý buffer từng kênh
     -> trích xuất PDU -> đẩy PDU (dict) vào pdu_queue.
     """
-    def __init__(self, ssl_sock, pdu_queue, done_callback):
+    def __init__(self, ssl_sock, pdu_queue, done_callback, framing: int = FRAMING_V1):
         super().__init__(daemon=True, name="ClientReceiver") # Đổi tên thread
         self.sock = ssl_sock
         self.client_id = "server" 
         self.pdu_queue = pdu_queue
         self.done_callback = done_callback
+        self.framing = framing
         
         self.mcs = MCSLite()
         self.parser = PDUParser()
         self.running = True
-        self.channel_buffers = defaultdict(bytearray)
-
-    def _get_pdu_total_length(self, data: bytes) -> int:
-        """
-        Kiểm tra buffer và trả về tổng độ dài của PDU đầu tiên.
-        (Logic giống hệt Server/ManagerReceiver)
-        """
-        if len(data) < SHARE_HDR_SIZE:
-            raise ValueError("Không đủ dữ liệu cho header chung")
-        
-        seq, ts_ms, ptype, flags = struct.unpack_from(SHARE_CTRL_HDR_FMT, data)
-        offset = SHARE_HDR_SIZE
-
-        if (flags & FRAGMENT_FLAG):
-            return len(data)
-
-        try:
-            if ptype == PDU_TYPE_FULL:
-                if len(data) < offset + 12: raise ValueError("Thiếu header FULL")
-                jpg_len = struct.unpack_from(">I", data, offset + 8)[0]
-                return offset + 12 + jpg_len
-            
-            elif ptype == PDU_TYPE_RECT:
-                if len(data) < offset + 28: raise ValueError("Thiếu header RECT")
-                jpg_len = struct.unpack_from(">I", data, offset + 16)[0]
-                return offset + 28 + jpg_len
-            
-            elif ptype == PDU_TYPE_CONTROL or ptype == PDU_TYPE_INPUT:
-                if len(data) < offset + 4: raise ValueError("Thiếu header CONTROL/INPUT")
-                msg_len = struct.unpack_from(">I", data, offset)[0]
-                return offset + 4 + msg_len
-                
-            elif ptype == PDU_TYPE_FILE_START:
-                if len(data) < offset + 2: raise ValueError("Thiếu header FILE_START")
-                fn_len = struct.unpack_from(">H", data, offset)[0]
-                return offset + 2 + fn_len + 16
-                
-            elif ptype == PDU_TYPE_FILE_CHUNK:
-                if len(data) < offset + 12: raise ValueError("Thiếu header FILE_CHUNK")
-                chunk_len = struct.unpack_from(">I", data, offset + 8)[0]
-                return offset + 12 + chunk_len
-                
-            elif ptype == PDU_TYPE_FILE_END:
-                return offset + 4
-                
-            elif ptype == PDU_TYPE_FILE_ACK:
-                return offset + 8
-                
-            elif ptype == PDU_TYPE_FILE_NAK:
-                if len(data) < offset + 12: raise ValueError("Thiếu header FILE_NAK")
-                reason_len = struct.unpack_from(">I", data, offset + 8)[0]
-                return offset + 12 + reason_len
-                
-            else:
-                raise ValueError(f"Loại PDU không xác định: {ptype}")
-                
-        except struct.error:
-            raise ValueError("Không đủ dữ liệu để đọc độ dài PDU")
-
-    def _process_channel_buffer(self, channel_id: int):
-        buf = self.channel_buffers[channel_id]
-        while self.running:
-            if not buf: break
-            try:
-                total_pdu_len = self._get_pdu_total_length(bytes(buf))
-            except ValueError: break 
-            if len(buf) < total_pdu_len: break
-                
-            pdu_bytes = buf[:total_pdu_len]
-            del buf[:total_pdu_len]
+        self.decoders = defaultdict(PDUStreamDecoder)
 
+    def _process_channel_data(self, channel_id: int, data):
+        for pdu_bytes in self.decoders[channel_id].feed(data):
+            if not self.running: break
             try:
                 parsed = self.parser.parse(pdu_bytes)
             except Exception as e:
@@ -117,9 +46,10 @@ class ClientReceiver(threading.Thread):
 
     def run(self):
         try:
+            reader = TPKTReader(self.sock, timeout=600.0, framing=self.framing)
             while self.running:
                 try:
-                    tpkt_body = TPKTLayer.recv_one(self.sock, recv_fn=self.sock.recv, timeout=600.0)
+                    tpkt_body = reader.recv_one()
                 except (TimeoutError, ConnectionError, OSError, ssl.SSLError) as e:
                     if self.running:
                         print(f"[ClientReceiver] Mất kết nối tới Server: {e}")
@@ -131,11 +61,9 @@ class ClientReceiver(threading.Thread):
                     
                 self.mcs.feed(tpkt_body)
 
-                for ch_id in ALL_CHANNELS:
-                    new_data = self.mcs.read_channel(ch_id)
-                    if new_data:
-                        self.channel_buffers[ch_id].extend(new_data)
-                    self._process_channel_buffer(ch_id)
+                for ch_id, new_data in self.mcs.drain():
+                    if ch_id in ALL_CHANNELS:
+                        self._process_channel_data(ch_id, new_data)
 
         except Exception as e:
             if self.running:
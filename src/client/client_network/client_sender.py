@@ -15,7 +15,9 @@ from src.common.network.file_utils import stream_file_in_chunks, crc32_bytes
 from src.common.network.pdu_parser import PDUParser 
 from src.client.client_constants import CHANNEL_VIDEO, CHANNEL_FILE
 # [QUAN TRỌNG] Import các hằng số cần thiết
-from src.common.network.constants import SHARE_HDR_SIZE, FRAGMENT_HDR_SIZE, MAX_TPKT_LENGTH
+from src.common.network.constants import (
+    SHARE_HDR_SIZE, FRAGMENT_HDR_SIZE, MAX_TPKT_LENGTH, CODEC_JPEG, FRAMING_V2, MAX_V2_PDU_SIZE, V1_FRAGMENT_SIZE,
+)
 
 class ClientSender:
     def __init__(self, 
@@ -42,6 +44,9 @@ class ClientSender:
         self.unacked_lock = threading.Lock()
         self.max_unacked_bytes = max_unacked_bytes
 
+        # Tổng byte video đã gửi (RateController dùng để đo throughput thực tế)
+        self.video_bytes_sent = 0
+
         self._running = False
         self._frame_thread = None
         self._resend_thread = None 
@@ -53,13 +58,19 @@ class ClientSender:
             self._seq = (self._seq + 1) & 0xffffffff
             return self._seq
 
-    def enqueue_frame(self, width: int, height: int, jpg_bytes: bytes, bbox=None, seq: Optional[int]=None, ts_ms: Optional[int]=None):
+    def get_link_stats(self):
+        """(tổng byte video đã gửi, số frame đang chờ trong hàng đợi)"""
+        return self.video_bytes_sent, self.frame_q.qsize()
+
+    def enqueue_frame(self, width: int, height: int, jpg_bytes: bytes, bbox=None, seq: Optional[int]=None, ts_ms: Optional[int]=None,
+                      codec: int = CODEC_JPEG, monitor: int = 0, viewport=None):
         if not self._running: return False
         
         if seq is None: seq = self.next_seq()
         if ts_ms is None: ts_ms = int(time.time() * 1000)
         
-        frame_data = (width, height, jpg_bytes, bbox, seq, ts_ms)
+        # Phần tử thứ 2 luôn là id màn hình (mọi loại item) để xóa chọn lọc khi đầy
+        frame_data = ("frame", monitor, width, height, jpg_bytes, bbox, seq, ts_ms, codec, viewport)
 
         try:
             self.frame_q.put_nowait(frame_data)
@@ -67,14 +78,18 @@ class ClientSender:
         except queue.Full:
             # --- [SỬA LẠI ĐOẠN NÀY] ---
             
-            # Nếu frame mới là FULL FRAME (quan trọng): Xóa sạch hàng đợi cũ để nhét nó vào
+            # Nếu frame mới là FULL FRAME (quan trọng): Xóa hàng đợi cũ CỦA CÙNG MÀN HÌNH để nhét nó vào
             if bbox is None:
                 # print(f"Queue đầy. Xóa cũ để ưu tiên FULL Frame {seq}")
                 with self.frame_q.mutex:
+                    # Bỏ cả CACHE PDU -> bitmap cache của manager bị lệch, báo False để client gửi keyframe
+                    lost_cache = any(item[0] == "cache" and item[1] == monitor for item in self.frame_q.queue)
+                    kept = [item for item in self.frame_q.queue if item[1] != monitor]
                     self.frame_q.queue.clear()
+                    self.frame_q.queue.extend(kept)
                 try:
                     self.frame_q.put_nowait(frame_data)
-                    return True
+                    return not lost_cache
                 except: return False
             
             # Nếu frame mới là RECT FRAME (ít quan trọng): Hàng đợi đầy thì vứt luôn frame mới
@@ -83,6 +98,30 @@ class ClientSender:
                 # print(f"Queue đầy. Bỏ qua Rect Frame {seq}")
                 return False
 
+    def enqueue_cache_ops(self, width: int, height: int, tile_size: int, ops, seq: Optional[int] = None,
+                          monitor: int = 0):
+        """
+        Xếp CACHE PDU vào cùng hàng đợi với frame (giữ thứ tự: các vùng của frame rồi mới tới op cache).
+        Không bao giờ bỏ âm thầm: hàng đợi đầy -> False để client gửi lại keyframe.
+        """
+        if not self._running: return False
+        if seq is None: seq = self.next_seq()
+        try:
+            self.frame_q.put_nowait(("cache", monitor, width, height, tile_size, ops, seq))
+            return True
+        except queue.Full:
+            return False
+
+    def enqueue_copy_rect(self, width: int, height: int, src, dst, seq: Optional[int] = None, monitor: int = 0):
+        """Xếp copy-rect (cuộn / kéo) vào hàng đợi frame; đầy -> False để client gửi lại keyframe."""
+        if not self._running: return False
+        if seq is None: seq = self.next_seq()
+        try:
+            self.frame_q.put_nowait(("copy", monitor, width, height, src, dst, seq))
+            return True
+        except queue.Full:
+            return False
+
     def start(self):
         if self._running:
             return
@@ -109,37 +148,53 @@ class ClientSender:
         # TPKT Overhead = 4 bytes. MCS Header = 4 bytes. Tổng Header = 8 bytes.
         # PDU tối đa (Max MCS payload) = MAX_TPKT_LENGTH - 4 (TPKT Header) - 4 (MCS Header) = 65527
         MAX_FRAGMENT_SIZE = MAX_TPKT_LENGTH - 8 
-        MAX_BODY_SIZE_PER_FRAGMENT = 64000
+        MAX_BODY_SIZE_PER_FRAGMENT = V1_FRAGMENT_SIZE
         
         while self._running:
             try:
-                width, height, jpg, bbox, seq, ts_ms = self.frame_q.get(timeout=0.1) 
+                item = self.frame_q.get(timeout=0.1) 
             except queue.Empty:
                 continue
             
             try:
                 # 1. Tạo PDU (Luôn là FULL Frame theo logic mới)
-                if bbox:
-                    # Logic này có thể không bao giờ chạy nếu bbox luôn None
-                    l, u, r, b = bbox
-                    w, h = r - l, b - u
-                    pdu = PDUBuilder.build_rect_frame_pdu(seq, jpg, l, u, w, h, width, height, flags=0)
+                # PDU video giữ dạng danh sách đoạn [header, payload memoryview, ...]: payload không bị nối / copy
+                if item[0] == "cache":
+                    _, monitor, width, height, tile_size, ops, seq = item
+                    segments = [PDUBuilder.build_cache_pdu(seq, width, height, tile_size, ops, monitor=monitor)]
+                elif item[0] == "copy":
+                    _, monitor, width, height, (l, u, r, b), (dst_x, dst_y), seq = item
+                    segments = [PDUBuilder.build_copy_rect_pdu(seq, l, u, r - l, b - u, dst_x, dst_y, width, height,
+                                                               monitor=monitor)]
                 else:
-                    pdu = PDUBuilder.build_full_frame_pdu(seq, jpg, width, height, flags=0)
+                    _, monitor, width, height, jpg, bbox, seq, ts_ms, codec, viewport = item
+                    if bbox:
+                        # Logic này có thể không bao giờ chạy nếu bbox luôn None
+                        l, u, r, b = bbox
+                        w, h = r - l, b - u
+                        segments = PDUBuilder.build_rect_frame_segments(seq, jpg, l, u, w, h, width, height, flags=0,
+                                                                        codec=codec, monitor=monitor)
+                    else:
+                        segments = PDUBuilder.build_full_frame_segments(seq, jpg, width, height, flags=0, codec=codec,
+                                                                        monitor=monitor, viewport=viewport)
+                pdu_len = sum(len(seg) for seg in segments)
 
                 # 2. Gửi (Có phân mảnh)
                 # Nếu PDU lớn hơn kích thước cho phép, phải chia nhỏ
-                if len(pdu) > MAX_BODY_SIZE_PER_FRAGMENT:
-                    fragments = PDUBuilder.fragmentize(pdu, MAX_BODY_SIZE_PER_FRAGMENT)
-                    
-                    for offset, frag_bytes in fragments:
+                # Framing v2 (server hỗ trợ): PDU tới ~16 MB đi nguyên khối, không chia fragment
+                max_body = MAX_V2_PDU_SIZE if self.network.framing == FRAMING_V2 else MAX_BODY_SIZE_PER_FRAGMENT
+                if pdu_len > max_body:
+                    # Sinh từng fragment khi gửi (không dựng sẵn cả danh sách)
+                    for offset, frag_segments in PDUBuilder.iter_fragments(segments, MAX_BODY_SIZE_PER_FRAGMENT):
                         if not self._running: break
-                        self.network.send_mcs_pdu(self.channel_screen, frag_bytes)
+                        self.network.send_mcs_segments(self.channel_screen, frag_segments)
+                        self.video_bytes_sent += sum(len(seg) for seg in frag_segments)
                         # Sleep cực ngắn để tránh nghẽn socket buffer
                         time.sleep(0.001)
                 else:
                     # Gửi nguyên cục
-                    self.network.send_mcs_pdu(self.channel_screen, pdu)
+                    self.network.send_mcs_segments(self.channel_screen, segments)
+                    self.video_bytes_sent += pdu_len
                         
             except Exception as e:
                 print(f"[ClientSender] Lỗi gửi frame: {e}")
@@ -0,0 +1,97 @@
+# client/client_pipeline.py
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+
+class LatestWinsQueue:
+    """
+    Hàng đợi có giới hạn giữa các stage của pipeline.
+    Khi đầy, phần tử cũ nhất bị thay thế thay vì chặn stage phía trước:
+    - merge(old, new) -> phần tử thay thế (ví dụ gộp dirty rect của frame bị bỏ vào frame mới)
+    - không có merge -> bỏ hẳn phần tử cũ
+    """
+
+    def __init__(self, maxsize: int = 1, merge: Optional[Callable[[Any, Any], Any]] = None):
+        self.maxsize = max(1, int(maxsize))
+        self.merge = merge
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item) -> None:
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                old = self._items.popleft()
+                self.dropped += 1
+                if self.merge is not None:
+                    item = self.merge(old, item)
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None):
+        """Trả về phần tử kế tiếp, hoặc None nếu hết thời gian chờ / queue đã đóng."""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if self._items:
+                return self._items.popleft()
+            return None
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+
+class StageTimings:
+    """Thời gian xử lý theo từng stage (ms): lần gần nhất, trung bình trượt (EMA) và lớn nhất."""
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        ms = seconds * 1000.0
+        with self._lock:
+            st = self._stats.get(stage)
+            if st is None:
+                self._stats[stage] = {"last_ms": ms, "avg_ms": ms, "max_ms": ms, "count": 1}
+                return
+            st["last_ms"] = ms
+            st["avg_ms"] += self.alpha * (ms - st["avg_ms"])
+            st["max_ms"] = max(st["max_ms"], ms)
+            st["count"] += 1
+
+    def measure(self, stage: str):
+        return _StageTimer(self, stage)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    def format(self) -> str:
+        snap = self.snapshot()
+        return " | ".join(f"{k}={v['avg_ms']:.1f}ms (max {v['max_ms']:.1f})" for k, v in snap.items())
+
+
+class _StageTimer:
+    def __init__(self, timings: StageTimings, stage: str):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.record(self.stage, time.perf_counter() - self._start)
+        return False
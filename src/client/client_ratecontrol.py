@@ -0,0 +1,135 @@
+# client/client_ratecontrol.py
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional, Tuple
+
+
+class RateController:
+    """
+    Điều khiển bitrate cho luồng video: chọn chất lượng JPEG và tỉ lệ thu nhỏ
+    cho frame KẾ TIẾP dựa trên kích thước các frame gần đây và throughput thực tế
+    của sender, thay vì encode lại frame hiện tại khi nó quá lớn.
+    - Vượt ngân sách: giảm quality trước, chạm sàn mới giảm scale (scale đổi -> FULL frame).
+    - Dư ngân sách: khôi phục scale trước, sau đó tăng dần quality.
+    """
+
+    # Các bước quality tính trên mỗi cửa sổ đo (chia nhỏ theo thời gian giữa 2 frame)
+    QUALITY_GAIN = 15.0          # Số điểm quality cho mỗi e-lần sai lệch bitrate
+    MAX_QUALITY_DOWN = 20        # Bước giảm tối đa
+    MAX_QUALITY_UP = 8           # Tăng chậm hơn giảm để tránh dao động
+    DEADBAND = math.log(1.15)    # Sai lệch < 15% -> giữ nguyên
+    OVERSHOOT = math.log(2.0)    # Vượt gấp đôi ngân sách -> giảm scale ngay, không chờ quality chạm sàn
+    SCALE_STEP = 0.75
+    SCALE_COOLDOWN = 3.0         # Đổi scale tốn một FULL frame -> không đổi quá thường xuyên
+    BACKLOG_FRAMES = 5           # Hàng đợi sender dài hơn mức này = đường truyền không theo kịp
+
+    def __init__(self, target_bitrate: int = 2_000_000, min_quality: int = 35, max_quality: int = 85,
+                 min_scale: float = 0.5, window: float = 2.0):
+        """
+        target_bitrate: Ngân sách bit/s cho phiên hiện tại
+        min_quality / max_quality: Khoảng quality JPEG được phép
+        min_scale: Tỉ lệ thu nhỏ thấp nhất so với max_dimension
+        window: Cửa sổ (giây) để đo bitrate thực tế
+        """
+        self.target_bitrate = target_bitrate
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_scale = min_scale
+        self.window = window
+
+        self.quality = float(max_quality)
+        self.scale = 1.0
+        # Hàm trả về (tổng byte sender đã gửi, số frame đang chờ gửi); None = không đo
+        self.link_stats: Optional[Callable[[], Tuple[int, int]]] = None
+
+        self._samples = deque()  # (ts, nbytes) của các frame đã encode
+        self._lock = threading.Lock()
+        self._last_scale_change = 0.0
+        self._last_update = None
+        self._measure_since = time.time()  # Mốc bắt đầu đo (đặt lại khi đổi scale)
+        self._link_prev = None   # (ts, bytes_sent)
+        self.link_bps = None     # Throughput đo được của sender (EMA)
+
+    def set_target_bitrate(self, bitrate: int) -> None:
+        with self._lock:
+            self.target_bitrate = max(64_000, int(bitrate))
+
+    def record_frame(self, nbytes: int) -> None:
+        """Gọi sau mỗi frame đã encode xong (tổng byte của mọi vùng trong frame)."""
+        with self._lock:
+            self._samples.append((time.time(), nbytes))
+
+    def _measure_link(self, now: float):
+        if self.link_stats is None:
+            return None
+        try:
+            sent, backlog = self.link_stats()
+        except Exception:
+            return None
+        if self._link_prev is not None:
+            dt = now - self._link_prev[0]
+            if dt > 0:
+                bps = (sent - self._link_prev[1]) * 8 / dt
+                self.link_bps = bps if self.link_bps is None else self.link_bps + 0.3 * (bps - self.link_bps)
+        self._link_prev = (now, sent)
+        return backlog
+
+    def update(self, fps: float, max_quality: Optional[int] = None) -> Tuple[int, float]:
+        """Tính (quality, scale) cho frame kế tiếp. Gọi một lần mỗi frame ở stage capture."""
+        now = time.time()
+        with self._lock:
+            if max_quality is not None:
+                self.max_quality = max_quality
+            ceiling = max(self.min_quality, self.max_quality)
+
+            # Cửa sổ đo phải chứa vài frame kể cả khi fps thấp (0.33 fps ở chế độ VIEW)
+            window = max(self.window, 3.0 / max(fps, 0.01))
+            while self._samples and self._samples[0][0] < now - window:
+                self._samples.popleft()
+
+            budget = self.target_bitrate
+            backlog = self._measure_link(now)
+            if backlog is not None and backlog > self.BACKLOG_FRAMES and self.link_bps:
+                # Sender đang tồn frame: ngân sách thực tế là throughput đạt được
+                budget = min(budget, 0.9 * self.link_bps)
+
+            # Khoảng đo thực tế: ngắn hơn cửa sổ ngay sau khi khởi động / đổi scale
+            span = max(now - max(now - window, self._measure_since), 1.0 / max(fps, 0.01))
+            produced = sum(n for _, n in self._samples) * 8 / span
+
+            # Điều chỉnh theo thời gian (không theo số frame) để fps cao không làm dao động
+            dt = now - self._last_update if self._last_update is not None else 0.0
+            self._last_update = now
+            if produced > 0 and dt > 0:
+                err = math.log(budget / produced)
+                if abs(err) > self.DEADBAND:
+                    self._adjust(err, ceiling, now, min(1.0, dt / window))
+
+            self.quality = min(max(self.quality, self.min_quality), ceiling)
+            return int(round(self.quality)), self.scale
+
+    def _adjust(self, err: float, ceiling: int, now: float, gain: float) -> None:
+        can_rescale = now - self._last_scale_change >= self.SCALE_COOLDOWN
+
+        if err < 0:
+            # Với nội dung văn bản, quality ảnh hưởng ít tới kích thước; số pixel mới là chính
+            heavy = err < -self.OVERSHOOT
+            if self.quality > self.min_quality:
+                self.quality += max(self.QUALITY_GAIN * err, -self.MAX_QUALITY_DOWN) * gain
+            if (heavy or self.quality <= self.min_quality) and self.scale > self.min_scale and can_rescale:
+                self._set_scale(max(self.min_scale, self.scale * self.SCALE_STEP), now)
+        else:
+            if self.scale < 1.0 and can_rescale and self.quality >= ceiling:
+                self._set_scale(min(1.0, self.scale / self.SCALE_STEP), now)
+            else:
+                self.quality += min(self.QUALITY_GAIN * err, self.MAX_QUALITY_UP) * gain
+
+    def _set_scale(self, scale: float, now: float) -> None:
+        self.scale = scale
+        self._last_scale_change = now
+        # Kích thước frame thay đổi hẳn -> số liệu cũ không còn đúng
+        self._samples.clear()
+        self._measure_since = now
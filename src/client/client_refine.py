@@ -0,0 +1,95 @@
+# client/client_refine.py
+
+import threading
+from typing import Iterable, List, Tuple
+from src.client.client_regions import merge_dirty_tiles
+
+Rect = Tuple[int, int, int, int]
+
+
+class RefinementTracker:
+    """
+    Progressive refinement: ghi nhận các ô đã gửi ở chất lượng thấp (chế độ tương tác)
+    và trả lại chúng khi đã đứng yên đủ N frame để gửi bản nét.
+    Tọa độ là tọa độ đã thu nhỏ (tọa độ manager nhận được), ô theo lưới tile_size của frame.
+    Luồng capture gọi mark / shift / take_ready, luồng gửi gọi confirm -> có lock.
+    """
+
+    def __init__(self):
+        self.size = (0, 0)
+        self.tile_size = 64
+        self.frame_no = 0
+        self._pending = {}  # (cột, hàng) -> số frame lần cuối ô được gửi ở chất lượng thấp
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def tick(self) -> int:
+        """Sang frame mới (gọi mỗi lần capture). Trả về số thứ tự frame."""
+        self.frame_no += 1
+        return self.frame_no
+
+    def reset(self, size: Tuple[int, int], tile_size: int) -> None:
+        """FULL frame: mọi ô đều được gửi lại, lưới có thể đổi kích thước."""
+        with self._lock:
+            self.size = size
+            self.tile_size = max(1, tile_size)
+            self._pending.clear()
+
+    def _tiles(self, rect: Rect) -> Iterable[Tuple[int, int]]:
+        l, u, r, b = rect
+        ts = self.tile_size
+        for ty in range(u // ts, -(-b // ts)):
+            for tx in range(l // ts, -(-r // ts)):
+                yield tx, ty
+
+    def mark(self, rects: Iterable[Rect], lossy: bool = True) -> None:
+        """Các vùng vừa được gửi lại: chất lượng thấp -> chờ refine, ngược lại -> đã nét."""
+        with self._lock:
+            for rect in rects:
+                for tile in self._tiles(rect):
+                    if lossy:
+                        self._pending[tile] = self.frame_no
+                    else:
+                        self._pending.pop(tile, None)
+
+    def shift(self, src: Rect, dst: Tuple[int, int]) -> None:
+        """Copy-rect: nội dung chưa nét ở vùng nguồn được chép sang vùng đích."""
+        with self._lock:
+            if not any(tile in self._pending for tile in self._tiles(src)):
+                return
+            w, h = src[2] - src[0], src[3] - src[1]
+            for tile in self._tiles((dst[0], dst[1], dst[0] + w, dst[1] + h)):
+                self._pending[tile] = self.frame_no
+
+    def confirm(self, lossless: List[Rect], lossy: List[Rect], frame_no: int) -> None:
+        """
+        Luồng gửi báo các vùng của frame frame_no đã đi bằng codec lossless (PNG / PALETTE):
+        ô không bị gửi lại chất lượng thấp sau frame đó thì không cần refine nữa.
+        Ô chạm vùng JPEG của cùng frame (frame gộp) được giữ lại.
+        """
+        with self._lock:
+            keep = {tile for rect in lossy for tile in self._tiles(rect)}
+            for rect in lossless:
+                for tile in self._tiles(rect):
+                    if tile not in keep and self._pending.get(tile, frame_no + 1) <= frame_no:
+                        del self._pending[tile]
+
+    def take_ready(self, idle_frames: int, max_tiles: int) -> List[Rect]:
+        """Lấy (và bỏ khỏi danh sách chờ) tối đa max_tiles ô đã đứng yên idle_frames frame, gộp thành hình chữ nhật."""
+        with self._lock:
+            ready = sorted((ty, tx) for (tx, ty), f in self._pending.items() if self.frame_no - f >= idle_frames)
+            ready = ready[:max_tiles]
+            for ty, tx in ready:
+                del self._pending[(tx, ty)]
+        if not ready:
+            return []
+
+        ts = self.tile_size
+        width, height = self.size
+        dirty_rows = [[] for _ in range(-(-height // ts))]
+        for ty, tx in ready:
+            dirty_rows[ty].append(tx)
+        return merge_dirty_tiles(dirty_rows, ts, width, height)
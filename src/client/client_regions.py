@@ -0,0 +1,300 @@
+# client/client_regions.py
+
+from typing import List, Optional, Tuple
+from PIL import Image, ImageChops
+
+try:
+    import numpy as np
+except ImportError:  # Không có numpy -> dùng đường xử lý bằng PIL (chậm hơn)
+    np = None
+
+# Hình chữ nhật theo quy ước bbox của PIL: (left, upper, right, lower)
+Rect = Tuple[int, int, int, int]
+
+
+def rect_area(rect: Rect) -> int:
+    l, u, r, b = rect
+    return max(0, r - l) * max(0, b - u)
+
+
+def merge_dirty_tiles(dirty_rows: List[List[int]], tile_size: int, width: int, height: int) -> List[Rect]:
+    """
+    Gộp các ô (tile) thay đổi thành danh sách hình chữ nhật.
+    dirty_rows[r] là danh sách (đã sắp xếp) các cột bị thay đổi ở hàng ô thứ r.
+    - Bước 1: gộp các ô liền nhau trên cùng một hàng thành 1 đoạn (run).
+    - Bước 2: nếu hàng dưới có đoạn trùng khớp cột với hàng trên -> kéo dài hình chữ nhật xuống.
+    """
+    rects: List[Rect] = []
+    open_rects = {}  # (c0, c1) -> hàng bắt đầu r0
+
+    def _close(c0, c1, r0, r1):
+        rects.append((
+            c0 * tile_size,
+            r0 * tile_size,
+            min(c1 * tile_size, width),
+            min(r1 * tile_size, height),
+        ))
+
+    for row, cols in enumerate(dirty_rows):
+        runs = []
+        for c in cols:
+            if runs and runs[-1][1] == c:
+                runs[-1][1] = c + 1
+            else:
+                runs.append([c, c + 1])
+
+        still_open = {}
+        for c0, c1 in runs:
+            key = (c0, c1)
+            still_open[key] = open_rects.pop(key, row)
+
+        # Các hình chữ nhật không được hàng này nối tiếp thì đóng lại
+        for (c0, c1), r0 in open_rects.items():
+            _close(c0, c1, r0, row)
+        open_rects = still_open
+
+    for (c0, c1), r0 in open_rects.items():
+        _close(c0, c1, r0, len(dirty_rows))
+
+    return rects
+
+
+def _longest_run(mask) -> Tuple[int, int]:
+    """Đoạn True liên tục dài nhất trong mảng bool 1 chiều: (start, end), (0, 0) nếu không có."""
+    if not mask.any():
+        return 0, 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    k = int(np.argmax(ends - starts))
+    return int(starts[k]), int(ends[k])
+
+
+def find_row_shift(prev, cur, min_run: int, min_votes: int = 8, max_repeat: int = 16,
+                   candidates: int = 3) -> Optional[Tuple[int, int, int]]:
+    """
+    Tìm độ dịch dọc d sao cho cur[y] == prev[y - d] trên dải hàng liên tục dài nhất (cuộn trang).
+    prev, cur: mảng HxWxC cùng kích thước (truyền mảng đã transpose để tìm dịch ngang).
+    - Bỏ phiếu: mỗi hàng của cur tìm các hàng giống hệt trong prev (theo hash) -> phiếu cho i - j.
+      Hàng lặp lại quá nhiều lần (dòng trống, nền) không cho biết độ dịch nên bị bỏ qua.
+    - Kiểm tra chính xác vài ứng viên nhiều phiếu nhất bằng so sánh mảng.
+    Trả về (d, y0, y1) với [y0, y1) là dải hàng khớp trong cur, hoặc None.
+    """
+    height = cur.shape[0]
+    index = {}
+    for j in range(height):
+        index.setdefault(hash(prev[j].tobytes()), []).append(j)
+
+    votes = {}
+    for i in range(height):
+        rows = index.get(hash(cur[i].tobytes()))
+        if rows is None or len(rows) > max_repeat:
+            continue
+        for j in rows:
+            if i != j:
+                votes[i - j] = votes.get(i - j, 0) + 1
+
+    best = None
+    for d, n in sorted(votes.items(), key=lambda kv: -kv[1])[:candidates]:
+        if n < min_votes:
+            break
+        lo, hi = max(0, d), min(height, height + d)
+        y0, y1 = _longest_run((cur[lo:hi] == prev[lo - d:hi - d]).all(axis=(1, 2)))
+        if y1 - y0 >= min_run and (best is None or y1 - y0 > best[2] - best[1]):
+            best = (d, lo + y0, lo + y1)
+    return best
+
+
+class TileChangeDetector:
+    """
+    Phát hiện thay đổi theo lưới ô (ví dụ 64x64) thay vì một bounding box duy nhất.
+    Một đồng hồ nhấp nháy ở góc này và con trỏ ở góc kia sẽ cho ra 2 vùng nhỏ
+    thay vì gần như toàn màn hình.
+    """
+
+    def __init__(self, tile_size: int = 64, threshold: int = 30, use_numpy: bool = True):
+        self.tile_size = max(8, int(tile_size))
+        self.threshold = threshold
+        self.use_numpy = use_numpy and np is not None
+        # Bảng tra (LUT) cho threshold: rẻ hơn lambda theo từng pixel
+        self._lut = [0] * (threshold + 1) + [255] * (255 - threshold)
+        # Ảnh tham chiếu = ảnh mà manager đang có
+        # (mảng numpy HxWx3 ở chế độ numpy, ảnh PIL thang xám ở chế độ PIL)
+        self._prev = None
+        self._scratch = None  # (hi, lo, mask) dùng lại cho đường numpy
+
+    def _as_array(self, img: Image.Image, frame=None):
+        # frame: mảng HxWxC uint8 liên tục (BGRA từ mss hoặc RGB từ PIL)
+        if frame is None:
+            frame = np.asarray(img)
+        return frame
+
+    def reset(self, img: Image.Image, frame=None) -> None:
+        """Đặt lại ảnh tham chiếu (sau khi gửi FULL frame)."""
+        if self.use_numpy:
+            self._prev = np.array(self._as_array(img, frame), copy=True)
+        else:
+            self._prev = img.convert("L")
+
+    def detect(self, img: Image.Image, frame=None) -> Optional[List[Rect]]:
+        """
+        Trả về:
+        - None nếu chưa có ảnh tham chiếu hoặc kích thước thay đổi (cần FULL frame),
+        - [] nếu màn hình đứng im,
+        - danh sách các dirty rect đã gộp.
+        """
+        if self.use_numpy:
+            return self._detect_array(self._as_array(img, frame))
+
+        gray = img.convert("L")
+        if self._prev is None or self._prev.size != gray.size:
+            self._prev = gray
+            return None
+
+        mask = ImageChops.difference(gray, self._prev).point(self._lut)
+        bbox = mask.getbbox()
+        if bbox is None:
+            return []
+
+        width, height = gray.size
+        ts = self.tile_size
+        rows = (height + ts - 1) // ts
+
+        # Chỉ quét các ô nằm trong bbox tổng
+        c_start, c_end = bbox[0] // ts, (bbox[2] + ts - 1) // ts
+        r_start, r_end = bbox[1] // ts, (bbox[3] + ts - 1) // ts
+
+        dirty_rows: List[List[int]] = [[] for _ in range(rows)]
+        for r in range(r_start, r_end):
+            u = r * ts
+            b = min(u + ts, height)
+            for c in range(c_start, c_end):
+                l = c * ts
+                tile_box = (l, u, min(l + ts, width), b)
+                if mask.crop(tile_box).getbbox() is not None:
+                    dirty_rows[r].append(c)
+
+        rects = merge_dirty_tiles(dirty_rows, ts, width, height)
+
+        # Cập nhật ảnh tham chiếu CHỈ ở các vùng sẽ được gửi đi,
+        # để các thay đổi nhỏ dưới ngưỡng vẫn được cộng dồn cho lần sau.
+        for rect in rects:
+            self._prev.paste(gray.crop(rect), rect[:2])
+
+        return rects
+
+    def detect_move(self, frame, min_size: Optional[int] = None, align: int = 1):
+        """
+        Phát hiện cuộn / kéo: một dải lớn trong vùng thay đổi trùng với ảnh tham chiếu
+        bị dịch theo chiều dọc (hoặc ngang). Khi tìm thấy, ảnh tham chiếu được dịch y như
+        manager sẽ làm với copy-rect, để detect() sau đó chỉ còn phần mới lộ ra.
+        align: độ dịch và biên vùng phải là bội số của align (frame được thu nhỏ k/8 trước khi gửi)
+        Trả về (src_rect, (dst_x, dst_y)) hoặc None. Chỉ có ở đường numpy.
+        """
+        prev = self._prev
+        if not self.use_numpy or prev is None or prev.shape != frame.shape:
+            return None
+        min_run = min_size or 2 * self.tile_size
+
+        # Bbox vùng thay đổi, so sánh trên mảng 2D (H, W*C): nhanh hơn nhiều so với any(axis=2)
+        height, width, channels = frame.shape
+        changed = np.not_equal(frame.reshape(height, width * channels), prev.reshape(height, width * channels))
+        rows = np.flatnonzero(changed.any(axis=1))
+        if rows.size == 0 or rows[-1] + 1 - rows[0] < min_run:
+            return None
+        u, b = int(rows[0]), int(rows[-1]) + 1
+        cols = np.flatnonzero(changed[u:b].any(axis=0).reshape(width, channels).any(axis=1))
+        l, r = int(cols[0]), int(cols[-1]) + 1
+        if r - l < min_run:
+            return None
+
+        cur_box, prev_box = frame[u:b, l:r], prev[u:b, l:r]
+        found = find_row_shift(prev_box, cur_box, min_run)
+        if found is not None:
+            d, y0, y1 = found
+            src, shift = (l, u + y0 - d, r, u + y1 - d), (0, d)
+        else:
+            # Cuộn ngang = cuộn dọc trên ảnh chuyển vị (copy liên tục để hash từng cột cho rẻ)
+            found = find_row_shift(np.ascontiguousarray(prev_box.transpose(1, 0, 2)),
+                                   np.ascontiguousarray(cur_box.transpose(1, 0, 2)), min_run)
+            if found is None:
+                return None
+            d, x0, x1 = found
+            src, shift = (l + x0 - d, u, l + x1 - d, b), (d, 0)
+
+        if align > 1:
+            # Thu hẹp vùng vào trong lưới; phần bị cắt bỏ sẽ thành dirty rect bình thường
+            if d % align:
+                return None
+            sl, su, sr, sb = src
+            src = (-(-sl // align) * align, -(-su // align) * align, sr // align * align, sb // align * align)
+            if src[2] - src[0] < min_run // 2 or src[3] - src[1] < min_run // 2:
+                return None
+
+        sl, su, sr, sb = src
+        dx, dy = sl + shift[0], su + shift[1]
+        prev[dy:dy + sb - su, dx:dx + sr - sl] = prev[su:sb, sl:sr].copy()
+        return src, (dx, dy)
+
+    def _detect_array(self, frame) -> Optional[List[Rect]]:
+        """
+        Đường xử lý vector hóa bằng numpy: so sánh trực tiếp trên buffer,
+        không tạo ảnh PIL trung gian nào.
+        """
+        prev = self._prev
+        if prev is None or prev.shape != frame.shape:
+            self._prev = np.array(frame, copy=True)
+            self._scratch = None
+            return None
+
+        height, width, channels = frame.shape
+        # Gộp các kênh màu vào chiều ngang: (H, W*C). Ô thứ c chiếm các cột [c*ts*C, (c+1)*ts*C)
+        cur2d = frame.reshape(height, width * channels)
+        prev2d = prev.reshape(height, width * channels)
+
+        # Buffer tạm được tái sử dụng giữa các frame (tránh cấp phát lại mỗi tick)
+        # So sánh nhanh theo từng khối 8 byte khi độ dài hàng cho phép (BGRX với chiều rộng chẵn)
+        word = 8 if (width * channels) % 8 == 0 else 1
+        if self._scratch is None:
+            self._scratch = (np.empty_like(cur2d), np.empty_like(cur2d), np.empty(cur2d.shape, dtype=bool),
+                             np.empty((height, width * channels // word), dtype=bool))
+        hi, lo, mask, changed = self._scratch
+
+        # 1. Kiểm tra nhanh: màn hình đứng im hoàn toàn (trường hợp phổ biến nhất)
+        if word == 8:
+            np.not_equal(cur2d.view(np.uint64), prev2d.view(np.uint64), out=changed)
+        else:
+            np.not_equal(cur2d, prev2d, out=changed)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if rows.size == 0:
+            return []
+
+        # 2. Chỉ xử lý tiếp trong bbox (căn theo ô) của các byte thay đổi: màn hình 4K thường
+        #    chỉ đổi vài vùng nhỏ, không cần lặp lại các phép tính trên toàn bộ buffer
+        ts = self.tile_size
+        u = int(rows[0]) // ts * ts
+        b = min(height, (int(rows[-1]) // ts + 1) * ts)
+        cols = np.flatnonzero(changed[u:b].any(axis=0))
+        l = int(cols[0]) * word // channels // ts * ts
+        r = min(width, ((int(cols[-1]) + 1) * word - 1) // channels // ts * ts + ts)
+        box = (slice(u, b), slice(l * channels, r * channels))
+        cur_box, prev_box, hi_box, lo_box, mask_box = cur2d[box], prev2d[box], hi[box], lo[box], mask[box]
+
+        # 3. |cur - prev| > threshold trên uint8 mà không cần nâng kiểu dữ liệu
+        np.maximum(cur_box, prev_box, out=hi_box)
+        np.minimum(cur_box, prev_box, out=lo_box)
+        np.subtract(hi_box, lo_box, out=hi_box)
+        np.greater(hi_box, self.threshold, out=mask_box)
+
+        # 4. Gộp theo ô: OR theo từng dải cột rồi từng dải hàng (ô cuối có thể nhỏ hơn ts)
+        grid = np.logical_or.reduceat(mask_box, np.arange(0, (r - l) * channels, ts * channels), axis=1)
+        grid = np.logical_or.reduceat(grid, np.arange(0, b - u, ts), axis=0)
+
+        dirty_rows: List[List[int]] = [[] for _ in range((height + ts - 1) // ts)]
+        for i, row in enumerate(grid):
+            dirty_rows[u // ts + i] = (np.flatnonzero(row) + l // ts).tolist()
+        rects = merge_dirty_tiles(dirty_rows, ts, width, height)
+
+        for l, u, r, b in rects:
+            prev[u:b, l:r] = frame[u:b, l:r]
+
+        return rects
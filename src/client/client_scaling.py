@@ -0,0 +1,110 @@
+# client/client_scaling.py
+
+from math import gcd
+from typing import Tuple
+from PIL import Image
+
+from src.client.client_capture import CapturedFrame
+
+Rect = Tuple[int, int, int, int]
+
+# Tỉ lệ thu nhỏ được lượng tử hóa thành k/8 (k = 1..8): biên vùng nằm trên lưới 8 px gốc
+# luôn rơi đúng vào pixel nguyên ở ảnh thu nhỏ -> tọa độ gốc <-> thu nhỏ khớp tuyệt đối
+SCALE_STEPS = 8
+
+
+class FrameScaler:
+    """
+    Thu nhỏ frame theo tỉ lệ k/8, chỉ trên các vùng cần encode thay vì cả frame.
+    - k chia hết 8 (1/2, 1/4, 1/8): Image.reduce (lọc hộp số nguyên, nhanh nhất)
+    - còn lại (ví dụ 3/4 cho 2560 -> 1920): resize BOX; lọc hộp không lấy pixel bên kia biên
+      căn lưới nên thu nhỏ từng vùng cho kết quả giống hệt thu nhỏ cả frame
+    Phát hiện thay đổi chạy trên buffer gốc; vùng / ô / copy-rect được đổi sang tọa độ thu nhỏ ở đây.
+    """
+
+    def __init__(self, native_size: Tuple[int, int], k: int = SCALE_STEPS):
+        self.native_size = native_size
+        self.k = max(1, min(SCALE_STEPS, int(k)))
+        w, h = native_size
+        self.size = (self._ceil(w), self._ceil(h))
+
+    @classmethod
+    def for_limit(cls, native_size: Tuple[int, int], limit: int) -> "FrameScaler":
+        """Tỉ lệ k/8 lớn nhất để cạnh dài không vượt limit."""
+        long_edge = max(native_size)
+        if long_edge <= limit:
+            return cls(native_size)
+        return cls(native_size, max(1, (SCALE_STEPS * limit) // long_edge))
+
+    @property
+    def identity(self) -> bool:
+        return self.k == SCALE_STEPS
+
+    @property
+    def align(self) -> int:
+        """Bước lưới (px gốc) để biên vùng rơi vào pixel nguyên sau khi thu nhỏ."""
+        return SCALE_STEPS // gcd(self.k, SCALE_STEPS)
+
+    def _ceil(self, v: int) -> int:
+        return -(-v * self.k // SCALE_STEPS)
+
+    def length(self, v: int) -> int:
+        """Đổi một độ dài đã căn lưới (kích thước ô, độ dịch) sang tọa độ thu nhỏ."""
+        return v * self.k // SCALE_STEPS
+
+    def rect(self, rect: Rect) -> Rect:
+        """Đổi rect gốc (đã căn lưới, hoặc chạm mép frame) sang tọa độ thu nhỏ."""
+        l, u, r, b = rect
+        w, h = self.native_size
+        return (l * self.k // SCALE_STEPS, u * self.k // SCALE_STEPS,
+                self.size[0] if r >= w else r * self.k // SCALE_STEPS,
+                self.size[1] if b >= h else b * self.k // SCALE_STEPS)
+
+    def native_rect(self, rect: Rect) -> Rect:
+        """Ngược lại của rect(): rect thu nhỏ căn theo lưới ô -> rect gốc."""
+        l, u, r, b = rect
+        w, h = self.native_size
+        return (l * SCALE_STEPS // self.k, u * SCALE_STEPS // self.k,
+                w if r >= self.size[0] else r * SCALE_STEPS // self.k,
+                h if b >= self.size[1] else b * SCALE_STEPS // self.k)
+
+    def point(self, point: Tuple[int, int]) -> Tuple[int, int]:
+        return point[0] * self.k // SCALE_STEPS, point[1] * self.k // SCALE_STEPS
+
+    def region(self, frame: CapturedFrame, rect: Rect = None) -> Tuple[Rect, Image.Image]:
+        """(rect thu nhỏ, ảnh thu nhỏ) cho một vùng gốc của frame (None = cả frame)."""
+        native = rect or (0, 0) + tuple(self.native_size)
+        scaled = self.rect(native)
+        img = frame.to_image(native)
+        if self.identity:
+            return scaled, img
+        factor = SCALE_STEPS // self.k
+        if factor * self.k == SCALE_STEPS:
+            # reduce chia khối từ gốc tọa độ của vùng (đã căn lưới), khối lẻ ở mép được lấy trung bình riêng
+            return scaled, img.reduce(factor)
+
+        # Phần lẻ ở mép phải / dưới (hẹp hơn một bước lưới) được thu nhỏ riêng, để vùng chạm mép
+        # và FULL frame cho ra cùng một kết quả với phần còn lại theo đúng tỉ lệ k/8.
+        # Dải lẻ có tỉ lệ khác k/8 theo chiều hẹp nên kết quả phụ thuộc chiều dài dải -> chia dải
+        # theo từng bước lưới (khối cố định trên lưới gốc), RECT và FULL thu nhỏ đúng các khối giống nhau.
+        l, u, r, b = native
+        w, h = self.native_size
+        step = self.align
+        r_al = r if r < w else l + (r - l) // step * step
+        b_al = b if b < h else u + (b - u) // step * step
+        size = (scaled[2] - scaled[0], scaled[3] - scaled[1])
+        if (r_al, b_al) == (r, b):
+            return scaled, img.resize(size, Image.BOX)
+
+        out = Image.new("RGB", size)
+        pieces = [(l, u, r_al, b_al)]
+        pieces += [(r_al, y, r, min(y + step, b_al)) for y in range(u, b_al, step)]
+        pieces += [(x, b_al, min(x + step, r_al), b) for x in range(l, r_al, step)]
+        pieces.append((r_al, b_al, r, b))
+        for x0, y0, x1, y1 in pieces:
+            if x1 <= x0 or y1 <= y0:
+                continue
+            pl, pu, pr, pb = self.rect((x0, y0, x1, y1))
+            piece = img.crop((x0 - l, y0 - u, x1 - l, y1 - u)).resize((pr - pl, pb - pu), Image.BOX)
+            out.paste(piece, (pl - scaled[0], pu - scaled[1]))
+        return scaled, out
@@ -1,180 +1,733 @@
 # client/client_screenshot.py
 
-from mss import mss
-import pyautogui
-from PIL import Image, ImageChops
-import io
 import time
+import queue
 import threading
-
-try:
-    RESAMPLE_MODE = Image.Resampling.LANCZOS
-except AttributeError:
-    RESAMPLE_MODE = Image.ANTIALIAS
+from concurrent.futures import ThreadPoolExecutor
+from src.client.client_regions import TileChangeDetector, rect_area, merge_dirty_tiles
+from src.client.client_capture import MSSCaptureBackend
+from src.client.client_scaling import FrameScaler, SCALE_STEPS
+from src.client.client_pipeline import LatestWinsQueue, StageTimings
+from src.client.client_ratecontrol import RateController
+from src.client.client_bitmap_cache import BitmapCache, frame_tile_keys
+from src.client.client_refine import RefinementTracker
+from src.client.client_framerate import FrameRateGovernor
+from src.common.video_codec import classify_region, encode_region, apply_color_mode
+from src.common.network.constants import CODEC_JPEG, CACHE_OP_RESET, CACHE_OP_HIT, CACHE_OP_STORE, COLOR_MODES
 
 
 class ClientScreenshot:
-    def __init__(self, fps=0.33, quality=85, max_dimension=1920, detect_delta=False):
+    def __init__(self, fps=0.33, quality=85, max_dimension=1920, detect_delta=False,
+                 tile_size=64, full_frame_ratio=0.5, backend=None, encode_workers=2,
+                 target_bitrate=2_000_000, content_aware=True, detect_moves=True, monitor_id=0,
+                 progressive=False, interactive_quality=50, refine_quality=95, refine_after=3):
         """
-        fps: Frame per second (0.33 = 1 frame mỗi ~3 giây)
-        quality: Chất lượng JPEG (85 = chất lượng cao)
+        fps: Frame per second (0.33 = 1 frame mỗi ~3 giây); cố định, dùng set_fps_range để fps tự điều chỉnh
+        quality: Chất lượng JPEG tối đa (85 = chất lượng cao), RateController chỉ hạ xuống từ mức này
         max_dimension: Độ phân giải tối đa (1920 = Full HD)
         detect_delta: Tắt delta detection để ưu tiên chất lượng
+        tile_size: Kích thước ô lưới dùng để phát hiện vùng thay đổi (64 = 64x64 px)
+        full_frame_ratio: Nếu tổng diện tích vùng thay đổi vượt tỉ lệ này -> gửi FULL frame
+        backend: Nguồn chụp màn hình (mặc định MSSCaptureBackend, SyntheticCaptureBackend để benchmark)
+        encode_workers: Số luồng encode song song (PIL nhả GIL khi encode)
+        target_bitrate: Ngân sách bit/s của luồng video (xem target_bitrate / RateController)
+        content_aware: Chọn codec theo nội dung từng vùng (JPEG / PNG / PALETTE), False = luôn JPEG
+        detect_moves: Phát hiện cuộn / kéo cửa sổ và gửi copy-rect thay vì encode lại cả vùng (cần detect_delta)
+        monitor_id: Màn hình nguồn (0 = chính), được chuyển cho mọi callback để gắn vào PDU
+        progressive: Chế độ tương tác: vùng thay đổi gửi nhanh ở interactive_quality, vùng đã đứng yên
+                     refine_after frame được gửi lại ở refine_quality (hoặc lossless nếu content_aware chọn)
         """
-        self.fps = fps
+        self.governor = FrameRateGovernor(fps)
         self.quality = quality
         self.max_dimension = max_dimension
         self.detect_delta = detect_delta
+        self.full_frame_ratio = full_frame_ratio
+        self.monitor_id = monitor_id
+        self.backend = backend or MSSCaptureBackend(monitor_index=monitor_id + 1)
+        self.encode_workers = max(1, int(encode_workers))
+        self.content_aware = content_aware
+        self.color_mode = "full" # Chế độ màu cho đường truyền yếu (COLOR_MODES), đổi bằng set_color_mode
+        self.detect_moves = detect_moves
+        self.progressive = progressive
+        self.interactive_quality = interactive_quality
+        self.refine_quality = refine_quality
+        self.refine_after = max(1, int(refine_after))
+        self.REFINE_MAX_TILES = 128 # Số ô refine tối đa mỗi tick (tránh dồn cả màn hình vào một frame)
+        self._refine = RefinementTracker()
+        # Vùng quan trọng (ROI): callable -> [rect gốc] (cửa sổ đang focus, quanh con trỏ) trên màn hình này,
+        # [] = ROI nằm ở màn hình khác, None = không biết (mọi vùng như nhau)
+        self.roi_provider = None
+        self.ROI_BACKGROUND_QUALITY_DROP = 25 # Vùng ngoài ROI: chất lượng thấp hơn bấy nhiêu
+        self.ROI_BACKGROUND_INTERVAL = 1.0 # Vùng ngoài ROI: gửi gộp tối đa một lần mỗi bấy nhiêu giây
+        self._roi_deferred = set() # Ô (tọa độ gốc) ngoài ROI đã thay đổi nhưng chưa gửi
+        self._last_background_ts = 0.0
+        # Viewport của manager: vùng đang hiển thị (x0, y0, x1, y1 chuẩn hóa theo màn hình) và kích thước hiển thị
+        # (w, h) px. Chỉ vùng này được chụp / encode, thu nhỏ vừa kích thước hiển thị. None = cả màn hình / không giới hạn
+        self.viewport = None
+        self.viewport_size = None
+        self.VIEWPORT_MIN_SIZE = 64 # Vùng nhỏ nhất được chụp (px gốc)
+        self._native_size = None
+        self._frame_viewport = None # (l, u, r, b, native_w, native_h) của frame vừa chụp, None = cả màn hình
+        self._last_viewport = None
+        self.timings = StageTimings()
+        self.rate = RateController(target_bitrate=target_bitrate, max_quality=quality)
+        self.TIMINGS_LOG_INTERVAL = 30.0
+
+        # Bitmap cache: tắt (0) cho tới khi server gửi dung lượng đã thương lượng với các manager
+        self.cache = BitmapCache()
+        self._cache_capacity = 0
+        # callback(full_w, full_h, tile_size, ops, seq, monitor) -> False nếu không gửi được
+        self.on_cache_ops = None
+        # callback(full_w, full_h, src_rect, dst_point, seq, monitor) -> False nếu không gửi được
+        self.on_copy_rect = None
 
+        self._change_fraction = 0.0 # Tỉ lệ diện tích thay đổi của tick gần nhất (cho governor)
         self._first_frame = True
-        self._prev_image = None
+        self._detector = TileChangeDetector(tile_size=tile_size)
         self._force_full = False
+        self._last_frame_size = None
         self.stop = False
-        self.frame_seq = 0
+        # Mỗi màn hình một dải seq riêng (4 bit cao) -> server/manager ghép fragment không lẫn nhau
+        self.frame_seq = (monitor_id & 0x7) << 28
         self._lock = threading.Lock()
         self.FULL_FRAME_INTERVAL = 60.0 # Gửi full frame mỗi 60 giây
         self.last_full_frame_ts = 0.0
+        # Yêu cầu keyframe từ viewer: gộp lại, tối đa một keyframe mỗi KEYFRAME_MIN_INTERVAL giây
+        self.KEYFRAME_MIN_INTERVAL = 1.0
+        self._keyframe_requested = False
+        self._last_keyframe_ts = 0.0
+
+    @property
+    def fps(self):
+        """fps hiện tại (do FrameRateGovernor chọn trong khoảng sàn / trần)."""
+        return self.governor.fps
+
+    @fps.setter
+    def fps(self, value):
+        self.governor.set_range(value)
+
+    def set_fps_range(self, min_fps, max_fps):
+        """Cho fps tự điều chỉnh theo mức hoạt động: đứng im -> min_fps, thay đổi nhiều / có input -> max_fps."""
+        self.governor.set_range(min_fps, max_fps)
+
+    def notify_input(self):
+        """Input từ manager: chụp nhanh ngay để thao tác điều khiển có phản hồi."""
+        self.governor.record_input()
+
+    @property
+    def target_bitrate(self):
+        return self.rate.target_bitrate
+
+    @target_bitrate.setter
+    def target_bitrate(self, bitrate):
+        self.rate.set_target_bitrate(bitrate)
+
+    def _max_long_edge(self, size):
+        # Cạnh dài tối đa sau khi áp dụng max_dimension, kích thước hiển thị của manager và scale của RateController
+        long_edge = max(size)
+        limit = min(long_edge, self.max_dimension) if self.max_dimension else long_edge
+        if self.viewport_size:
+            # Làm tròn LÊN bước k/8 kế tiếp: ảnh không nhỏ hơn khung hiển thị (manager thu nhỏ thì vẫn nét)
+            vw, vh = self.viewport_size
+            fit = long_edge * min(vw / float(size[0]), vh / float(size[1]))
+            k = min(SCALE_STEPS, max(1, -(-int(SCALE_STEPS * fit) // long_edge)))
+            limit = min(limit, -(-k * long_edge // SCALE_STEPS))
+        return max(1, int(limit * self.rate.scale))
+
+    def _quality_ceiling(self):
+        # Chế độ tương tác: gửi nhanh ở chất lượng thấp, phần nét do refine đảm nhận
+        return min(self.quality, self.interactive_quality) if self.progressive else self.quality
+
+    def _scaler_for(self, size):
+        # Tỉ lệ thu nhỏ (k/8) cho frame này; màn hình nhỏ hơn giới hạn -> giữ nguyên
+        return FrameScaler.for_limit(size, self._max_long_edge(size))
+
+    def _region_quality(self, job, rect):
+        # Vùng ngoài ROI (không chạm ROI) -> chất lượng thấp hơn; FULL frame / không có ROI -> quality của frame
+        if rect is None or job.roi is None:
+            return job.quality
+        l, u, r, b = rect
+        if any(l < rr and rl < r and u < rb and ru < b for rl, ru, rr, rb in job.roi):
+            return job.quality
+        return max(10, job.quality - self.ROI_BACKGROUND_QUALITY_DROP)
+
+    def _current_roi(self, size):
+        """ROI của frame (rect gốc đã nới ra theo lưới ô, cắt theo màn hình), None = không có ROI."""
+        if self.roi_provider is None:
+            return None
+        try:
+            rects = self.roi_provider()
+        except Exception:
+            return None
+        if rects is None:
+            return None
+        ts = self._detector.tile_size
+        w, h = size
+        # Đang chụp viewport: đổi tọa độ màn hình sang tọa độ frame
+        dx, dy = self._frame_viewport[:2] if self._frame_viewport else (0, 0)
+        rects = [(l - dx, u - dy, r - dx, b - dy) for l, u, r, b in rects]
+        roi = []
+        for l, u, r, b in rects:
+            l, u = max(0, int(l) // ts * ts), max(0, int(u) // ts * ts)
+            r, b = min(w, -(-int(r) // ts) * ts), min(h, -(-int(b) // ts) * ts)
+            if r > l and b > u:
+                roi.append((l, u, r, b))
+        return roi
 
-    def _resize_if_needed(self, img):
-        w, h = img.size
-        long_edge = max(w, h)
-        if self.max_dimension and long_edge > self.max_dimension:
-            scale = float(self.max_dimension) / long_edge
-            img = img.resize((int(w*scale), int(h*scale)), RESAMPLE_MODE)
-        return img
-
-    def _encode_jpeg(self, img, adaptive=True):
-        bio = io.BytesIO()
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        
-        # Adaptive quality: tăng giới hạn size lên để giữ chất lượng cao
-        current_quality = self.quality
-        if adaptive:
-            img.save(bio, format="JPEG", quality=current_quality, optimize=True)
-            size_kb = len(bio.getvalue()) / 1024
-            
-            # Nếu frame > 300KB, giảm quality xuống (tăng từ 80KB lên 300KB)
-            if size_kb > 300:
-                bio = io.BytesIO()
-                current_quality = max(70, current_quality - 10)  # Giảm 10 điểm nhưng không dưới 70
-                img.save(bio, format="JPEG", quality=current_quality, optimize=True)
-        else:
-            img.save(bio, format="JPEG", quality=current_quality, optimize=True)
-        
-        return bio.getvalue()
+    def _defer_background(self, rects, roi, size, now):
+        """
+        Tách các ô thay đổi theo ROI: ô chạm ROI gửi ngay, ô ngoài ROI dồn lại và gửi gộp
+        mỗi ROI_BACKGROUND_INTERVAL giây (nội dung lấy từ frame lúc gửi, là nội dung mới nhất).
+        """
+        ts = self._detector.tile_size
+        w, h = size
+        roi_tiles = {(tx, ty) for l, u, r, b in roi
+                     for ty in range(u // ts, -(-b // ts)) for tx in range(l // ts, -(-r // ts))}
+        fg = set()
+        for l, u, r, b in rects:
+            for ty in range(u // ts, -(-b // ts)):
+                for tx in range(l // ts, -(-r // ts)):
+                    (fg if (tx, ty) in roi_tiles else self._roi_deferred).add((tx, ty))
+        bg = set()
+        if self._roi_deferred and now - self._last_background_ts >= self.ROI_BACKGROUND_INTERVAL:
+            bg, self._roi_deferred = self._roi_deferred - fg, set()
+            self._last_background_ts = now
+        self._roi_deferred -= fg
+
+        merged = []
+        for tiles in (fg, bg):
+            dirty_rows = [[] for _ in range(-(-h // ts))]
+            for tx, ty in sorted(tiles, key=lambda t: (t[1], t[0])):
+                dirty_rows[ty].append(tx)
+            merged.extend(merge_dirty_tiles(dirty_rows, ts, w, h))
+        return merged
+
+    def _encode_region(self, img, quality=None):
+        """
+        Trả về (codec, bytes). Văn bản / UI phẳng -> lossless PALETTE hoặc PNG, còn lại JPEG.
+        Quality được RateController chọn trước khi encode -> mỗi vùng chỉ encode đúng 1 lần.
+        """
+        codec = classify_region(img) if self.content_aware else CODEC_JPEG
+        img, codec = apply_color_mode(img, codec, self.color_mode)
+        return codec, encode_region(img, codec, quality or self.quality)
 
     def capture_once(self):
-        with mss() as sct:
-            # Lấy màn hình đầu tiên
-            monitor = sct.monitors[1] # Thường là monitors[1] trên Windows/mss
-            sct_img = sct.grab(monitor)
-            
-            # Convert sang PIL Image cực nhanh
-            img = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
-            return self._resize_if_needed(img)
-
-        # img = pyautogui.screenshot()
-        # return self._resize_if_needed(img)
-
-    def compute_delta_bbox(self, img):
-        if not self.detect_delta or self._prev_image is None:
-            # [SỬA] Đảm bảo prev_image được khởi tạo là ảnh thang xám
-            self._prev_image = img.convert("L")
+        frame = self.capture_frame()
+        return self._scaler_for(frame.size).region(frame)[1]
+
+    def capture_frame(self):
+        """
+        Chụp một frame từ backend (phiên chụp được giữ lâu dài).
+        Trả về CapturedFrame ở độ phân giải gốc: buffer thô được dùng trực tiếp cho phát hiện thay đổi,
+        ảnh PIL (đã thu nhỏ) chỉ được tạo cho các vùng thực sự encode.
+        Có viewport -> chỉ chụp vùng đó (frame nhỏ hơn, tọa độ tính từ góc viewport).
+        """
+        native = self.backend.native_size() or self._native_size
+        rect = self._viewport_rect(native)
+        if rect is None:
+            frame = self.backend.grab()
+            self._native_size = frame.size
+            self._frame_viewport = None
+            return frame
+        self._frame_viewport = rect + tuple(native)
+        return self.backend.grab(rect)
+
+    def set_viewport(self, region=None, size=None):
+        """
+        Viewport manager báo: region = (x0, y0, x1, y1) chuẩn hóa 0..1 của màn hình này (None = cả màn hình),
+        size = (w, h) px đang hiển thị (None = chỉ giới hạn bởi max_dimension).
+        Frame kế tiếp là keyframe mang viewport mới (manager dùng để ánh xạ input / con trỏ).
+        """
+        if region is not None:
+            x0, y0, x1, y1 = (max(0.0, min(1.0, float(v))) for v in region)
+            region = None if (x0, y0, x1, y1) == (0.0, 0.0, 1.0, 1.0) or x1 <= x0 or y1 <= y0 else (x0, y0, x1, y1)
+        size = (int(size[0]), int(size[1])) if size and min(size) > 0 else None
+        self.viewport, self.viewport_size = region, size
+
+    def _viewport_rect(self, native):
+        """Vùng chụp (px gốc, căn lưới 8 px để thu nhỏ k/8 khớp pixel), None = cả màn hình."""
+        if self.viewport is None or not native:
+            return None
+        w, h = native
+        x0, y0, x1, y1 = self.viewport
+        step, min_size = SCALE_STEPS, self.VIEWPORT_MIN_SIZE
+        l, u = int(x0 * w) // step * step, int(y0 * h) // step * step
+        r, b = min(w, -(-int(x1 * w + 0.5) // step) * step), min(h, -(-int(y1 * h + 0.5) // step) * step)
+        r, b = min(w, max(r, l + min_size)), min(h, max(b, u + min_size))
+        l, u = max(0, min(l, r - min_size)), max(0, min(u, b - min_size))
+        if (l, u, r, b) == (0, 0, w, h):
             return None
-            
-        # 1. Tính toán sự khác biệt (trên ảnh thang xám)
-        diff = ImageChops.difference(img.convert("L"), self._prev_image)
-        
-        # 2. Áp dụng Threshold
-        threshold_value = 30
-        mask = diff.point(lambda p: 255 if p > threshold_value else 0) 
-        
-        # 3. Tính toán bounding box từ mask
-        bbox = mask.getbbox()
-        
-        if bbox is not None:
-            # [SỬA] Cập nhật ảnh cũ sang ảnh mới (nếu có thay đổi)
-            self._prev_image = img.convert("L") 
-            
-        return bbox
+        return l, u, r, b
+
+    def _detector_input(self, frame):
+        # Đường numpy chỉ cần buffer thô; đường PIL cần ảnh đầy đủ
+        if self._detector.use_numpy:
+            return None, frame.array
+        return frame.to_image(), None
+
+    def compute_dirty_rects(self, frame):
+        """
+        Trả về danh sách dirty rect (l, u, r, b) so với ảnh tham chiếu.
+        None nghĩa là cần gửi FULL frame (chưa có tham chiếu / vùng thay đổi quá lớn).
+        Tắt delta -> [] (không gửi gì), FULL chỉ đến từ should_send_full (frame đầu / ép buộc / 60s).
+        """
+        if not self.detect_delta:
+            return []
+
+        rects = self._detector.detect(*self._detector_input(frame))
+        if not rects:
+            return rects
+
+        full_w, full_h = frame.size
+        dirty_area = sum(rect_area(r) for r in rects)
+        if dirty_area > self.full_frame_ratio * full_w * full_h:
+            return None
+        return rects
+
+    def _emit(self, callback, full_width, full_height, data, bbox, img, ts_ms, codec, viewport=None):
+        seq = self.frame_seq
+        self.frame_seq += 1
+        # Gửi qua callback (vào Sender); FULL của viewport kèm vùng chụp để manager ánh xạ tọa độ
+        if viewport is not None:
+            return callback(full_width, full_height, data, bbox, img, seq, ts_ms, codec, self.monitor_id,
+                            viewport=viewport)
+        return callback(full_width, full_height, data, bbox, img, seq, ts_ms, codec, self.monitor_id)
+
+    def _emit_copy_rect(self, job, src, dst):
+        seq = self.frame_seq
+        self.frame_seq += 1
+        return self.on_copy_rect(job.width, job.height, src, dst, seq, self.monitor_id)
+
+    def _emit_cache_ops(self, job, ops):
+        if self.on_cache_ops is None:
+            return False
+        seq = self.frame_seq
+        self.frame_seq += 1
+        return self.on_cache_ops(job.width, job.height, job.tile_size, ops, seq, self.monitor_id)
 
     def force_full_frame(self):
         with self._lock:
             self._force_full = True
 
-    def capture_loop(self, callback):
-        print(f"[ClientScreenshot] Bắt đầu capture loop (Hybrid Mode: Full + Rect)...")
+    def request_keyframe(self):
+        """
+        Viewer cần keyframe (mới vào / mất ảnh nền). Khác force_full_frame: các yêu cầu dồn dập
+        (nhiều viewer vào cùng lúc) được gộp thành một keyframe, cách keyframe trước ít nhất KEYFRAME_MIN_INTERVAL.
+        """
+        with self._lock:
+            self._keyframe_requested = True
 
-        while not self.stop:
-            # Cho phép thay đổi fps động theo chế độ (view/control)
-            interval = 1.0 / max(self.fps, 0.01)
-            start_time = time.perf_counter()
-            
+    def _keyframe_due(self, now):
+        return self._keyframe_requested and now - self._last_keyframe_ts >= self.KEYFRAME_MIN_INTERVAL
+
+    def set_bitmap_cache(self, capacity):
+        """
+        Đặt dung lượng bitmap cache (số ô) đã thương lượng, 0 = tắt.
+        Áp dụng ở keyframe kế tiếp: client gửi RESET rồi nạp lại cache từ FULL frame.
+        Tới lúc đó cache cũ vẫn được dùng nguyên vẹn (viewer mới chưa có ảnh nền thì bỏ qua op).
+        """
+        self._cache_capacity = max(0, int(capacity))
+        self.request_keyframe()
+
+    def set_color_mode(self, mode):
+        """
+        Đổi chế độ màu (COLOR_MODES) lúc đang chạy. Kèm keyframe: ảnh nền và bitmap cache (RESET)
+        của manager được làm mới theo chế độ mới, không lẫn ô cũ với ô mới.
+        """
+        if mode not in COLOR_MODES or mode == self.color_mode:
+            return
+        self.color_mode = mode
+        self.request_keyframe()
+
+    def get_stage_timings(self):
+        """Thời gian từng stage (capture / diff / encode / send) và số frame bị thay thế."""
+        stats = self.timings.snapshot()
+        stats["dropped_frames"] = self.dropped_frames
+        return stats
+
+    @property
+    def dropped_frames(self):
+        q = getattr(self, "_job_q", None)
+        return q.dropped if q is not None else 0
+
+    @staticmethod
+    def _merge_jobs(old, new):
+        """
+        Frame cũ chưa kịp encode bị thay bằng frame mới (latest-wins).
+        Ảnh tham chiếu của detector đã coi các vùng của frame cũ là "đã gửi",
+        nên nội dung của chúng phải được giữ lại trong frame mới:
+        - frame mới là FULL: bao trùm tất cả -> bỏ frame cũ
+        - frame cũ là FULL: dán các vùng mới lên ảnh FULL cũ -> FULL của nội dung mới nhất
+        - cả hai là RECT: giữ các vùng cũ không bị vùng mới che phủ hoàn toàn
+        Keyframe (RESET bitmap cache) không được mất khi gộp; hash ô của frame mới được ưu tiên.
+        Copy-rect của frame cũ được giữ (luôn áp dụng trước mọi vùng); frame mới không bao giờ
+        có copy-rect (hay vùng refine) vì capture chỉ tìm cuộn / refine khi job_q đang trống.
+        Vùng refine của frame cũ được giữ nếu không bị vùng mới che hoàn toàn (gửi trước các vùng).
+        Đổi viewport luôn sinh FULL nên viewport của frame mới là viewport của cả frame gộp.
+        """
+        keyframe = old.keyframe or new.keyframe
+        tile_keys = None
+        if old.tile_keys is not None and new.tile_keys is not None:
+            tile_keys = {**old.tile_keys, **new.tile_keys}
+
+        if new.is_full:
+            return _FrameJob(new.width, new.height, new.regions, new.ts_ms, new.quality,
+                             new.tile_keys, keyframe, tile_size=new.tile_size, frame_no=new.frame_no,
+                             viewport=new.viewport)
+        if old.is_full:
+            full_img = old.regions[0][1]
+            for rect, img in new.regions:
+                full_img.paste(img, rect[:2])
+            return _FrameJob(new.width, new.height, [(None, full_img)], new.ts_ms, new.quality,
+                             tile_keys, keyframe, tile_size=new.tile_size, frame_no=new.frame_no,
+                             viewport=new.viewport)
+
+        def _covered(rect):
+            return any(n[0] <= rect[0] and n[1] <= rect[1] and n[2] >= rect[2] and n[3] >= rect[3]
+                       for n, _ in new.regions)
+
+        kept = [(rect, img) for rect, img in old.regions if not _covered(rect)]
+        refine = [(rect, img) for rect, img in old.refine if not _covered(rect)]
+        return _FrameJob(new.width, new.height, kept + new.regions, new.ts_ms, new.quality,
+                         tile_keys, keyframe, old.moves, new.tile_size, refine + new.refine, new.frame_no, new.roi,
+                         new.viewport)
+
+    def _timed_encode(self, img, quality):
+        with self.timings.measure("encode"):
+            return self._encode_region(img, quality)
+
+    def _encode_stage(self, job_q, send_q, pool, done):
+        # Lấy frame mới nhất, đẩy các vùng vào pool encode; thứ tự gửi được giữ nhờ send_q
+        while not (done.is_set() and len(job_q) == 0):
+            job = job_q.get(timeout=0.1)
+            if job is None:
+                continue
+            # Bitmap cache được quyết định tuần tự ở đây (cùng thứ tự với khâu gửi)
+            regions, cache_ops = self._apply_bitmap_cache(job)
+            futures = [(rect, img, pool.submit(self._timed_encode, img, self._region_quality(job, rect)))
+                       for rect, img in regions]
+            refine = [(rect, img, pool.submit(self._timed_encode, img, self.refine_quality))
+                      for rect, img in job.refine]
+            # send_q có giới hạn: nếu khâu gửi chậm thì khâu encode chờ, còn capture vẫn
+            # tiếp tục và các frame dồn lại được gộp trong job_q
+            send_q.put((job, futures, cache_ops, refine))
+        send_q.put(None)
+
+    def _apply_bitmap_cache(self, job):
+        """
+        Tách các ô manager đã có trong cache (HIT) khỏi vùng cần encode.
+        Trả về (regions còn phải encode, danh sách op cho CACHE PDU).
+        Thứ tự op: RESET, các HIT, rồi các STORE (manager cắt ô từ ảnh nền sau khi đã vá xong frame).
+        """
+        cache = self.cache
+        ops = []
+        if job.keyframe:
+            cache.reset(self._cache_capacity)
+            if cache.enabled:
+                ops.append((CACHE_OP_RESET, cache.capacity, 0, 0))
+        if not cache.enabled or job.tile_keys is None:
+            return job.regions, ops
+
+        ts = job.tile_size
+        hits, stores = [], []
+        stored_now = set()  # Ô trùng nhau trong cùng frame: chỉ STORE một lần, các lần sau vẫn encode
+        regions = []
+        for rect, img in job.regions:
+            l, u, r, b = rect or (0, 0, job.width, job.height)
+            dirty_rows = [[] for _ in range(0, b - u, ts)]
+            n_hits = 0
+            for y in range(u, b, ts):
+                for x in range(l, r, ts):
+                    key = job.tile_keys.get((x, y, min(x + ts, job.width), min(y + ts, job.height)))
+                    if key is not None and key not in stored_now:
+                        slot = cache.lookup(key)
+                        if slot is not None:
+                            hits.append((CACHE_OP_HIT, slot, x, y))
+                            n_hits += 1
+                            continue
+                        stored_now.add(key)
+                        stores.append((CACHE_OP_STORE, cache.insert(key), x, y))
+                    dirty_rows[(y - u) // ts].append((x - l) // ts)
+
+            if n_hits == 0:
+                regions.append((rect, img))
+                continue
+            # Gom các ô còn lại (tọa độ cục bộ của vùng) thành hình chữ nhật và cắt ảnh tương ứng
+            for dl, du, dr, db in merge_dirty_tiles(dirty_rows, ts, r - l, b - u):
+                regions.append(((l + dl, u + du, l + dr, u + db), img.crop((dl, du, dr, db))))
+
+        return regions, ops + hits + stores
+
+    def _send_stage(self, callback, send_q):
+        last_log = time.time()
+        while True:
+            item = send_q.get()
+            if item is None:
+                break
+            job, futures, cache_ops, refine = item
             try:
-                # 1. Chụp ảnh màn hình hiện tại
-                img = self.capture_once()
-                full_width, full_height = img.size
-                
-                # 2. Kiểm tra xem có CẦN gửi Full Frame không?
-                # - Là frame đầu tiên?
-                # - Bị ép buộc (force_full)?
-                # - Đã quá lâu chưa gửi Full Frame (30s)?
-                now = time.time()
-                is_time_for_full = (now - self.last_full_frame_ts) >= self.FULL_FRAME_INTERVAL
-                should_send_full = self._first_frame or self._force_full or is_time_for_full
-
-                bbox = None # Mặc định là None (nghĩa là Full Frame)
-
-                if should_send_full:
-                    # --- GỬI FULL FRAME ---
-                    self._first_frame = False
-                    self._force_full = False
-                    self.last_full_frame_ts = now
-                    
-                    # Cập nhật ảnh tham chiếu (để so sánh cho lần sau)
-                    self._prev_image = img.convert("L") 
-                    
-                    # bbox vẫn là None -> Code phía dưới sẽ hiểu là Full Frame
-                    
-                else:
-                    # --- GỬI RECT FRAME (Đây là đoạn bạn cần bật lại) ---
-                    # Tính toán vùng thay đổi so với ảnh trước
-                    bbox = self.compute_delta_bbox(img)
-
-                # 3. Xử lý gửi
-                # Nếu là chế độ Rect (không phải Full) mà bbox là None (nghĩa là màn hình đứng im, không thay đổi)
-                # -> Thì KHÔNG gửi gì cả để tiết kiệm băng thông.
-                if not should_send_full and bbox is None:
-                    # Ngủ bù thời gian rồi tiếp tục vòng lặp
-                    elapsed = time.perf_counter() - start_time
-                    time.sleep(max(0, interval - elapsed))
-                    continue
-
-                # 4. Cắt ảnh và Encode
-                if bbox:
-                    # [RECT] Cắt vùng thay đổi
-                    crop_img = img.crop(bbox)
-                    jpg_bytes = self._encode_jpeg(crop_img)
-                    pass 
-                else:
-                    # [FULL] Lấy toàn bộ ảnh
-                    jpg_bytes = self._encode_jpeg(img)
-
-                ts_ms = int(time.time() * 1000)
-                seq = self.frame_seq
-                self.frame_seq += 1
-
-                # 5. Gửi qua callback (vào Sender)
-                sent_ok = callback(full_width, full_height, jpg_bytes, bbox, img, seq, ts_ms)
+                sent_ok = True
+                frame_bytes = 0
+                # Copy-rect trước: các vùng của frame được tính trên ảnh nền đã dịch
+                for src, dst in job.moves:
+                    if self._emit_copy_rect(job, src, dst) is False:
+                        sent_ok = False
+                # Refine trước các vùng mới: vùng refine của frame cũ (đã gộp) có thể bị vùng mới vá đè
+                lossless, lossy = [], []
+                for is_refine, (rect, img, fut) in [(True, f) for f in refine] + [(False, f) for f in futures]:
+                    codec, data = fut.result()
+                    frame_bytes += len(data)
+                    if not is_refine:
+                        (lossy if codec == CODEC_JPEG else lossless).append(rect or (0, 0, job.width, job.height))
+                    with self.timings.measure("send"):
+                        viewport = job.viewport if rect is None else None
+                        if self._emit(callback, job.width, job.height, data, rect, img, job.ts_ms, codec,
+                                      viewport) is False:
+                            sent_ok = False
+                if cache_ops and sent_ok:
+                    with self.timings.measure("send"):
+                        sent_ok = self._emit_cache_ops(job, cache_ops) is not False
+                self.rate.record_frame(frame_bytes)
+                if sent_ok and lossless:
+                    # Vùng đã gửi lossless thì không cần refine
+                    self._refine.confirm(lossless, lossy, job.frame_no)
+
                 if sent_ok is False:
+                    if not job.is_full or self.cache.enabled:
+                        # Manager bị thiếu ít nhất 1 vùng (hoặc cache lệch) -> lần sau gửi FULL để đồng bộ lại
+                        self.force_full_frame()
                     time.sleep(0.05)
+            except Exception as e:
+                print(f"[ClientScreenshot] Lỗi encode/gửi: {e}")
+
+            now = time.time()
+            if now - last_log >= self.TIMINGS_LOG_INTERVAL:
+                last_log = now
+                print(f"[ClientScreenshot] Stage timings: {self.timings.format()} | dropped={self.dropped_frames} "
+                      f"| quality={job.quality} scale={self.rate.scale:.2f} "
+                      f"| cache hit={self.cache.hits} miss={self.cache.misses} | refine pending={len(self._refine)}")
+
+    def _can_detect_moves(self):
+        # Chỉ tìm cuộn khi không còn frame chờ encode: frame có copy-rect không bao giờ bị gộp làm frame mới
+        job_q = getattr(self, "_job_q", None)
+        # Còn ô ngoài ROI chưa gửi thì không tìm cuộn: manager sẽ chép cả nội dung cũ của các ô đó
+        return (self.detect_delta and self.detect_moves and self.on_copy_rect is not None and self._detector.use_numpy
+                and (job_q is None or len(job_q) == 0) and not self._roi_deferred)
+
+    def _capture_stage(self):
+        """
+        Chụp + so sánh (luôn tuần tự vì detector giữ ảnh tham chiếu).
+        Trả về _FrameJob với ảnh PIL (có sở hữu dữ liệu) cho từng vùng, hoặc None nếu màn hình đứng im.
+        """
+        # Quality/scale cho frame này được quyết định trước khi chụp (scale ảnh hưởng resize)
+        quality, _ = self.rate.update(self.fps, max_quality=self._quality_ceiling())
+        # Chỉ chế độ tương tác mới cố ý gửi chất lượng thấp để refine sau
+        lossy = self.progressive and quality < self.refine_quality
+        frame_no = self._refine.tick()
+
+        with self.timings.measure("capture"):
+            frame = self.capture_frame()
+            viewport = self._frame_viewport
+        # Phát hiện thay đổi chạy trên buffer gốc, chỉ các vùng được gửi mới bị thu nhỏ
+        scaler = self._scaler_for(frame.size)
+        full_width, full_height = scaler.size
+        tile_size = scaler.length(self._detector.tile_size)
+        ts_ms = int(time.time() * 1000)
+
+        # Kiểm tra xem có CẦN gửi Full Frame không?
+        # - Là frame đầu tiên?
+        # - Bị ép buộc (force_full)?
+        # - Đã quá lâu chưa gửi Full Frame (60s)?
+        now = time.time()
+        is_time_for_full = (now - self.last_full_frame_ts) >= self.FULL_FRAME_INTERVAL
+        # Đổi kích thước gửi đi (RateController đổi scale) thì manager không vá RECT được -> keyframe
+        # Đổi viewport (kể cả chỉ dịch vùng) -> keyframe mang vùng mới, tọa độ RECT sau đó tính theo vùng này
+        should_send_full = (self._first_frame or self._force_full or is_time_for_full
+                            or scaler.size != self._last_frame_size or viewport != self._last_viewport
+                            or self._keyframe_due(now))
+        # FULL do vùng thay đổi quá lớn KHÔNG phải keyframe: bitmap cache vẫn được giữ.
+        keyframe = should_send_full
+        if keyframe:
+            self._keyframe_requested = False
+            self._last_keyframe_ts = now
+        self._last_frame_size = scaler.size
+        self._last_viewport = viewport
+        use_cache = self._cache_capacity > 0 and self.on_cache_ops is not None
+
+        rects = None # Mặc định là None (nghĩa là Full Frame)
+        moves = []
+        roi = None
+        self._change_fraction = 0.0
 
+        if not should_send_full:
+            # Tính toán các vùng thay đổi (theo lưới ô) so với ảnh trước
+            with self.timings.measure("diff"):
+                # Cuộn / kéo: dịch ảnh tham chiếu trước, dirty rect chỉ còn phần mới lộ ra
+                move = self._detector.detect_move(frame.array, align=scaler.align) \
+                    if self._can_detect_moves() else None
+                if move is not None:
+                    src, dst = move
+                    moves.append((scaler.rect(src), scaler.point(dst)))
+                    self._refine.shift(*moves[-1])
+                rects = self.compute_dirty_rects(frame)
+
+            if rects is None or moves:
+                self._change_fraction = 1.0 # Vùng thay đổi quá lớn / cuộn: đang hoạt động mạnh
+            elif rects:
+                self._change_fraction = sum(rect_area(r) for r in rects) / float(frame.size[0] * frame.size[1])
+
+            if rects is not None:
+                roi = self._current_roi(frame.size)
+            if roi is not None:
+                # Vùng ngoài ROI: gửi thưa hơn (gộp), chất lượng thấp hơn (_region_quality)
+                rects = self._defer_background(rects, roi, frame.size, now)
+
+            # Màn hình đứng im -> chỉ gửi refine (nếu có ô chờ), không thì KHÔNG gửi gì cả.
+            if rects is not None and not rects and not moves:
+                refine = self._refine_regions(frame, scaler)
+                if not refine:
+                    return None
+                return _FrameJob(full_width, full_height, [], ts_ms, quality, tile_size=tile_size,
+                                 refine=refine, frame_no=frame_no, viewport=viewport)
+
+        if rects is None:
+            # FULL: frame đầu tiên, bị ép buộc, quá hạn, hoặc vùng thay đổi quá lớn
+            self._first_frame = False
+            self._force_full = False
+            self.last_full_frame_ts = now
+
+            # Cập nhật ảnh tham chiếu (để so sánh cho lần sau)
+            with self.timings.measure("diff"):
+                self._detector.reset(*self._detector_input(frame))
+                tile_keys = self._scaled_tile_keys(frame, [(0, 0) + frame.size], scaler) if use_cache else None
+            with self.timings.measure("scale"):
+                _, full_img = scaler.region(frame)
+            self._refine.reset(scaler.size, tile_size)
+            self._roi_deferred.clear()
+            if lossy:
+                self._refine.mark([(0, 0) + scaler.size])
+            return _FrameJob(full_width, full_height, [(None, full_img)], ts_ms, quality,
+                             tile_keys, keyframe, tile_size=tile_size, frame_no=frame_no, viewport=viewport)
+
+        # RECT: tạo ảnh (và hash ô cho bitmap cache) cho từng vùng ngay trong luồng capture,
+        # vì buffer của backend chỉ hợp lệ tới lần grab() kế tiếp
+        with self.timings.measure("diff"):
+            tile_keys = self._scaled_tile_keys(frame, rects, scaler) if use_cache else None
+        with self.timings.measure("scale"):
+            regions = [scaler.region(frame, rect) for rect in rects]
+        self._refine.mark([rect for rect, _ in regions], lossy)
+        # Ô đã đứng yên đủ lâu được refine ngay trong frame này (con trỏ nhấp nháy không chặn refine)
+        refine = self._refine_regions(frame, scaler)
+        return _FrameJob(full_width, full_height, regions, ts_ms, quality,
+                         tile_keys, moves=moves, tile_size=tile_size, refine=refine, frame_no=frame_no,
+                         roi=None if roi is None else [scaler.rect(r) for r in roi], viewport=viewport)
+
+    def _refine_regions(self, frame, scaler):
+        """
+        Ảnh nét cho các ô đã đứng yên refine_after frame sau khi gửi chất lượng thấp.
+        Ô không đổi từ đó nên nội dung frame hiện tại chính là nội dung manager đang có.
+        Chỉ refine khi không còn frame chờ encode (đường truyền đang theo kịp).
+        """
+        job_q = getattr(self, "_job_q", None)
+        if not len(self._refine) or (job_q is not None and len(job_q) > 0):
+            return []
+        rects = self._refine.take_ready(self.refine_after, self.REFINE_MAX_TILES)
+        with self.timings.measure("scale"):
+            return [scaler.region(frame, scaler.native_rect(rect)) for rect in rects]
+
+    def _scaled_tile_keys(self, frame, boxes, scaler):
+        # Hash trên pixel gốc, khóa theo tọa độ ô sau khi thu nhỏ (tọa độ manager nhận được)
+        keys = frame_tile_keys(frame, boxes, self._detector.tile_size)
+        if scaler.identity:
+            return keys
+        return {scaler.rect(tile): key for tile, key in keys.items()}
+
+    def capture_loop(self, callback):
+        """
+        Pipeline: capture -> diff (luồng này) -> encode (pool) -> send (luồng riêng).
+        Encode chậm không làm lệch nhịp chụp: frame chưa kịp encode bị thay bằng frame mới nhất.
+        """
+        print(f"[ClientScreenshot] Bắt đầu capture loop (Pipeline: capture -> encode x{self.encode_workers} -> send)...")
+
+        self._job_q = job_q = LatestWinsQueue(maxsize=1, merge=self._merge_jobs)
+        send_q = queue.Queue(maxsize=self.encode_workers)
+        done = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.encode_workers, thread_name_prefix="jpeg-encode")
+        encode_thread = threading.Thread(target=self._encode_stage, args=(job_q, send_q, pool, done), daemon=True)
+        send_thread = threading.Thread(target=self._send_stage, args=(callback, send_q), daemon=True)
+        encode_thread.start()
+        send_thread.start()
+
+        next_tick = time.perf_counter()
+        while not self.stop:
+            try:
+                job = self._capture_stage()
+                if job is not None:
+                    job_q.put(job)
             except Exception as e:
                 print(f"[ClientScreenshot] Lỗi: {e}")
-                # import traceback
-                # traceback.print_exc()
+            # fps tick kế tiếp theo mức hoạt động (sàn / trần theo chế độ view/control)
+            fps = self.governor.record_tick(self._change_fraction)
+
+            # Giữ nhịp theo deadline
+            tick_start = next_tick
+            interval = 1.0 / max(fps, 0.01)
+            next_tick += interval
+            now = time.perf_counter()
+            if next_tick < now - interval:
+                # Trễ quá một chu kỳ (máy bị treo / capture quá chậm) -> bắt nhịp lại thay vì chụp dồn
+                tick_start = next_tick = now
+            # Ngủ theo từng đoạn ngắn để dừng được ngay (fps thấp = chu kỳ 3 giây)
+            while not self.stop and next_tick > now:
+                time.sleep(min(0.1, next_tick - now))
+                now = time.perf_counter()
+                # Input từ manager nâng fps -> rút ngắn chu kỳ đang chờ thay vì đợi hết chu kỳ idle
+                next_tick = min(next_tick, tick_start + 1.0 / max(self.fps, 0.01))
+                if self._keyframe_due(time.time()):
+                    break  # Viewer đang chờ keyframe: không đợi hết chu kỳ idle (fps thấp)
+
+        done.set()
+        job_q.close()
+        encode_thread.join(timeout=2.0)
+        send_thread.join(timeout=2.0)
+        pool.shutdown(wait=False)
+
+        # Đóng phiên chụp trong chính luồng capture (mss gắn với luồng tạo ra nó)
+        self.backend.close()
+
+
+class _FrameJob:
+    """
+    Một frame đi qua pipeline: danh sách (bbox, ảnh PIL), bbox None = FULL frame.
+    tile_keys: {ô lưới -> hash} cho bitmap cache (None = không dùng cache)
+    keyframe: FULL bắt buộc (đầu tiên / bị ép / định kỳ) -> RESET bitmap cache
+    moves: [(src_rect, (dst_x, dst_y))] copy-rect áp dụng trước các vùng (chỉ có ở frame RECT)
+    tile_size: kích thước ô lưới trong tọa độ đã thu nhỏ (tọa độ của regions / tile_keys)
+    refine: [(bbox, ảnh PIL)] gửi lại ở refine_quality, không qua bitmap cache, gửi trước regions
+    frame_no: số frame của RefinementTracker lúc chụp (đối chiếu khi xác nhận vùng lossless)
+    roi: [rect đã thu nhỏ] vùng quan trọng; vùng không chạm ROI được encode chất lượng thấp hơn (None = không có)
+    viewport: (l, u, r, b, native_w, native_h) vùng màn hình của frame, None = cả màn hình (gửi kèm FULL)
+    """
+
+    __slots__ = ("width", "height", "regions", "ts_ms", "quality", "tile_keys", "keyframe", "moves", "tile_size",
+                 "refine", "frame_no", "roi", "viewport")
+
+    def __init__(self, width, height, regions, ts_ms, quality, tile_keys=None, keyframe=False, moves=(),
+                 tile_size=64, refine=(), frame_no=0, roi=None, viewport=None):
+        self.width = width
+        self.height = height
+        self.regions = regions
+        self.ts_ms = ts_ms
+        self.quality = quality
+        self.tile_keys = tile_keys
+        self.keyframe = keyframe
+        self.moves = moves
+        self.tile_size = tile_size
+        self.refine = list(refine)
+        self.frame_no = frame_no
+        self.roi = roi
+        self.viewport = viewport
 
-            # Điều chỉnh FPS
-            elapsed = time.perf_counter() - start_time
-            time.sleep(max(0, interval - elapsed))
\ No newline at end of file
+    @property
+    def is_full(self):
+        return bool(self.regions) and self.regions[0][0] is None
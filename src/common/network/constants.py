@@ -8,6 +8,8 @@ PDU_TYPE_RECT = 2
 PDU_TYPE_CONTROL = 3
 PDU_TYPE_INPUT = 4
 PDU_TYPE_CURSOR = 5
+PDU_TYPE_CACHE = 6 # bitmap cache: dùng lại ô ảnh manager đã có (kênh video)
+PDU_TYPE_COPY = 7 # copy-rect: dịch một vùng trong ảnh nền của manager (cuộn / kéo cửa sổ)
 
 # File transfer PDUs
 PDU_TYPE_FILE_START = 10 # báo hiệu bắt đầu truyền file
@@ -25,11 +27,69 @@ FRAGMENT_FLAG = 0x01 # bit flag (1) đánh dấu PDU bị phân mảnh
 FRAGMENT_HDR_FMT = ">QI" # fragment header: total_size (Q - 8 bytes), offset (I - 4 bytes)
 FRAGMENT_HDR_SIZE = struct.calcsize(FRAGMENT_HDR_FMT) # kích thước fragment header
 
+# Codec của payload video (FULL/RECT), lưu ở bit 1-3 của flags
+VIDEO_CODEC_SHIFT = 1
+VIDEO_CODEC_MASK = 0x0E
+CODEC_JPEG = 0 # ảnh thường / ảnh chụp (mặc định, tương thích client cũ)
+CODEC_PNG = 1 # lossless PNG cho vùng văn bản nhiều màu (khử răng cưa)
+CODEC_PALETTE = 2 # lossless: bảng màu (<= 256 màu) + chỉ số nén zlib
+CODEC_RGB565 = 3 # màu 16 bit: pixel 5-6-5 (2 byte, little-endian) nén zlib
+
+# Chế độ màu của luồng video cho đường truyền yếu, từ ít hạn chế tới nhiều hạn chế nhất.
+# Vùng ảnh chụp luôn đi JPEG (JPEG xám ở "gray"); các chế độ khác chỉ đổi vùng lossless.
+COLOR_MODES = ("full", "rgb16", "palette8", "gray")
+
+# Màn hình nguồn của PDU video (FULL/RECT/COPY/CACHE), lưu ở bit 4-6 của flags
+MONITOR_SHIFT = 4
+MONITOR_MASK = 0x70
+MAX_MONITORS = 8 # id 0 = màn hình chính (mss monitors[1]), tương thích client cũ
+
+# Viewport (phần đuôi tùy chọn của PDU_TYPE_FULL, sau payload): vùng màn hình l, u, r, b (I) và kích thước
+# màn hình native_w, native_h (I) mà frame thể hiện. Không có = cả màn hình (parser cũ bỏ qua phần đuôi)
+# Bit 7 của flags báo có phần đuôi để bộ tách luồng tính đúng độ dài PDU
+VIEWPORT_FLAG = 0x80
+VIEWPORT_FMT = ">IIIIII"
+VIEWPORT_SIZE = struct.calcsize(VIEWPORT_FMT)
+
+# Bitmap cache (PDU_TYPE_CACHE)
+# header: full_w (I), full_h (I), tile_size (H), số op (I); mỗi op: loại (B), slot (H), x (H), y (H)
+CACHE_HDR_FMT = ">IIHI"
+CACHE_HDR_SIZE = struct.calcsize(CACHE_HDR_FMT)
+CACHE_OP_FMT = ">BHHH"
+CACHE_OP_SIZE = struct.calcsize(CACHE_OP_FMT)
+CACHE_OP_RESET = 0 # xóa cache, slot = dung lượng mới (0 = tắt cache)
+CACHE_OP_HIT = 1 # dán ô ở slot vào (x, y)
+CACHE_OP_STORE = 2 # lưu ô tại (x, y) của ảnh hiện tại vào slot
+
+# Copy-rect (PDU_TYPE_COPY): vùng nguồn x, y, w, h (I) -> điểm đích dst_x, dst_y (I), kèm full_w, full_h (I)
+COPY_FMT = ">IIIIIIII"
+COPY_SIZE = struct.calcsize(COPY_FMT)
+
+# Hình dạng con trỏ (phần shape của PDU_TYPE_CURSOR, rỗng = giữ hình dạng cũ): op (B), id trong cache (H)
+# DEFINE kèm w, h, hot_x, hot_y (H) + ảnh RGBA nén zlib; lần sau cùng hình dạng chỉ gửi USE + id
+CURSOR_SHAPE_HDR_FMT = ">BH"
+CURSOR_SHAPE_HDR_SIZE = struct.calcsize(CURSOR_SHAPE_HDR_FMT)
+CURSOR_SHAPE_DEFINE_FMT = ">HHHH"
+CURSOR_SHAPE_DEFINE_SIZE = struct.calcsize(CURSOR_SHAPE_DEFINE_FMT)
+CURSOR_SHAPE_DEFINE = 1 # lưu hình dạng vào id rồi dùng nó
+CURSOR_SHAPE_USE = 2 # dùng hình dạng đã lưu ở id
+CURSOR_SHAPE_HIDDEN = 3 # con trỏ đang ẩn (id bỏ qua)
+CURSOR_SHAPE_CACHE_SIZE = 32 # số hình dạng mỗi bên giữ (client chọn id bị thay thế)
+
 # TPKT 
 TPKT_HEADER_FMT = ">BBH" # TPKT header format: version (B - 1 byte), reserved (B - 1 byte), length (H - 2 bytes)
 TPKT_OVERHEAD = 4 # TPKT header size in bytes
 MAX_TPKT_LENGTH = 65535 # maximum TPKT length
 
+# Framing v2 (thỏa thuận trong X224Handshake qua byte reserved của TPKT handshake, peer cũ luôn gửi 0):
+# - TPKT: byte reserved là 8 bit cao của length -> độ dài 24 bit
+# - MCS: frame có payload > 64 KB dùng header mở rộng channel_id | MCS_EXT_FLAG (H), length (I)
+# PDU lớn (FULL frame) đi nguyên một TPKT, không cần chia fragment 64000 byte
+FRAMING_V1 = 1
+FRAMING_V2 = 2
+MAX_TPKT_V2_LENGTH = 0xFFFFFF # ~16 MB
+V1_FRAGMENT_SIZE = 64000 # kích thước fragment khi đầu bên kia chỉ hiểu framing v1
+
 # Event types (input)
 class EventType:
     MOUSE_MOVE = "mouse_move"
@@ -41,7 +101,12 @@ class EventType:
 # MCS Layer
 MCS_HDR_FMT = ">HH" # 2-bytes channel id & 2-bytes payload_length
 MCS_HDR_SIZE = struct.calcsize(MCS_HDR_FMT) # = 4 bytes
-MAX_CHANNEL_BUFFER = 2 * 1024 * 1024
+MCS_EXT_FLAG = 0x8000 # bit cao của channel_id: header mở rộng (framing v2)
+MCS_EXT_HDR_FMT = ">HI" # channel_id | MCS_EXT_FLAG (H), payload_length (I)
+MCS_EXT_HDR_SIZE = struct.calcsize(MCS_EXT_HDR_FMT) # = 6 bytes
+MAX_CHANNEL_BUFFER = 2 * 1024 * 1024 # giới hạn dữ liệu dồn lại của một kênh (một frame đơn lẻ luôn được nhận)
+# PDU lớn nhất đi nguyên khối qua framing v2
+MAX_V2_PDU_SIZE = MAX_TPKT_V2_LENGTH - TPKT_OVERHEAD - MCS_EXT_HDR_SIZE
 
 # Các hằng số đảm bảo PDUParser hoạt động an toàn 
 FRAGMENT_ASSEMBLY_TIMEOUT = 30.0 # Thời gian chờ lắp ráp tối đa 
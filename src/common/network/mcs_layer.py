@@ -3,8 +3,10 @@
 import struct
 import logging
 from collections import defaultdict
-from typing import Optional, Dict, Tuple
-from .constants import MCS_HDR_FMT, MCS_HDR_SIZE, MAX_CHANNEL_BUFFER
+from typing import Optional, Dict, List, Tuple
+from .constants import (
+    MCS_HDR_FMT, MCS_HDR_SIZE, MCS_EXT_FLAG, MCS_EXT_HDR_FMT, MCS_EXT_HDR_SIZE, MAX_CHANNEL_BUFFER,
+)
 
 log = logging.getLogger(__name__)
 class MCSLite:
@@ -14,16 +16,41 @@ class MCSLite:
         self._channel_names: Dict[int, str] = {} # ánh xạ ID sang tên kênh
 
     # đóng gói PDU với header MCS (channel_id (H), length (H)) + payload
+    # payload > 64 KB: header mở rộng (framing v2), chỉ gửi được cho peer đã thỏa thuận v2
     @staticmethod
     def build(channel_id: int, payload: bytes) -> bytes:
-        length = len(payload)
-        header = struct.pack(MCS_HDR_FMT, channel_id, length)
-        return header + payload
+        return MCSLite.header(channel_id, len(payload)) + payload
 
-    # thêm dữ liệu thô (từ TPKT) vào buffer để giải mã
-    def feed(self, data: bytes) -> None:
-        self.buffer.extend(data)
-        self._process_buffer()
+    # chỉ header MCS cho payload dài length (payload gửi riêng, xem TPKTLayer.frame_header)
+    @staticmethod
+    def header(channel_id: int, length: int) -> bytes:
+        if length > 0xFFFF:
+            return struct.pack(MCS_EXT_HDR_FMT, channel_id | MCS_EXT_FLAG, length)
+        return struct.pack(MCS_HDR_FMT, channel_id, length)
+
+    # tách (channel_id, payload) từ một MCS frame đã build, payload là memoryview (không copy)
+    @staticmethod
+    def unpack_frame(mcs_frame: bytes) -> Tuple[int, memoryview]:
+        (channel_id,) = struct.unpack_from(">H", mcs_frame)
+        if channel_id & MCS_EXT_FLAG:
+            channel_id, payload_len = struct.unpack_from(MCS_EXT_HDR_FMT, mcs_frame)
+            hdr_size = MCS_EXT_HDR_SIZE
+        else:
+            channel_id, payload_len = struct.unpack_from(MCS_HDR_FMT, mcs_frame)
+            hdr_size = MCS_HDR_SIZE
+        return channel_id & ~MCS_EXT_FLAG, memoryview(mcs_frame)[hdr_size:hdr_size + payload_len]
+
+    # thêm dữ liệu thô (từ TPKT, bytes hoặc memoryview) vào buffer để giải mã
+    def feed(self, data) -> None:
+        if self.buffer:
+            self.buffer.extend(data)
+            self._process_buffer()
+            return
+        # buffer chung rỗng (thường gặp: 1 TPKT = trọn MCS frame) -> tách thẳng trên data, chỉ giữ phần dư
+        with memoryview(data) as view:
+            consumed = self._split_frames(view)
+            if consumed < len(view):
+                self.buffer.extend(view[consumed:])
 
     # giải mã 1 PDU từ buffer, trả về (channel_id, payload)
     # def unpack(self) -> Tuple[int, bytes]:
@@ -36,33 +63,42 @@ class MCSLite:
 
     # vòng lặp xử lý buffer thô để tách các MCS frame
     def _process_buffer(self) -> None:
-        while True:
-            if len(self.buffer) < MCS_HDR_SIZE:
-                break 
+        with memoryview(self.buffer) as view:
+            consumed = self._split_frames(view)
+        # xóa các frame đã xử lý khỏi buffer chung (một lần)
+        if consumed:
+            del self.buffer[:consumed]
 
+    # tách các MCS frame đầy đủ trong view vào buffer của từng kênh, trả về số byte đã dùng
+    def _split_frames(self, view: memoryview) -> int:
+        pos = 0
+        end = len(view)
+        while end - pos >= MCS_HDR_SIZE:
             # đọc header (channel_id và length)
-            channel_id, payload_len = struct.unpack_from(MCS_HDR_FMT, self.buffer)
-            
-            frame_total_len = MCS_HDR_SIZE + payload_len
-            if len(self.buffer) < frame_total_len:
-                break
+            channel_id, payload_len = struct.unpack_from(MCS_HDR_FMT, view, pos)
+            hdr_size = MCS_HDR_SIZE
+            if channel_id & MCS_EXT_FLAG:
+                # header mở rộng (framing v2): length 32 bit
+                if end - pos < MCS_EXT_HDR_SIZE:
+                    break
+                channel_id, payload_len = struct.unpack_from(MCS_EXT_HDR_FMT, view, pos)
+                channel_id &= ~MCS_EXT_FLAG
+                hdr_size = MCS_EXT_HDR_SIZE
 
-            # trích xuất payload khi đã đủ data
-            payload_start = MCS_HDR_SIZE
-            payload_end = frame_total_len
-            payload = self.buffer[payload_start:payload_end]
+            frame_total_len = hdr_size + payload_len
+            if end - pos < frame_total_len:
+                break
 
             # đưa payload vào buffer của kênh tương ứng
             ch_buf = self.channel_buffers[channel_id]
-            if len(ch_buf) + payload_len > MAX_CHANNEL_BUFFER:
+            if ch_buf and len(ch_buf) + payload_len > MAX_CHANNEL_BUFFER:
                 # chống overflow, xóa buffer của kênh này và báo lỗi
                 log.error(f"Channel {channel_id} buffer overflow. Dropping data.")
                 ch_buf.clear()
-            
-            ch_buf.extend(payload)
 
-            # xóa frame đã xử lý khỏi buffer chung
-            del self.buffer[:frame_total_len]
+            ch_buf += view[pos + hdr_size:pos + frame_total_len]
+            pos += frame_total_len
+        return pos
 
     # lấy PDU tiếp theo
     # def next_pdu(self) -> Tuple[Optional[int], Optional[bytes]]:
@@ -81,7 +117,14 @@ class MCSLite:
         payload_data = bytes(ch_buf)
         ch_buf.clear()
         return payload_data
-    
+
+    # Lấy dữ liệu của các kênh vừa có dữ liệu mới: [(channel_id, bytearray)], trao luôn buffer (không copy)
+    def drain(self) -> List[Tuple[int, bytearray]]:
+        ready = [(ch, buf) for ch, buf in self.channel_buffers.items() if buf]
+        for ch, _ in ready:
+            self.channel_buffers[ch] = bytearray()
+        return ready
+
     # kiểm tra xem buffer của kênh có bao nhiêu data chờ xử lý
     def get_channel_data_size(self, channel_id: int) -> int:
         return len(self.channel_buffers.get(channel_id, b''))
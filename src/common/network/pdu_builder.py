@@ -3,17 +3,23 @@
 import json
 import struct
 import time
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple, Union
 from src.common.network.constants import (
-    PDU_TYPE_FULL, PDU_TYPE_RECT, PDU_TYPE_CONTROL, PDU_TYPE_INPUT, PDU_TYPE_CURSOR,
+    PDU_TYPE_FULL, PDU_TYPE_RECT, PDU_TYPE_CONTROL, PDU_TYPE_INPUT, PDU_TYPE_CURSOR, PDU_TYPE_CACHE, PDU_TYPE_COPY,
     PDU_TYPE_FILE_START, PDU_TYPE_FILE_CHUNK, PDU_TYPE_FILE_END, PDU_TYPE_FILE_ACK, PDU_TYPE_FILE_NAK,
     SHARE_CTRL_HDR_FMT,
     FRAGMENT_FLAG, FRAGMENT_HDR_FMT,
+    VIDEO_CODEC_SHIFT, VIDEO_CODEC_MASK, CODEC_JPEG, MONITOR_SHIFT, MONITOR_MASK,
+    CACHE_HDR_FMT, CACHE_OP_FMT, COPY_FMT, VIEWPORT_FLAG, VIEWPORT_FMT,
+    CURSOR_SHAPE_HDR_FMT, CURSOR_SHAPE_DEFINE_FMT, CURSOR_SHAPE_DEFINE,
 )
 
 FRAGMENT_HDR_SIZE = struct.calcsize(FRAGMENT_HDR_FMT)
 SHARE_HDR_SIZE = struct.calcsize(SHARE_CTRL_HDR_FMT)
 
+# Một đoạn của PDU gửi theo kiểu scatter-gather (header nhỏ là bytes, payload lớn là memoryview)
+Segment = Union[bytes, bytearray, memoryview]
+
 class PDUBuilder:
     # xây dựng header chung cho PDU với seq, ts_ms, ptype, flags
     @staticmethod
@@ -27,20 +33,68 @@ class PDUBuilder:
     - Nối (concatenate) tất cả lại: header_chung + header_riêng + payload_dữ_liệu 
     """
 
-    # tạo pdu full frame 
+    # gắn codec của payload video vào các bit flags
+    @staticmethod
+    def _video_flags(flags: int, codec: int, monitor: int = 0) -> int:
+        flags = (flags & ~VIDEO_CODEC_MASK) | ((codec << VIDEO_CODEC_SHIFT) & VIDEO_CODEC_MASK)
+        return PDUBuilder._monitor_flags(flags, monitor)
+
+    # gắn id màn hình nguồn vào các bit flags
+    @staticmethod
+    def _monitor_flags(flags: int, monitor: int) -> int:
+        return (flags & ~MONITOR_MASK) | ((monitor << MONITOR_SHIFT) & MONITOR_MASK)
+
+    # tạo pdu full frame (jpeg_bytes: payload đã encode theo codec)
+    # viewport: (l, u, r, b, native_w, native_h) khi frame chỉ là một vùng của màn hình
     @staticmethod
-    def build_full_frame_pdu(seq: int, jpeg_bytes: bytes, width: int, height: int, flags: int = 0) -> bytes:
-        header = PDUBuilder._hdr(seq, PDU_TYPE_FULL, flags)
+    def build_full_frame_pdu(seq: int, jpeg_bytes: bytes, width: int, height: int, flags: int = 0, codec: int = CODEC_JPEG,
+                             monitor: int = 0, viewport: Optional[Tuple[int, int, int, int, int, int]] = None) -> bytes:
+        return b"".join(PDUBuilder.build_full_frame_segments(seq, jpeg_bytes, width, height, flags, codec, monitor, viewport))
+
+    # như build_full_frame_pdu nhưng trả về các đoạn [header, payload (memoryview), trailer], không nối payload
+    @staticmethod
+    def build_full_frame_segments(seq: int, jpeg_bytes: bytes, width: int, height: int, flags: int = 0,
+                                  codec: int = CODEC_JPEG, monitor: int = 0,
+                                  viewport: Optional[Tuple[int, int, int, int, int, int]] = None) -> List[Segment]:
+        if viewport:
+            flags |= VIEWPORT_FLAG
+        header = PDUBuilder._hdr(seq, PDU_TYPE_FULL, PDUBuilder._video_flags(flags, codec, monitor))
         frame_hdr = struct.pack(">III", width, height, len(jpeg_bytes))
-        return header + frame_hdr + jpeg_bytes
+        segments = [header + frame_hdr, memoryview(jpeg_bytes)]
+        if viewport:
+            segments.append(struct.pack(VIEWPORT_FMT, *viewport))
+        return segments
 
     # tạo pdu rect frame
     @staticmethod
-    def build_rect_frame_pdu(seq: int, jpeg_bytes: bytes, x: int, y: int, w: int, h: int, full_w: int, full_h: int, flags: int = 0) -> bytes:
-        header = PDUBuilder._hdr(seq, PDU_TYPE_RECT, flags)
+    def build_rect_frame_pdu(seq: int, jpeg_bytes: bytes, x: int, y: int, w: int, h: int, full_w: int, full_h: int, flags: int = 0,
+                             codec: int = CODEC_JPEG, monitor: int = 0) -> bytes:
+        return b"".join(PDUBuilder.build_rect_frame_segments(seq, jpeg_bytes, x, y, w, h, full_w, full_h, flags, codec,
+                                                             monitor))
+
+    # như build_rect_frame_pdu nhưng trả về các đoạn [header, payload (memoryview)]
+    @staticmethod
+    def build_rect_frame_segments(seq: int, jpeg_bytes: bytes, x: int, y: int, w: int, h: int, full_w: int, full_h: int,
+                                  flags: int = 0, codec: int = CODEC_JPEG, monitor: int = 0) -> List[Segment]:
+        header = PDUBuilder._hdr(seq, PDU_TYPE_RECT, PDUBuilder._video_flags(flags, codec, monitor))
         rect_hdr = struct.pack(">IIIII", x, y, w, h, len(jpeg_bytes))
         full_dim = struct.pack(">II", full_w, full_h)
-        return header + rect_hdr + full_dim + jpeg_bytes
+        return [header + rect_hdr + full_dim, memoryview(jpeg_bytes)]
+
+    # tạo pdu bitmap cache: danh sách op (loại, slot, x, y) áp dụng theo thứ tự
+    @staticmethod
+    def build_cache_pdu(seq: int, full_w: int, full_h: int, tile_size: int, ops: List[Tuple[int, int, int, int]],
+                        monitor: int = 0) -> bytes:
+        header = PDUBuilder._hdr(seq, PDU_TYPE_CACHE, PDUBuilder._monitor_flags(0, monitor))
+        cache_hdr = struct.pack(CACHE_HDR_FMT, full_w, full_h, tile_size, len(ops))
+        return header + cache_hdr + b"".join(struct.pack(CACHE_OP_FMT, *op) for op in ops)
+
+    # tạo pdu copy-rect: manager chép vùng (x, y, w, h) của ảnh nền tới (dst_x, dst_y)
+    @staticmethod
+    def build_copy_rect_pdu(seq: int, x: int, y: int, w: int, h: int, dst_x: int, dst_y: int, full_w: int, full_h: int,
+                            monitor: int = 0) -> bytes:
+        header = PDUBuilder._hdr(seq, PDU_TYPE_COPY, PDUBuilder._monitor_flags(0, monitor))
+        return header + struct.pack(COPY_FMT, x, y, w, h, dst_x, dst_y, full_w, full_h)
 
     # tạo pdu control chung (ngắt kết nối, ping, ...)
     @staticmethod
@@ -69,6 +123,15 @@ class PDUBuilder:
         if cursor_shape_data:
             return header + cursor_hdr + cursor_shape_data
         return header + cursor_hdr
+
+    # tạo phần shape của pdu con trỏ (cursor_shape_data): DEFINE kèm ảnh RGBA đã nén zlib, USE / HIDDEN chỉ có id
+    @staticmethod
+    def build_cursor_shape(op: int, shape_id: int, width: int = 0, height: int = 0, hot_x: int = 0, hot_y: int = 0,
+                           rgba_zlib: bytes = b"") -> bytes:
+        shape_hdr = struct.pack(CURSOR_SHAPE_HDR_FMT, op, shape_id)
+        if op != CURSOR_SHAPE_DEFINE:
+            return shape_hdr
+        return shape_hdr + struct.pack(CURSOR_SHAPE_DEFINE_FMT, width, height, hot_x, hot_y) + rgba_zlib
     
     # tạo pdu bắt đầu truyền file
     @staticmethod
@@ -108,28 +171,39 @@ class PDUBuilder:
     # phân mảnh 1 PDU lớn thành nhiều fragment nhỏ hơn max_payload
     @staticmethod
     def fragmentize(pdu_bytes: bytes, max_payload: int) -> List[Tuple[int, bytes]]:
-        import struct as _struct
-        hdr_size = _struct.calcsize(SHARE_CTRL_HDR_FMT)
-        if len(pdu_bytes) < hdr_size:
+        return [(offset, b"".join(segments)) for offset, segments in PDUBuilder.iter_fragments([pdu_bytes], max_payload)]
+
+    # sinh lần lượt (offset, các đoạn của fragment) từ PDU dạng danh sách đoạn (segments[0] bắt đầu bằng header chung)
+    # mỗi fragment: [header chung + header fragment, các lát memoryview của payload], không copy payload
+    @staticmethod
+    def iter_fragments(segments: List[Segment], max_payload: int) -> Iterator[Tuple[int, List[Segment]]]:
+        first = memoryview(segments[0])
+        if len(first) < SHARE_HDR_SIZE:
             raise ValueError("pdu_bytes too small")
 
-        seq, ts_ms, ptype, flags = _struct.unpack(SHARE_CTRL_HDR_FMT, pdu_bytes[:hdr_size])
-        body = pdu_bytes[hdr_size:]
-        total_len = len(body)
-        fragments = []
-        offset = 0
+        seq, ts_ms, ptype, flags = struct.unpack_from(SHARE_CTRL_HDR_FMT, first)
+        body = [first[SHARE_HDR_SIZE:]] + [memoryview(seg) for seg in segments[1:]]
+        body = [view for view in body if len(view)]
+        total_len = sum(len(view) for view in body)
 
-        avail = max_payload - hdr_size - (_struct.calcsize(FRAGMENT_HDR_FMT))
+        avail = max_payload - SHARE_HDR_SIZE - FRAGMENT_HDR_SIZE
         if avail <= 0:
             raise ValueError("max_payload too small for any fragment")
 
+        new_hdr = struct.pack(SHARE_CTRL_HDR_FMT, seq, ts_ms, ptype, flags | FRAGMENT_FLAG)
+        offset = 0
+        idx, pos = 0, 0  # đoạn và vị trí đang đọc trong body
         while offset < total_len:
-            chunk = body[offset: offset + avail]
-            new_flags = flags | FRAGMENT_FLAG
-            new_hdr = _struct.pack(SHARE_CTRL_HDR_FMT, seq, ts_ms, ptype, new_flags)
-            frag_hdr = _struct.pack(FRAGMENT_HDR_FMT, offset, total_len)
-            frag_bytes = new_hdr + frag_hdr + chunk
-            fragments.append((offset, frag_bytes))
-            offset += len(chunk)
-
-        return fragments
+            size = min(avail, total_len - offset)
+            frag = [new_hdr + struct.pack(FRAGMENT_HDR_FMT, offset, total_len)]
+            need = size
+            while need:
+                view = body[idx]
+                take = min(need, len(view) - pos)
+                frag.append(view[pos:pos + take])
+                pos += take
+                need -= take
+                if pos == len(view):
+                    idx, pos = idx + 1, 0
+            yield offset, frag
+            offset += size
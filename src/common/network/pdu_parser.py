@@ -1,90 +1,104 @@
 # common_network/pdu_parser.py
 
+import bisect
+import heapq
+import itertools
 import json
 import struct
 import time
 from typing import Optional, Dict,  Tuple
 from src.common.network.constants import (
-    PDU_TYPE_CURSOR, PDU_TYPE_FULL, PDU_TYPE_RECT, PDU_TYPE_CONTROL, PDU_TYPE_INPUT,
+    PDU_TYPE_CURSOR, PDU_TYPE_FULL, PDU_TYPE_RECT, PDU_TYPE_CONTROL, PDU_TYPE_INPUT, PDU_TYPE_CACHE, PDU_TYPE_COPY,
     PDU_TYPE_FILE_START, PDU_TYPE_FILE_CHUNK, PDU_TYPE_FILE_END, PDU_TYPE_FILE_ACK, PDU_TYPE_FILE_NAK,
     SHARE_CTRL_HDR_FMT, SHARE_HDR_SIZE,
     FRAGMENT_FLAG, FRAGMENT_HDR_FMT, FRAGMENT_HDR_SIZE,
-    FRAGMENT_ASSEMBLY_TIMEOUT, MAX_FRAGMENTS_PER_SEQ, MAX_BUFFERED_BYTES_PER_SEQ
+    FRAGMENT_ASSEMBLY_TIMEOUT, MAX_FRAGMENTS_PER_SEQ, MAX_BUFFERED_BYTES_PER_SEQ,
+    VIDEO_CODEC_SHIFT, VIDEO_CODEC_MASK, MONITOR_SHIFT, MONITOR_MASK,
+    CACHE_HDR_FMT, CACHE_HDR_SIZE, CACHE_OP_FMT, CACHE_OP_SIZE, COPY_FMT, COPY_SIZE, VIEWPORT_FLAG, VIEWPORT_FMT, VIEWPORT_SIZE,
+    CURSOR_SHAPE_HDR_FMT, CURSOR_SHAPE_HDR_SIZE, CURSOR_SHAPE_DEFINE_FMT, CURSOR_SHAPE_DEFINE_SIZE, CURSOR_SHAPE_DEFINE,
 )
 
 class PDUParser:
     def __init__(self):
-        self.fragment_buffer: Dict[int, Dict] = {} # [seq, dict ["total", "parts" (offset->bytes), "ptype", "ts_ms", "first_ts"]]
+        # [seq, dict ["total", "buf" (header + payload, cấp phát một lần), "ranges" (offset->len),
+        #             "starts" (các offset đã nhận, tăng dần), "received", "ptype", "ts_ms", "flags", "gen"]]
+        self.fragment_buffer: Dict[int, Dict] = {}
+        self._deadlines = [] # heap (hạn lắp ráp, gen, seq); mục của PDU đã xong / đã hủy bị bỏ qua khi tới hạn
+        self._gen = itertools.count()
 
     # Kiểm tra xem PDU có phải là fragment không
     def _is_fragment(self, flags: int) -> bool:
         return (flags & FRAGMENT_FLAG) != 0
 
-    # Dọn dẹp các fragment cũ đã hết hạn
+    # Dọn dẹp các fragment cũ đã hết hạn (chỉ xem các mục tới hạn ở đầu heap, không quét hết)
     def _cleanup_old_fragments(self) -> None:
-        now = time.time()
-        to_delete = []
-        for seq, meta in list(self.fragment_buffer.items()):
-            first_ts = meta.get("first_ts", now)
-            if now - first_ts > FRAGMENT_ASSEMBLY_TIMEOUT:
-                to_delete.append(seq)
-        for seq in to_delete:
-            try:
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, gen, seq = heapq.heappop(self._deadlines)
+            meta = self.fragment_buffer.get(seq)
+            if meta is not None and meta["gen"] == gen:
                 del self.fragment_buffer[seq]
-            except KeyError:
-                pass
 
-    # Lưu fragment và kiểm tra xem có thể lắp ráp PDU hoàn chỉnh không
-    def _store_fragment(self, seq: int, ts_ms: int, ptype: int, frag_offset: int, total_len: int, payload: bytes) -> Optional[bytes]:
+    # Lưu fragment thẳng vào buffer của PDU (cấp phát theo total_len ở fragment đầu tiên),
+    # trả về PDU hoàn chỉnh (bytearray, header đã xóa cờ fragment) khi đủ byte, ngược lại None
+    def _store_fragment(self, seq: int, ts_ms: int, ptype: int, frag_offset: int, total_len: int, payload,
+                        flags: int = 0) -> Optional[bytearray]:
         self._cleanup_old_fragments()
 
         meta = self.fragment_buffer.get(seq)
         if meta is None:
+            if total_len > MAX_BUFFERED_BYTES_PER_SEQ:
+                raise MemoryError("fragment assembly would exceed MAX_BUFFERED_BYTES_PER_SEQ")
             meta = {
                 "total": total_len,
-                "parts": {},
+                "buf": bytearray(SHARE_HDR_SIZE + total_len),
+                "ranges": {},
+                "starts": [],
+                "received": 0,
                 "ptype": ptype,
                 "ts_ms": ts_ms,
-                "first_ts": time.time(),
+                "flags": flags,
+                "gen": next(self._gen),
             }
             self.fragment_buffer[seq] = meta
+            heapq.heappush(self._deadlines, (time.monotonic() + FRAGMENT_ASSEMBLY_TIMEOUT, meta["gen"], seq))
 
         if total_len != meta["total"]:
-            try:
-                del self.fragment_buffer[seq]
-            except KeyError:
-                pass
+            del self.fragment_buffer[seq]
             raise ValueError("fragment total_len conflicted")
 
-        if len(meta["parts"]) >= MAX_FRAGMENTS_PER_SEQ:
+        size = len(payload)
+        if frag_offset + size > total_len:
             del self.fragment_buffer[seq]
-            raise MemoryError("too many fragments for seq")
+            raise ValueError("fragment exceeds total_len")
+
+        ranges, starts = meta["ranges"], meta["starts"]
+        # Khoảng [frag_offset, frag_offset + size) phải nằm trọn trong phần chưa nhận:
+        # fragment lặp (gửi lại) hoặc chồng lên dữ liệu đã có bị bỏ qua, không cộng vào received
+        i = bisect.bisect_right(starts, frag_offset)
+        if size == 0 or (i and starts[i - 1] + ranges[starts[i - 1]] > frag_offset) \
+                or (i < len(starts) and starts[i] < frag_offset + size):
+            return None
 
-        current_buffered = sum(len(b) for b in meta["parts"].values())
-        if current_buffered + len(payload) > MAX_BUFFERED_BYTES_PER_SEQ:
+        if len(ranges) >= MAX_FRAGMENTS_PER_SEQ:
             del self.fragment_buffer[seq]
-            raise MemoryError("fragment assembly would exceed MAX_BUFFERED_BYTES_PER_SEQ")
+            raise MemoryError("too many fragments for seq")
 
-        meta["parts"][frag_offset] = payload
+        start = SHARE_HDR_SIZE + frag_offset
+        meta["buf"][start:start + size] = payload
+        ranges[frag_offset] = size
+        starts.insert(i, frag_offset)  # fragment đến theo thứ tự -> chèn ở cuối
+        meta["received"] += size
 
-        received = sum(len(b) for b in meta["parts"].values())
-        if received >= meta["total"]:
-            parts = meta["parts"]
-            assembled = bytearray()
-            for off in sorted(parts.keys()):
-                assembled.extend(parts[off])
-            try:
-                del self.fragment_buffer[seq]
-            except KeyError:
-                pass
-            
-            # header PDU đã lắp ráp
-            flags = 0 # xóa cờ fragment
-            header = struct.pack(SHARE_CTRL_HDR_FMT, seq, meta["ts_ms"], meta["ptype"], flags)
-            
-            return header + assembled
-        
-        return None
+        if meta["received"] < total_len:
+            return None
+
+        del self.fragment_buffer[seq]
+        # header PDU đã lắp ráp
+        flags = meta["flags"] & ~FRAGMENT_FLAG # xóa cờ fragment, giữ các bit khác (codec)
+        buf = meta["buf"]
+        struct.pack_into(SHARE_CTRL_HDR_FMT, buf, 0, seq, meta["ts_ms"], meta["ptype"], flags)
+        return buf
 
     def parse(self, data: bytes, reassemble: bool = True) -> Optional[dict]:
         """
@@ -107,6 +121,8 @@ class PDUParser:
                 if ptype == PDU_TYPE_FULL: return {**base, "type": "full"}
                 if ptype == PDU_TYPE_RECT: return {**base, "type": "rect"}
                 if ptype == PDU_TYPE_CURSOR: return {**base, "type": "cursor"}
+                if ptype == PDU_TYPE_CACHE: return {**base, "type": "cache"}
+                if ptype == PDU_TYPE_COPY: return {**base, "type": "copy"}
                 return {**base, "type": "unknown_fragment"}
             
             if len(data) < SHARE_HDR_SIZE + FRAGMENT_HDR_SIZE:
@@ -114,8 +130,8 @@ class PDUParser:
             
             frag_offset, total_len = struct.unpack(FRAGMENT_HDR_FMT, data[offset:offset+FRAGMENT_HDR_SIZE])
             offset += FRAGMENT_HDR_SIZE 
-            frag_payload = data[offset:] # phần dữ liệu fragment
-            assembled_pdu_bytes = self._store_fragment(seq, ts_ms, ptype, frag_offset, total_len, frag_payload) # lưu fragment
+            frag_payload = memoryview(data)[offset:] # phần dữ liệu fragment (chép thẳng vào buffer lắp ráp)
+            assembled_pdu_bytes = self._store_fragment(seq, ts_ms, ptype, frag_offset, total_len, frag_payload, flags) # lưu fragment
             
             # nếu chưa đủ, _store_fragment trả về None. Hàm parse trả về PDU "đặc biệt"
             if assembled_pdu_bytes is None:
@@ -139,8 +155,14 @@ class PDUParser:
             offset += 12
             if offset + jpg_len > len(data):
                 raise ValueError("FULL jpg length exceeds payload")
-            jpg = data[offset:offset+jpg_len]
-            return {**base, "type": "full", "width": width, "height": height, "jpg": jpg}
+            jpg = memoryview(data)[offset:offset+jpg_len] # không copy payload ảnh (có thể vài MB)
+            pdu = {**base, "type": "full", "width": width, "height": height, "jpg": jpg,
+                   "codec": (flags & VIDEO_CODEC_MASK) >> VIDEO_CODEC_SHIFT,
+                   "monitor": (flags & MONITOR_MASK) >> MONITOR_SHIFT}
+            offset += jpg_len
+            if flags & VIEWPORT_FLAG and len(data) >= offset + VIEWPORT_SIZE:
+                pdu["viewport"] = struct.unpack(VIEWPORT_FMT, data[offset:offset + VIEWPORT_SIZE])
+            return pdu
 
         elif ptype == PDU_TYPE_RECT:
             if len(data) < offset + 20:
@@ -153,10 +175,35 @@ class PDUParser:
             offset += 8
             if offset + jpg_len > len(data):
                 raise ValueError("RECT jpg length exceeds payload")
-            jpg = data[offset:offset+jpg_len]
+            jpg = memoryview(data)[offset:offset+jpg_len]
             return {
                 **base, "type": "rect", "x": x, "y": y, "w": w, "h": h,
-                "full_w": full_w, "full_h": full_h, "jpg": jpg
+                "full_w": full_w, "full_h": full_h, "jpg": jpg,
+                "codec": (flags & VIDEO_CODEC_MASK) >> VIDEO_CODEC_SHIFT,
+                "monitor": (flags & MONITOR_MASK) >> MONITOR_SHIFT
+            }
+
+        elif ptype == PDU_TYPE_CACHE:
+            if len(data) < offset + CACHE_HDR_SIZE:
+                raise ValueError("CACHE too small")
+            full_w, full_h, tile_size, n_ops = struct.unpack(CACHE_HDR_FMT, data[offset:offset+CACHE_HDR_SIZE])
+            offset += CACHE_HDR_SIZE
+            if offset + n_ops * CACHE_OP_SIZE > len(data):
+                raise ValueError("CACHE ops exceed payload")
+            ops = [struct.unpack_from(CACHE_OP_FMT, data, offset + i * CACHE_OP_SIZE) for i in range(n_ops)]
+            return {
+                **base, "type": "cache", "full_w": full_w, "full_h": full_h,
+                "tile_size": tile_size, "ops": ops, "monitor": (flags & MONITOR_MASK) >> MONITOR_SHIFT
+            }
+
+        elif ptype == PDU_TYPE_COPY:
+            if len(data) < offset + COPY_SIZE:
+                raise ValueError("COPY too small")
+            x, y, w, h, dst_x, dst_y, full_w, full_h = struct.unpack(COPY_FMT, data[offset:offset+COPY_SIZE])
+            return {
+                **base, "type": "copy", "x": x, "y": y, "w": w, "h": h,
+                "dst_x": dst_x, "dst_y": dst_y, "full_w": full_w, "full_h": full_h,
+                "monitor": (flags & MONITOR_MASK) >> MONITOR_SHIFT
             }
 
         elif ptype == PDU_TYPE_CONTROL:
@@ -191,11 +238,21 @@ class PDUParser:
             offset += 12
             
             cursor_shape = data[offset:offset+shape_len]
-            
-            return {
+            pdu = {
                 **base, "type": "cursor", "x": x, "y": y, 
                 "cursor_shape": cursor_shape
             }
+            # Hình dạng con trỏ (rỗng = không đổi)
+            if len(cursor_shape) >= CURSOR_SHAPE_HDR_SIZE:
+                shape_op, shape_id = struct.unpack(CURSOR_SHAPE_HDR_FMT, cursor_shape[:CURSOR_SHAPE_HDR_SIZE])
+                pdu["shape_op"], pdu["shape_id"] = shape_op, shape_id
+                if shape_op == CURSOR_SHAPE_DEFINE:
+                    end = CURSOR_SHAPE_HDR_SIZE + CURSOR_SHAPE_DEFINE_SIZE
+                    if len(cursor_shape) < end:
+                        raise ValueError("CURSOR shape too small")
+                    w, h, hot_x, hot_y = struct.unpack(CURSOR_SHAPE_DEFINE_FMT, cursor_shape[CURSOR_SHAPE_HDR_SIZE:end])
+                    pdu.update({"shape_size": (w, h), "shape_hotspot": (hot_x, hot_y), "shape_rgba": cursor_shape[end:]})
+            return pdu
 
         elif ptype == PDU_TYPE_FILE_START:
             if len(data) < offset + 2:
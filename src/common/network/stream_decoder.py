@@ -0,0 +1,135 @@
+# common_network/stream_decoder.py
+
+import logging
+import struct
+from typing import List, Optional
+from src.common.network.constants import (
+    PDU_TYPE_FULL, PDU_TYPE_RECT, PDU_TYPE_CONTROL, PDU_TYPE_INPUT, PDU_TYPE_CURSOR, PDU_TYPE_CACHE, PDU_TYPE_COPY,
+    PDU_TYPE_FILE_START, PDU_TYPE_FILE_CHUNK, PDU_TYPE_FILE_END, PDU_TYPE_FILE_ACK, PDU_TYPE_FILE_NAK,
+    SHARE_CTRL_HDR_FMT, SHARE_HDR_SIZE, FRAGMENT_FLAG, FRAGMENT_HDR_SIZE,
+    CACHE_HDR_SIZE, CACHE_OP_SIZE, COPY_SIZE, VIEWPORT_FLAG, VIEWPORT_SIZE, MAX_V2_PDU_SIZE,
+)
+
+log = logging.getLogger(__name__)
+
+_SHARE_HDR = struct.Struct(SHARE_CTRL_HDR_FMT)
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+
+# ptype -> (vị trí trường độ dài sau header chung, kiểu trường, phần cố định sau header chung, số byte mỗi đơn vị)
+_LENGTH_FIELDS = {
+    PDU_TYPE_FULL: (8, _U32, 12, 1),                          # width, height, len + payload (+ viewport)
+    PDU_TYPE_RECT: (16, _U32, 28, 1),                         # x, y, w, h, len, full_w, full_h + payload
+    PDU_TYPE_CACHE: (10, _U32, CACHE_HDR_SIZE, CACHE_OP_SIZE),  # header + n_ops * op
+    PDU_TYPE_CONTROL: (0, _U32, 4, 1),
+    PDU_TYPE_INPUT: (0, _U32, 4, 1),
+    PDU_TYPE_CURSOR: (8, _U32, 12, 1),                        # x, y, shape_len + shape
+    PDU_TYPE_FILE_START: (0, _U16, 18, 1),                    # fn_len + tên + size, chunk, checksum (QII)
+    PDU_TYPE_FILE_CHUNK: (8, _U32, 12, 1),                    # offset (Q), len + dữ liệu
+    PDU_TYPE_FILE_NAK: (8, _U32, 12, 1),                      # offset (Q), len + lý do
+}
+# PDU có độ dài cố định (sau header chung)
+_FIXED_SIZES = {
+    PDU_TYPE_COPY: COPY_SIZE,
+    PDU_TYPE_FILE_END: 4,   # checksum (I)
+    PDU_TYPE_FILE_ACK: 8,   # ack_offset (Q)
+}
+
+
+def pdu_total_length(data, start: int = 0, end: Optional[int] = None) -> Optional[int]:
+    """
+    Tổng độ dài PDU bắt đầu tại data[start] (data: bytes / bytearray / memoryview, không copy).
+    None = chưa đủ header để biết độ dài; ValueError = loại PDU không xác định.
+    Fragment không có trường độ dài: mỗi fragment đi trong một MCS frame riêng nên chiếm hết phần đã nhận.
+    """
+    if end is None:
+        end = len(data)
+    avail = end - start
+    if avail < SHARE_HDR_SIZE:
+        return None
+    _, _, ptype, flags = _SHARE_HDR.unpack_from(data, start)
+
+    if flags & FRAGMENT_FLAG:
+        return avail if avail >= SHARE_HDR_SIZE + FRAGMENT_HDR_SIZE else None
+
+    fixed = _FIXED_SIZES.get(ptype)
+    if fixed is not None:
+        return SHARE_HDR_SIZE + fixed
+
+    spec = _LENGTH_FIELDS.get(ptype)
+    if spec is None:
+        raise ValueError(f"Loại PDU không xác định: {ptype}")
+    field_off, field, base, unit = spec
+    if avail < SHARE_HDR_SIZE + field_off + field.size:
+        return None
+    (count,) = field.unpack_from(data, start + SHARE_HDR_SIZE + field_off)
+    total = SHARE_HDR_SIZE + base + count * unit
+    if ptype == PDU_TYPE_FULL and flags & VIEWPORT_FLAG:
+        total += VIEWPORT_SIZE
+    return total
+
+
+class PDUStreamDecoder:
+    """
+    Tách các PDU hoàn chỉnh từ luồng byte của MỘT kênh MCS.
+    - Độ dài PDU đang nhận dở được nhớ lại: FULL lớn đến qua nhiều TPKT chỉ nối thêm, không parse lại header
+    - Parse trên memoryview; mỗi PDU copy đúng một lần (bytes trả về), phần thừa được dọn một lần mỗi feed
+    - Buffer rỗng: parse thẳng trên dữ liệu vừa nhận, chỉ giữ lại phần đuôi chưa đủ
+    Loại PDU lạ / độ dài vô lý -> bỏ phần đã đệm của kênh (không kẹt kênh mãi).
+    """
+
+    def __init__(self, max_pdu: int = MAX_V2_PDU_SIZE):
+        self.max_pdu = max_pdu  # PDU lớn nhất hợp lệ (FULL nguyên khối qua framing v2)
+        self._buf = bytearray()
+        self._need = 0  # độ dài PDU đầu buffer (0 = chưa biết)
+
+    @property
+    def pending(self) -> int:
+        """Số byte đang đệm chờ PDU hoàn chỉnh."""
+        return len(self._buf)
+
+    def reset(self) -> None:
+        self._buf.clear()
+        self._need = 0
+
+    def feed(self, data) -> List[bytes]:
+        """Thêm dữ liệu mới của kênh, trả về các PDU hoàn chỉnh (theo thứ tự)."""
+        if not data:
+            return []
+        buf = self._buf
+        if buf:
+            buf += data
+            if self._need and len(buf) < self._need:
+                return []  # PDU đang nhận dở, đã biết độ dài
+            src = buf
+        else:
+            src = data
+
+        pdus = []
+        pos = 0
+        self._need = 0
+        with memoryview(src) as view:
+            end = len(view)
+            while pos < end:
+                try:
+                    total = pdu_total_length(view, pos, end)
+                    if total is not None and total > self.max_pdu:
+                        raise ValueError(f"PDU quá lớn ({total} bytes)")
+                except ValueError as e:
+                    log.error(f"Bỏ {end - pos} bytes không tách được PDU: {e}")
+                    pos = end
+                    break
+                if total is None:
+                    break
+                if end - pos < total:
+                    self._need = total
+                    break
+                pdus.append(bytes(view[pos:pos + total]))
+                pos += total
+
+        # Dọn phần đã tách (memoryview đã nhả nên bytearray đổi kích thước được)
+        if src is buf:
+            del buf[:pos]
+        elif pos < len(src):
+            buf += src[pos:]
+        return pdus
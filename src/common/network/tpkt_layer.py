@@ -1,8 +1,12 @@
 # common_network/tpkt_layer.py
 
+import ssl
 import struct
 import time
-from src.common.network.constants import TPKT_HEADER_FMT, TPKT_OVERHEAD, MAX_TPKT_LENGTH
+from src.common.network.mcs_layer import MCSLite
+from src.common.network.constants import (
+    TPKT_HEADER_FMT, TPKT_OVERHEAD, MAX_TPKT_LENGTH, FRAMING_V1, FRAMING_V2, MAX_TPKT_V2_LENGTH,
+)
 
 class TPKTLayer:
     # nhận chính xác n bytes từ socket 
@@ -24,13 +28,28 @@ class TPKTLayer:
             data.extend(chunk)
         return bytes(data)
 
+    # độ dài TPKT tối đa theo framing đã thỏa thuận
+    @staticmethod
+    def max_length(framing: int = FRAMING_V1) -> int:
+        return MAX_TPKT_V2_LENGTH if framing == FRAMING_V2 else MAX_TPKT_LENGTH
+
     # đóng gói body (là PDU của lớp MCS [channel_id][payload]) vào TPKT header
+    # framing v2: byte reserved chứa 8 bit cao của độ dài (v1 luôn là 0)
     @staticmethod
-    def pack(body: bytes) -> bytes:
+    def pack(body: bytes, framing: int = FRAMING_V1) -> bytes:
         total_len = TPKT_OVERHEAD + len(body)
-        if total_len > MAX_TPKT_LENGTH:
+        if total_len > TPKTLayer.max_length(framing):
+            raise ValueError(f"TPKT too large: {total_len}")
+        return struct.pack(TPKT_HEADER_FMT, 0x03, total_len >> 16, total_len & 0xFFFF) + body
+
+    # header TPKT + MCS cho một frame có payload dài payload_len (payload gửi riêng, không nối vào header)
+    @staticmethod
+    def frame_header(channel_id: int, payload_len: int, framing: int = FRAMING_V1) -> bytes:
+        mcs_hdr = MCSLite.header(channel_id, payload_len)
+        total_len = TPKT_OVERHEAD + len(mcs_hdr) + payload_len
+        if total_len > TPKTLayer.max_length(framing):
             raise ValueError(f"TPKT too large: {total_len}")
-        return struct.pack(TPKT_HEADER_FMT, 0x03, 0x00, total_len) + body
+        return struct.pack(TPKT_HEADER_FMT, 0x03, total_len >> 16, total_len & 0xFFFF) + mcs_hdr
 
     # gỡ TPKT header, trả về (version, reserved, length)
     @staticmethod
@@ -49,3 +68,115 @@ class TPKTLayer:
         body_len = total_len - TPKT_OVERHEAD
         body = TPKTLayer.recv_exact(sock, body_len, recv_fn=recv_fn, timeout=timeout)
         return body
+
+
+class TPKTReader:
+    """
+    Đọc TPKT liên tục từ MỘT kết nối qua buffer dùng lại (mỗi receiver một reader).
+    - recv_into thẳng vào buffer cố định, mỗi lần đọc tối đa phần còn trống -> nhiều TPKT nhỏ / 1 syscall
+    - recv_one trả về body dạng memoryview trỏ vào buffer, CHỈ hợp lệ tới lần gọi kế tiếp
+      (người gọi feed vào MCS ngay, MCS tự copy phần cần giữ)
+    - Hết chỗ ở cuối buffer -> dồn phần chưa đọc về đầu (không cấp phát lại)
+    - framing v2: TPKT lớn hơn buffer -> buffer được nới tạm thời, đọc xong body đó thì trả về kích thước gốc
+      (server giữ một reader cho mỗi client / manager, không để mỗi kết nối chiếm vài MB mãi)
+    """
+
+    def __init__(self, sock, timeout=30, buffer_size: int = MAX_TPKT_LENGTH, framing: int = FRAMING_V1):
+        self.sock = sock
+        self.timeout = timeout
+        self.framing = framing
+        self.max_length = TPKTLayer.max_length(framing)
+        sock.settimeout(timeout)  # Đặt một lần, không đặt lại mỗi lần đọc
+        self._buffer_size = max(buffer_size, MAX_TPKT_LENGTH)
+        self._buf = bytearray(self._buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # byte đầu tiên chưa trả cho người gọi
+        self._end = 0    # hết phần dữ liệu đã nhận
+
+    def _fill(self, need: int) -> None:
+        """Đọc tới khi buffer có ít nhất need byte chưa xử lý."""
+        if self._start + need > len(self._buf):
+            pending = self._end - self._start
+            if need > len(self._buf):
+                # body cũ đã trả ra vẫn giữ buffer cũ, không đổi kích thước tại chỗ được
+                buf = bytearray(need)
+                buf[:pending] = self._view[self._start:self._end]
+                self._buf, self._view = buf, memoryview(buf)
+            else:
+                self._view[:pending] = self._view[self._start:self._end]  # memmove, vùng chồng nhau vẫn đúng
+            self._start, self._end = 0, pending
+        while self._end - self._start < need:
+            n = self.sock.recv_into(self._view[self._end:])
+            if not n:
+                raise ConnectionError("socket closed during TPKT recv")
+            self._end += n
+
+    def _shrink(self) -> None:
+        """Body lớn trước đó đã được dùng xong -> quay về buffer kích thước gốc (giữ phần chưa đọc)."""
+        pending = self._end - self._start
+        buf = bytearray(self._buffer_size)
+        buf[:pending] = self._view[self._start:self._end]
+        self._buf, self._view = buf, memoryview(buf)
+        self._start, self._end = 0, pending
+
+    def recv_one(self) -> memoryview:
+        """Đọc một TPKT đầy đủ, trả về body (PDU của lớp MCS)."""
+        if len(self._buf) > self._buffer_size and self._end - self._start <= self._buffer_size:
+            self._shrink()
+        if self._end - self._start < TPKT_OVERHEAD:
+            self._fill(TPKT_OVERHEAD)
+        ver, rsv, total_len = struct.unpack_from(TPKT_HEADER_FMT, self._buf, self._start)
+        if self.framing == FRAMING_V2:
+            total_len |= rsv << 16
+
+        if total_len < TPKT_OVERHEAD or total_len > self.max_length:
+            raise ValueError(f"Invalid TPKT total_len {total_len}")
+
+        if self._end - self._start < total_len:
+            self._fill(total_len)
+        body = self._view[self._start + TPKT_OVERHEAD:self._start + total_len]
+        self._start += total_len
+        if self._start == self._end:
+            self._start = self._end = 0  # Đọc hết -> lần sau nhận từ đầu buffer
+        return body
+
+
+class SegmentWriter:
+    """
+    Gửi một TPKT dạng danh sách đoạn (header TPKT/MCS, header PDU, payload memoryview) mà không nối chuỗi.
+    - Socket thường có sendmsg: gửi thẳng các đoạn (writev)
+    - SSLSocket (không có sendmsg) / Windows: chép các đoạn vào MỘT buffer dùng lại rồi gửi một lần
+    Mỗi luồng gửi giữ writer riêng: view trả về từ join chỉ hợp lệ tới lần join kế tiếp.
+    """
+
+    def __init__(self, buffer_size: int = 256 * 1024):
+        self._buf = bytearray(buffer_size)
+
+    def join(self, segments) -> memoryview:
+        """Chép các đoạn liền nhau vào buffer dùng lại, trả về view của phần đã chép."""
+        total = sum(len(seg) for seg in segments)
+        if total > len(self._buf):
+            self._buf = bytearray(max(total, 2 * len(self._buf)))
+        view = memoryview(self._buf)
+        pos = 0
+        for seg in segments:
+            n = len(seg)
+            view[pos:pos + n] = seg
+            pos += n
+        return view[:total]
+
+    def sendall(self, sock, segments) -> None:
+        if isinstance(sock, ssl.SSLSocket) or not hasattr(sock, "sendmsg"):
+            sock.sendall(self.join(segments))
+            return
+        views = [memoryview(seg) for seg in segments if len(seg)]
+        while views:
+            sent = sock.sendmsg(views)
+            # Gửi được một phần: bỏ các đoạn đã gửi hết, cắt đoạn đang dở
+            while sent:
+                n = len(views[0])
+                if sent < n:
+                    views[0] = views[0][sent:]
+                    break
+                sent -= n
+                views.pop(0)
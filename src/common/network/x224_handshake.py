@@ -1,7 +1,8 @@
 # common_network/x224_handshake.py
 
 import struct
-from src.common.network.constants import TPKT_HEADER_FMT
+from typing import Optional, Tuple
+from src.common.network.constants import TPKT_HEADER_FMT, FRAMING_V1, FRAMING_V2
 
 CONNECT_MAGIC = b"X224_CONNECT_V1"
 CONFIRM_MAGIC = b"X224_CONFIRM_V1"
@@ -22,8 +23,14 @@ class X224Handshake:
     # gửi yêu cầu kết nối từ client và chờ phản hồi từ server
     @staticmethod
     def client_send_connect(sock, client_id: str, timeout=10):
+        return X224Handshake.client_negotiate(sock, client_id, timeout=timeout, framing=FRAMING_V1)[0]
+
+    # như client_send_connect, kèm đề nghị framing qua byte reserved của TPKT (server cũ bỏ qua, trả về 0)
+    # trả về (phản hồi, framing hai bên dùng sau handshake)
+    @staticmethod
+    def client_negotiate(sock, client_id: str, timeout=10, framing: int = FRAMING_V2) -> Tuple[bytes, int]:
         body = CONNECT_MAGIC + b":" + client_id.encode() # b"X224_CONNECT_V1:MyComputerName
-        hdr = struct.pack(TPKT_HEADER_FMT, 0x03, 0x00, 4 + len(body))
+        hdr = struct.pack(TPKT_HEADER_FMT, 0x03, FRAMING_V2 if framing == FRAMING_V2 else 0x00, 4 + len(body))
         sock.sendall(hdr + body)
         sock.settimeout(timeout)
 
@@ -34,11 +41,19 @@ class X224Handshake:
             raise ValueError("X224 handshake response too large")
 
         body = X224Handshake.recv_all(sock, length - 4, timeout)
-        return body
+        agreed = FRAMING_V2 if framing == FRAMING_V2 and rsv == FRAMING_V2 else FRAMING_V1
+        return body, agreed
 
     # xử lý yêu cầu kết nối từ client và gửi phản hồi từ server
     @staticmethod
     def server_do_handshake(sock, timeout=10):
+        ok, client_id, _ = X224Handshake.server_negotiate(sock, timeout=timeout, framing=FRAMING_V1)
+        return ok, client_id
+
+    # như server_do_handshake, đồng ý framing v2 nếu client đề nghị (client cũ gửi reserved = 0)
+    # trả về (ok, client_id, framing)
+    @staticmethod
+    def server_negotiate(sock, timeout=10, framing: int = FRAMING_V2) -> Tuple[bool, Optional[str], int]:
         sock.settimeout(timeout)
 
         hdr = X224Handshake.recv_all(sock, 4, timeout)
@@ -51,7 +66,7 @@ class X224Handshake:
                 sock.sendall(tpkt)
             except:
                 pass
-            return False, None
+            return False, None, FRAMING_V1
 
         body = X224Handshake.recv_all(sock, length - 4, timeout)
         if not body.startswith(CONNECT_MAGIC + b":"):
@@ -61,13 +76,14 @@ class X224Handshake:
                 sock.sendall(tpkt)
             except:
                 pass
-            return False, None
+            return False, None, FRAMING_V1
 
         _, rest = body.split(b":", 1)
         client_id = rest.decode(errors="ignore")
 
+        agreed = FRAMING_V2 if framing == FRAMING_V2 and rsv == FRAMING_V2 else FRAMING_V1
         resp = CONFIRM_MAGIC + b":OK"
-        tpkt = struct.pack(TPKT_HEADER_FMT, 0x03, 0x00, 4 + len(resp)) + resp
+        tpkt = struct.pack(TPKT_HEADER_FMT, 0x03, FRAMING_V2 if agreed == FRAMING_V2 else 0x00, 4 + len(resp)) + resp
         sock.sendall(tpkt)
 
-        return True, client_id
+        return True, client_id, agreed
@@ -0,0 +1,139 @@
+# common/video_codec.py
+
+import io
+import struct
+import zlib
+from typing import Tuple
+from PIL import Image, ImageFilter
+
+try:
+    import numpy as np
+except ImportError:  # Không có numpy -> không dùng PALETTE (vùng ít màu sẽ gửi bằng PNG)
+    np = None
+
+from src.common.network.constants import CODEC_JPEG, CODEC_PNG, CODEC_PALETTE, CODEC_RGB565
+
+CODEC_NAMES = {CODEC_JPEG: "jpeg", CODEC_PNG: "png", CODEC_PALETTE: "palette", CODEC_RGB565: "rgb565"}
+
+# Ngưỡng phân loại vùng ảnh
+MAX_PALETTE_COLORS = 256 # <= 256 màu -> bảng màu (UI phẳng, văn bản không khử răng cưa)
+MAX_PNG_COLORS = 4096 # văn bản khử răng cưa: nhiều sắc độ nhưng vẫn ít màu so với ảnh chụp
+EDGE_THRESHOLD = 48 # độ chênh sáng được coi là cạnh "sắc"
+TEXT_EDGE_DENSITY = 0.02 # tỉ lệ pixel nằm trên cạnh sắc để coi là văn bản
+PNG_COMPRESS_LEVEL = 3 # cân bằng tốc độ / kích thước (mặc định 6 chậm gấp đôi)
+PALETTE_ZLIB_LEVEL = 6
+RGB565_ZLIB_LEVEL = 6
+
+
+def edge_density(img: Image.Image) -> float:
+    """Tỉ lệ pixel nằm trên cạnh sắc (chữ, đường kẻ bảng tính) trên ảnh thang xám."""
+    w, h = img.size
+    if w < 3 or h < 3:
+        return 0.0
+    edges = img.convert("L").filter(ImageFilter.FIND_EDGES)
+    hist = edges.histogram()
+    return sum(hist[EDGE_THRESHOLD:]) / float(w * h)
+
+
+def classify_region(img: Image.Image) -> int:
+    """
+    Chọn codec cho một vùng dựa trên số màu và mật độ cạnh:
+    - ít màu -> PALETTE (lossless, rất nhỏ cho IDE / bảng tính)
+    - nhiều sắc độ nhưng nhiều cạnh sắc (chữ khử răng cưa) -> PNG
+    - còn lại (ảnh, video, gradient) -> JPEG
+    """
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    # getcolors trả về None ngay khi vượt maxcolors -> rẻ với ảnh chụp
+    if img.getcolors(MAX_PALETTE_COLORS) is not None:
+        return CODEC_PALETTE if np is not None else CODEC_PNG
+    if img.getcolors(MAX_PNG_COLORS) is not None and edge_density(img) >= TEXT_EDGE_DENSITY:
+        return CODEC_PNG
+    return CODEC_JPEG
+
+
+def _encode_palette(img: Image.Image) -> bytes:
+    colors = img.getcolors(MAX_PALETTE_COLORS)
+    if colors is None:
+        raise ValueError("too many colors for palette codec")
+    # Ánh xạ chính xác màu -> chỉ số (Image.quantize dùng bảng tra gần đúng, làm lệch
+    # các sắc độ gần nhau của chữ khử răng cưa). Khóa màu = R | G<<8 | B<<16 (little-endian RGBX)
+    keys = np.frombuffer(img.convert("RGBX").tobytes(), dtype="<u4") & 0x00FFFFFF
+    palette_keys = np.array(sorted(r | (g << 8) | (b << 16) for _, (r, g, b) in colors), dtype=np.uint32)
+    indices = np.searchsorted(palette_keys, keys).astype(np.uint8)
+    palette = b"".join(bytes((k & 0xFF, (k >> 8) & 0xFF, k >> 16)) for k in palette_keys.tolist())
+    return struct.pack(">H", len(palette_keys)) + palette + zlib.compress(indices.tobytes(), PALETTE_ZLIB_LEVEL)
+
+
+def _decode_palette(data: bytes, size: Tuple[int, int]) -> Image.Image:
+    (n_colors,) = struct.unpack(">H", data[:2])
+    palette = data[2:2 + 3 * n_colors]
+    indices = zlib.decompress(data[2 + 3 * n_colors:])
+    img = Image.frombytes("P", size, indices)
+    img.putpalette(palette)
+    return img.convert("RGB")
+
+
+def _encode_rgb565(img: Image.Image) -> bytes:
+    rgb = np.asarray(img.convert("RGB"), dtype=np.uint16)
+    packed = ((rgb[..., 0] >> 3) << 11) | ((rgb[..., 1] >> 2) << 5) | (rgb[..., 2] >> 3)
+    return zlib.compress(packed.astype("<u2").tobytes(), RGB565_ZLIB_LEVEL)
+
+
+def _decode_rgb565(data: bytes, size: Tuple[int, int]) -> Image.Image:
+    w, h = size
+    packed = np.frombuffer(zlib.decompress(data), dtype="<u2").reshape(h, w)
+    r, g, b = (packed >> 11) & 0x1F, (packed >> 5) & 0x3F, packed & 0x1F
+    # Lặp bit cao vào bit thấp: 0x1F -> 0xFF, 0 -> 0 (không bị tối đi)
+    rgb = np.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1)
+    return Image.fromarray(rgb.astype(np.uint8), "RGB")
+
+
+def apply_color_mode(img: Image.Image, codec: int, color_mode: str = "full") -> Tuple[Image.Image, int]:
+    """
+    Giảm độ sâu màu của một vùng theo chế độ luồng (COLOR_MODES) trước khi encode.
+    Trả về (ảnh, codec thực tế) - codec được ghi vào flags của PDU để manager giải mã về RGB.
+    - gray: mọi vùng sang thang xám (JPEG xám, vùng lossless <= 256 mức xám -> PALETTE)
+    - palette8: vùng lossless nhiều màu được lượng tử hóa còn 256 màu -> PALETTE
+    - rgb16: vùng lossless nhiều màu -> RGB565 (2 byte / pixel)
+    Vùng ảnh chụp (JPEG) giữ nguyên ở palette8 / rgb16: JPEG đã nhỏ hơn mọi cách giảm màu.
+    """
+    if color_mode == "gray":
+        img = img.convert("L")
+        if codec == CODEC_JPEG:
+            return img, codec
+        return (img, CODEC_PALETTE) if np is not None else (img, CODEC_PNG)
+    if codec != CODEC_PNG:
+        return img, codec
+    if color_mode == "palette8":
+        img = img.convert("RGB").quantize(MAX_PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+        return (img, CODEC_PALETTE) if np is not None else (img, CODEC_PNG)
+    if color_mode == "rgb16" and np is not None:
+        return img, CODEC_RGB565
+    return img, codec
+
+
+def encode_region(img: Image.Image, codec: int, quality: int = 85) -> bytes:
+    if codec == CODEC_PALETTE:
+        return _encode_palette(img.convert("RGB") if img.mode != "RGB" else img)
+    if codec == CODEC_RGB565:
+        return _encode_rgb565(img)
+    # JPEG / PNG nhận thẳng ảnh xám (L) và ảnh bảng màu (P, chỉ PNG) -> ít byte hơn RGB
+    if img.mode not in ("RGB", "L") and not (img.mode == "P" and codec == CODEC_PNG):
+        img = img.convert("RGB")
+    bio = io.BytesIO()
+    if codec == CODEC_PNG:
+        img.save(bio, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    else:
+        img.save(bio, format="JPEG", quality=quality, optimize=True)
+    return bio.getvalue()
+
+
+def decode_region(data: bytes, codec: int, size: Tuple[int, int]) -> Image.Image:
+    """Giải mã payload video thành ảnh RGB. size = (w, h) khai báo trong PDU (cần cho PALETTE)."""
+    if codec == CODEC_PALETTE:
+        return _decode_palette(data, size)
+    if codec == CODEC_RGB565:
+        return _decode_rgb565(data, size)
+    # JPEG và PNG tự mô tả kích thước
+    return Image.open(io.BytesIO(data)).convert("RGB")
@@ -361,6 +361,7 @@ class ManageClientsWindow(QWidget):
         self.screen_window.disconnect_requested.connect(self._on_screen_disconnect)
         self.screen_window.close_requested.connect(self._on_screen_close)
         self.screen_window.input_event_generated.connect(manager._on_gui_input)
+        self.screen_window.viewport_changed.connect(manager.gui_set_viewport)
         
         manager.session_started.connect(self.screen_window.set_session_started)
         manager.session_ended.connect(self.screen_window.set_session_ended)
@@ -429,6 +430,7 @@ class ManageClientsWindow(QWidget):
         self.control_window.disconnect_requested.connect(self._on_control_disconnect)
         self.control_window.close_requested.connect(self._on_control_close)
         self.control_window.input_event_generated.connect(manager._on_gui_input)
+        self.control_window.viewport_changed.connect(manager.gui_set_viewport)
         
         manager.session_started.connect(self.control_window.set_session_started)
         manager.session_ended.connect(self.control_window.set_session_ended)
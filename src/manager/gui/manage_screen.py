@@ -5,8 +5,8 @@ from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QPushButton, QFrame
 )
-from PyQt6.QtCore import Qt, pyqtSignal, QPoint, QEvent
-from PyQt6.QtGui import QPixmap, QPainter, QBrush, QPen, QPolygon, QMouseEvent, QKeyEvent, QCursor
+from PyQt6.QtCore import Qt, pyqtSignal, QPoint, QEvent, QTimer
+from PyQt6.QtGui import QPixmap, QPainter, QBrush, QPen, QPolygon, QMouseEvent, QKeyEvent, QCursor, QWheelEvent
 from PIL.ImageQt import ImageQt
 
 from src.gui.ui_components import (
@@ -18,6 +18,11 @@ class ManageScreenWindow(QWidget):
     disconnect_requested = pyqtSignal()
     close_requested = pyqtSignal()
     input_event_generated = pyqtSignal(dict)
+    # Vùng đang xem (x0, y0, x1, y1 chuẩn hóa) và kích thước khung hiển thị (w, h) px thật
+    viewport_changed = pyqtSignal(tuple, tuple)
+
+    ZOOM_STEP = 1.25
+    MAX_ZOOM = 8.0
 
     def __init__(self, client_id: str, mode: str = "view"):
         """
@@ -36,6 +41,12 @@ class ManageScreenWindow(QWidget):
         self.last_mouse_sent_time = 0
         self.current_cursor_norm_x = 0.5
         self.current_cursor_norm_y = 0.5
+        # Zoom: vùng màn hình client đang xem (Ctrl + lăn chuột), báo lên manager khi đổi / đổi cỡ cửa sổ
+        self.zoom_region = (0.0, 0.0, 1.0, 1.0)
+        self._viewport_timer = QTimer(self)
+        self._viewport_timer.setSingleShot(True)
+        self._viewport_timer.setInterval(300)  # Gộp các sự kiện kéo cửa sổ / lăn chuột liên tiếp
+        self._viewport_timer.timeout.connect(self._emit_viewport)
 
         # Tạo con trỏ ảo (giống con trỏ Windows thật)
         cursor_pixmap = QPixmap(24, 32)
@@ -73,6 +84,7 @@ class ManageScreenWindow(QWidget):
         painter.drawPolygon(QPolygon(inner_points))
         painter.end()
         self.cursor_pixmap_base = cursor_pixmap
+        self.cursor_hotspot = (2, 2)  # Điểm nhọn của con trỏ trong pixmap
 
         self.init_ui()
 
@@ -87,6 +99,21 @@ class ManageScreenWindow(QWidget):
 
         top_bar.addStretch()
 
+        fit_btn = QPushButton("Fit")
+        fit_btn.setCursor(Qt.CursorShape.PointingHandCursor)
+        fit_btn.setToolTip("Xem toàn màn hình (Ctrl + lăn chuột để zoom)")
+        fit_btn.setStyleSheet(f"""
+            QPushButton {{
+                background-color: {CARD_BG};
+                color: {TEXT_LIGHT};
+                border-radius: 8px;
+                padding: 8px 16px;
+                font-size: 11pt;
+            }}
+        """)
+        fit_btn.clicked.connect(self.reset_zoom)
+        top_bar.addWidget(fit_btn)
+
         disconnect_btn = QPushButton("Disconnect")
         disconnect_btn.setCursor(Qt.CursorShape.PointingHandCursor)
         disconnect_btn.setStyleSheet(f"""
@@ -159,6 +186,7 @@ class ManageScreenWindow(QWidget):
         """Update cursor position"""
         if not cursor_data:
             return
+        self._apply_cursor_shape(cursor_data)
 
         x_norm = cursor_data.get('x', 0.5)
         y_norm = cursor_data.get('y', 0.5)
@@ -166,6 +194,11 @@ class ManageScreenWindow(QWidget):
         self.current_cursor_norm_x = x_norm
         self.current_cursor_norm_y = y_norm
 
+        # Đang zoom và con trỏ nằm ngoài vùng đang xem -> ẩn
+        if not (0.0 <= x_norm <= 1.0 and 0.0 <= y_norm <= 1.0):
+            self.cursor_label.hide()
+            return
+
         # Update cursor position on screen
         screen_width = self.screen_label.width()
         screen_height = self.screen_label.height()
@@ -174,8 +207,8 @@ class ManageScreenWindow(QWidget):
             cursor_x = int(x_norm * screen_width)
             cursor_y = int(y_norm * screen_height)
 
-            # Offset để con trỏ ở đúng vị trí (tip của arrow)
-            self.cursor_label.move(cursor_x - 2, cursor_y - 2)
+            # Offset để con trỏ ở đúng vị trí (tip của arrow / hotspot của hình dạng client gửi)
+            self.cursor_label.move(cursor_x - self.cursor_hotspot[0], cursor_y - self.cursor_hotspot[1])
             
             # Debug: In ra console
             print(f"[Cursor] x={cursor_x}, y={cursor_y}, norm=({x_norm:.3f}, {y_norm:.3f})")
@@ -186,9 +219,26 @@ class ManageScreenWindow(QWidget):
                 print("[Cursor] Showing cursor label")
             self.cursor_label.raise_()
 
+    def _apply_cursor_shape(self, cursor_data):
+        """Đổi hình con trỏ theo hình dạng client gửi (shape_image None = ẩn, không có = giữ nguyên)"""
+        if "shape_image" not in cursor_data:
+            return
+        img = cursor_data["shape_image"]
+        if img is None:
+            pixmap = QPixmap(1, 1)
+            pixmap.fill(Qt.GlobalColor.transparent)
+            self.cursor_hotspot = (0, 0)
+        else:
+            pixmap = QPixmap.fromImage(ImageQt(img).copy())
+            self.cursor_hotspot = cursor_data.get("shape_hotspot", (0, 0))
+        self.cursor_label.setPixmap(pixmap)
+        self.cursor_label.setFixedSize(pixmap.width(), pixmap.height())
+
     def eventFilter(self, obj, event):
         """Handle mouse and keyboard events on screen"""
         if obj == self.screen_label:
+            if isinstance(event, QWheelEvent) and event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+                return self.handle_zoom_event(event)
             if isinstance(event, QMouseEvent):
                 return self.handle_mouse_event(event)
             elif isinstance(event, QKeyEvent):
@@ -196,6 +246,36 @@ class ManageScreenWindow(QWidget):
 
         return super().eventFilter(obj, event)
 
+    def handle_zoom_event(self, event: QWheelEvent):
+        """Ctrl + lăn chuột: zoom quanh vị trí chuột (client encode vùng đó ở độ phân giải hiển thị)"""
+        w, h = self.screen_label.width(), self.screen_label.height()
+        if w == 0 or h == 0:
+            return False
+        x0, y0, x1, y1 = self.zoom_region
+        px = x0 + (x1 - x0) * max(0.0, min(1.0, event.position().x() / w))
+        py = y0 + (y1 - y0) * max(0.0, min(1.0, event.position().y() / h))
+        factor = 1 / self.ZOOM_STEP if event.angleDelta().y() > 0 else self.ZOOM_STEP
+        span = max(1 / self.MAX_ZOOM, min(1.0, (x1 - x0) * factor))
+        # Giữ điểm dưới con trỏ đứng yên, rồi đẩy vùng vào trong màn hình
+        nx0 = min(max(0.0, px - (px - x0) * span / (x1 - x0)), 1.0 - span)
+        ny0 = min(max(0.0, py - (py - y0) * span / (y1 - y0)), 1.0 - span)
+        self.zoom_region = (nx0, ny0, nx0 + span, ny0 + span)
+        self._viewport_timer.start()
+        return True
+
+    def reset_zoom(self):
+        self.zoom_region = (0.0, 0.0, 1.0, 1.0)
+        self._viewport_timer.start()
+
+    def _emit_viewport(self):
+        ratio = self.screen_label.devicePixelRatioF()
+        size = (int(self.screen_label.width() * ratio), int(self.screen_label.height() * ratio))
+        self.viewport_changed.emit(tuple(self.zoom_region), size)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._viewport_timer.start()
+
     def handle_mouse_event(self, event: QMouseEvent):
         """Handle mouse events - Only in CONTROL mode"""
         # VIEW mode: read-only, không xử lý input
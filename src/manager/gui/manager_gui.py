@@ -196,6 +196,7 @@ class ManagerWindow(QMainWindow):
         painter.drawConvexPolygon(QPolygon(points))
         painter.end()
         self.cursor_pixmap_base = cursor_pixmap 
+        self.cursor_hotspot = (1, 1)  # Điểm nhọn của con trỏ trong pixmap
         
         self.cursor_label = QLabel(self.screen_label)
         self.cursor_label.setStyleSheet("background-color: none;")
@@ -317,8 +318,8 @@ class ManagerWindow(QMainWindow):
             x_abs = int(offset_x + pixmap_size.width() * norm_x)
             y_abs = int(offset_y + pixmap_size.height() * norm_y)
             
-            # Trừ nhẹ để mũi tên trỏ đúng điểm
-            self.cursor_label.move(x_abs - 1, y_abs - 1)
+            # Trừ hotspot để mũi tên trỏ đúng điểm
+            self.cursor_label.move(x_abs - self.cursor_hotspot[0], y_abs - self.cursor_hotspot[1])
             self.cursor_label.show()
 
     # --- Cập nhật ảnh Video ---
@@ -355,6 +356,8 @@ class ManagerWindow(QMainWindow):
         Chỉ cập nhật nếu chuột của Manager ĐANG KHÔNG nằm trong vùng video.
         (Tránh xung đột: tay mình di qua trái, tín hiệu client báo về qua phải -> Rung lắc)
         """
+        self._apply_cursor_shape(pdu)
+
         # Nếu chuột manager đang ở trong vùng screen_label, ta ưu tiên hiển thị chuột manager
         if self.screen_label.underMouse():
             return 
@@ -367,6 +370,21 @@ class ManagerWindow(QMainWindow):
         
         self._move_cursor_overlay_to_norm(self.current_cursor_norm_x, self.current_cursor_norm_y)
 
+    def _apply_cursor_shape(self, pdu: dict):
+        """Đổi hình con trỏ ảo theo hình dạng client gửi (shape_image None = ẩn, không có = giữ nguyên)."""
+        if "shape_image" not in pdu:
+            return
+        img = pdu["shape_image"]
+        if img is None:
+            pixmap = QPixmap(1, 1)
+            pixmap.fill(Qt.GlobalColor.transparent)
+            self.cursor_hotspot = (0, 0)
+        else:
+            pixmap = QPixmap.fromImage(ImageQt(img).copy())
+            self.cursor_hotspot = pdu.get("shape_hotspot", (0, 0))
+        self.cursor_label.setPixmap(pixmap)
+        self.cursor_label.adjustSize()
+
     # --- Connect/Disconnect ---
     def on_connect_click(self):
         items = self.client_list_widget.selectedItems()
@@ -33,6 +33,7 @@ class Manager(QObject):
     cursor_pdu_received = pyqtSignal(object)
     input_pdu_received = pyqtSignal(object)  # Keylog data
     security_alert_received = pyqtSignal(object)  # Security alerts
+    monitors_received = pyqtSignal(list)  # Danh sách màn hình của client đang xem
 
     def __init__(self, host: str, port: int, manager_id: str = "manager1", username: str = None, password: str = None):
         super().__init__()
@@ -40,9 +41,12 @@ class Manager(QObject):
         self.app = ManagerApp(host, port, manager_id, username, password)
         self.input_handler = ManagerInputHandler(self.app)
         self.viewer = ManagerViewer()
+        self.viewer.on_keyframe_needed = self.app.request_keyframe
         
         self.current_session_client_id = None
         self.client_list = []
+        # Viewport GUI báo gần nhất: ((x0, y0, x1, y1) chuẩn hóa, (w, h) px hoặc None = chưa biết)
+        self._viewport = ((0.0, 0.0, 1.0, 1.0), None)
 
         self.app.on_connected = self._on_connected
         self.app.on_disconnected = self._on_disconnected
@@ -55,6 +59,7 @@ class Manager(QObject):
         self.app.on_control_pdu = self._on_control_pdu
         self.app.on_cursor_pdu = self._on_cursor_pdu
         self.app.on_input_pdu = self._on_input_pdu
+        self.app.on_monitor_list = self._on_monitor_list
 
     def start(self):
         if not os.path.exists(CA_FILE):
@@ -106,6 +111,9 @@ class Manager(QObject):
             self.current_session_client_id = client_id
             
         print(f"[Manager] Phiên làm việc với '{client_id}' đã CHÍNH THỨC bắt đầu.")
+        if self._viewport[1]:
+            # Cửa sổ đã có kích thước trước khi phiên bắt đầu -> client encode đúng cỡ ngay từ đầu
+            self._send_viewport(client_id)
         self.session_started.emit(client_id)
 
     def _on_session_ended(self, client_id: str):
@@ -146,6 +154,44 @@ class Manager(QObject):
             import traceback
             traceback.print_exc()
         
+    def _on_monitor_list(self, client_id: str, layout: list):
+        self.viewer.set_monitor_layout(client_id, layout)
+        if client_id == self.current_session_client_id:
+            self.monitors_received.emit(layout)
+
+    def gui_select_monitor(self, monitor):
+        """GUI chọn màn hình (id hoặc "all"): đổi ảnh hiển thị và báo client chỉ chụp màn hình đó."""
+        client_id = self.current_session_client_id
+        if not client_id:
+            return
+        img = self.viewer.select_monitor(client_id, monitor)
+        self.app.select_monitor(client_id, "all" if monitor in (None, "all") else int(monitor))
+        # Màn hình mới hiển thị toàn bộ (bỏ zoom) trong cùng khung hiển thị
+        self._viewport = ((0.0, 0.0, 1.0, 1.0), self._viewport[1])
+        self._send_viewport(client_id)
+        if img:
+            self.video_pdu_received.emit(img)
+
+    def gui_set_viewport(self, region, size):
+        """
+        GUI báo vùng đang xem (x0, y0, x1, y1 chuẩn hóa, zoom) và kích thước khung hiển thị (w, h) px
+        khi đổi kích thước cửa sổ / zoom -> client chỉ encode vùng đó ở đúng kích thước hiển thị.
+        """
+        self._viewport = (tuple(region), tuple(size) if size else None)
+        if self.current_session_client_id:
+            self._send_viewport(self.current_session_client_id)
+
+    def _send_viewport(self, client_id):
+        selected = self.viewer.selected_monitor.get(client_id, 0)
+        region, size = self._viewport
+        self.app.set_viewport(client_id, "all" if selected is None else selected, region, size)
+
+    def gui_set_color_mode(self, mode: str):
+        """GUI chọn chế độ màu cho client đang xem (đường truyền yếu: rgb16 / palette8 / gray, "full" = bình thường)."""
+        client_id = self.current_session_client_id
+        if client_id:
+            self.app.set_color_mode(client_id, mode)
+
     def _on_file_pdu(self, pdu: dict):
         ptype = pdu.get("type")
         if ptype == "file_start":
@@ -177,7 +223,12 @@ class Manager(QObject):
     def _on_cursor_pdu(self, pdu: dict):
         if not self.current_session_client_id:
             return
-        # pdu chứa x, y (đã chuẩn hóa), cursor_shape (bytes)
+        # pdu chứa x, y (đã chuẩn hóa), cursor_shape (bytes) -> kèm shape_image / shape_hotspot khi hình dạng đổi
+        pdu = self.viewer.process_cursor_pdu(self.current_session_client_id, pdu)
+        if "x" in pdu and "y" in pdu:
+            # Đang zoom: vị trí trên cả màn hình -> vị trí trên vùng đang hiển thị
+            x, y = self.viewer.from_screen_norm(self.current_session_client_id, pdu["x"], pdu["y"])
+            pdu = {**pdu, "x": x, "y": y}
         self.cursor_pdu_received.emit(pdu) # Gửi thẳng dict PDU lên GUI/Viewer
 
     def gui_connect_to_client(self, client_id: str):
@@ -302,6 +353,13 @@ class Manager(QObject):
             print(f"[Manager] ⚠️ Không gửi input event - chưa có session!")
             return 
         
+        # Tọa độ chuẩn hóa tính trên ảnh đang hiển thị -> client cần biết đó là màn hình nào
+        selected = self.viewer.selected_monitor.get(self.current_session_client_id, 0)
+        event.setdefault("monitor", "all" if selected is None else selected)
+        if "x_norm" in event and "y_norm" in event:
+            # Ảnh chỉ là vùng viewport (zoom) -> đổi sang tọa độ trên cả màn hình
+            event["x_norm"], event["y_norm"] = self.viewer.to_screen_norm(
+                self.current_session_client_id, event["x_norm"], event["y_norm"])
         print(f"[Manager] ✅ Gửi input event tới input_handler: {event}")
         # Gửi sự kiện đã được format bởi GUI
         self.input_handler.send_event(event)
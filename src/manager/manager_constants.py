@@ -34,6 +34,14 @@ CMD_CONTROL_CLIENT = "control:"  # Điều khiển (1-to-1 exclusive), ví dụ:
 CMD_STOP_VIEW = "stop_view"  # Dừng xem
 CMD_STOP_CONTROL = "stop_control"  # Dừng điều khiển
 CMD_DISCONNECT = "disconnect"  # Legacy, dùng stop_control thay thế
+CMD_BITMAP_CACHE = "bitmap_cache:"  # Báo số ô bitmap cache manager giữ được: "bitmap_cache:2048"
+CMD_SELECT_MONITOR = "monitor:"  # Chọn màn hình đang xem: "monitor:admin3:1" hoặc "monitor:admin3:all"
+CMD_KEYFRAME = "keyframe:"  # Xin FULL frame khi thiếu ảnh nền: "keyframe:admin3:0"
+CMD_VIEWPORT = "viewport:"  # Vùng / kích thước đang hiển thị: "viewport:admin3:0:0.25,0,0.75,0.5:960x540" (0x0 = không giới hạn)
+CMD_COLOR_MODE = "colormode:"  # Chế độ màu cho đường truyền yếu: "colormode:admin3:gray" (full / rgb16 / palette8 / gray)
+
+# --- Bitmap cache ---
+BITMAP_CACHE_ENTRIES = 2048  # Ô 64x64 RGB đã giải mã (~24MB mỗi client đang xem)
 
 # --- Lệnh Nhận về (Server -> Manager) ---
 CMD_REGISTER_OK = "register_ok"
@@ -44,4 +52,5 @@ CMD_VIEW_ENDED = "view_ended"  # View session kết thúc
 CMD_CONTROL_ENDED = "control_ended"  # Control session kết thúc
 CMD_SESSION_STARTED = "session_started"  # Legacy
 CMD_SESSION_ENDED = "session_ended"  # Legacy
-CMD_ERROR = "error"
\ No newline at end of file
+CMD_ERROR = "error"
+CMD_MONITOR_LIST = "monitors:"  # Bố cục màn hình của client: "monitors:admin3:[{"id": 0, "left": 0, ...}]"
\ No newline at end of file
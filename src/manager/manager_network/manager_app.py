@@ -6,15 +6,14 @@ from queue import Queue, Empty
 from .manager_client import ManagerClient
 from .manager_receiver import ManagerReceiver
 from src.common.network.pdu_builder import PDUBuilder
-from src.common.network.mcs_layer import MCSLite
-from src.common.network.tpkt_layer import TPKTLayer
+from src.common.network.tpkt_layer import TPKTLayer, SegmentWriter
 from src.manager.manager_constants import (
     CHANNEL_CONTROL, CHANNEL_INPUT,
     CMD_REGISTER, CMD_LOGIN, CMD_LIST_CLIENTS, CMD_VIEW_CLIENT, CMD_CONTROL_CLIENT, 
-    CMD_STOP_VIEW, CMD_STOP_CONTROL, CMD_DISCONNECT,
+    CMD_STOP_VIEW, CMD_STOP_CONTROL, CMD_DISCONNECT, CMD_BITMAP_CACHE, BITMAP_CACHE_ENTRIES,
     CMD_CLIENT_LIST_UPDATE, CMD_SESSION_STARTED, CMD_SESSION_ENDED, 
     CMD_VIEW_STARTED, CMD_CONTROL_STARTED, CMD_VIEW_ENDED, CMD_CONTROL_ENDED,
-    CMD_ERROR
+    CMD_ERROR, CMD_SELECT_MONITOR, CMD_MONITOR_LIST, CMD_KEYFRAME, CMD_COLOR_MODE, CMD_VIEWPORT
 )
 
 class ManagerApp:
@@ -32,6 +31,7 @@ class ManagerApp:
         self.builder = PDUBuilder()
         self.seq = 0
         self.lock = threading.Lock() 
+        self.writer = SegmentWriter() # Buffer gửi dùng lại (dùng trong self.lock)
 
         self.on_connected = None
         self.on_disconnected = None
@@ -44,6 +44,7 @@ class ManagerApp:
         self.on_control_pdu = None
         self.on_cursor_pdu = None
         self.on_input_pdu = None
+        self.on_monitor_list = None  # (client_id, [{"id", "left", "top", "width", "height"}])
 
     def start(self, cafile: str) -> bool:
         if not self.client.connect(cafile):
@@ -51,7 +52,8 @@ class ManagerApp:
             return False
         
         self.running = True
-        self.receiver = ManagerReceiver(self.client.sock, self.pdu_queue, self._on_receiver_done)
+        self.receiver = ManagerReceiver(self.client.sock, self.pdu_queue, self._on_receiver_done,
+                                        framing=self.client.framing)
         self.receiver.start()
         
         self.pdu_loop_thread = threading.Thread(target=self._pdu_loop, daemon=True)
@@ -137,10 +139,18 @@ class ManagerApp:
             elif msg.startswith(CMD_ERROR):
                 if self.on_error:
                     self.on_error(msg.split(":", 1)[1])
+            elif msg.startswith(CMD_MONITOR_LIST):
+                # "monitors:<client_id>:[...]" (JSON bắt đầu bằng '[')
+                if self.on_monitor_list:
+                    try:
+                        client_id, layout_json = msg[len(CMD_MONITOR_LIST):].split(":[", 1)
+                        self.on_monitor_list(client_id, json.loads("[" + layout_json))
+                    except Exception as e:
+                        print(f"[ManagerApp] ❌ Lỗi parse danh sách màn hình: {e}")
             elif self.on_control_pdu:
                 self.on_control_pdu(pdu)
 
-        elif ptype in ("full", "rect"):
+        elif ptype in ("full", "rect", "copy", "cache"):
             print(f"[ManagerApp] Xử lý VIDEO PDU: {ptype}")
             if self.on_video_pdu:
                 self.on_video_pdu(pdu)
@@ -172,11 +182,10 @@ class ManagerApp:
             print(f"[ManagerApp] ⚠️ Không gửi được - socket is None")
             return
         try:
-            mcs_frame = MCSLite.build(channel_id, pdu_bytes)
-            tpkt_packet = TPKTLayer.pack(mcs_frame)
+            header = TPKTLayer.frame_header(channel_id, len(pdu_bytes), self.client.framing)
             with self.lock:
-                self.client.sock.sendall(tpkt_packet)
-            print(f"[ManagerApp] ✅ Đã gửi PDU tới channel {channel_id}, size: {len(tpkt_packet)} bytes")
+                self.writer.sendall(self.client.sock, [header, pdu_bytes])
+            print(f"[ManagerApp] ✅ Đã gửi PDU tới channel {channel_id}, size: {len(header) + len(pdu_bytes)} bytes")
         except Exception as e:
             print(f"[ManagerApp] ❌ Lỗi gửi PDU: {e}")
             import traceback
@@ -195,6 +204,8 @@ class ManagerApp:
         register_msg = f"{CMD_REGISTER}manager:{self.username or self.client.manager_id}"
         print(f"[ManagerApp] Sending REGISTER: {register_msg}")
         self._send_control_pdu(register_msg)
+        # Báo dung lượng bitmap cache để server thương lượng với client khi bắt đầu xem
+        self._send_control_pdu(f"{CMD_BITMAP_CACHE}{BITMAP_CACHE_ENTRIES}")
 
         # Nếu có thông tin đăng nhập, gửi thêm LOGIN để server có thể xác thực (nếu DB sẵn sàng)
         if self.username and self.password:
@@ -225,6 +236,27 @@ class ManagerApp:
         else:  # default to control
             self._send_control_pdu(CMD_STOP_CONTROL)
 
+    def select_monitor(self, client_id: str, monitor="all"):
+        """Báo server màn hình đang xem (id hoặc "all"); client chỉ chụp các màn hình có người xem."""
+        self._send_control_pdu(f"{CMD_SELECT_MONITOR}{client_id}:{monitor}")
+
+    def request_keyframe(self, client_id: str, monitor: int = 0):
+        """Xin FULL frame của một màn hình (chưa có / mất ảnh nền); client gộp các yêu cầu dồn dập."""
+        self._send_control_pdu(f"{CMD_KEYFRAME}{client_id}:{monitor}")
+
+    def set_viewport(self, client_id: str, monitor="all", region=(0.0, 0.0, 1.0, 1.0), size=None):
+        """
+        Báo vùng đang hiển thị (x0, y0, x1, y1 chuẩn hóa theo màn hình / ảnh ghép) và kích thước hiển thị (w, h) px.
+        Client chỉ encode vùng đó ở đúng kích thước này; size None = không giới hạn.
+        """
+        x0, y0, x1, y1 = region
+        w, h = size or (0, 0)
+        self._send_control_pdu(f"{CMD_VIEWPORT}{client_id}:{monitor}:{x0:.4f},{y0:.4f},{x1:.4f},{y1:.4f}:{int(w)}x{int(h)}")
+
+    def set_color_mode(self, client_id: str, mode: str = "full"):
+        """Chọn chế độ màu (full / rgb16 / palette8 / gray) cho đường truyền yếu; áp dụng từ keyframe kế tiếp."""
+        self._send_control_pdu(f"{CMD_COLOR_MODE}{client_id}:{mode}")
+
     def send_input(self, event: dict):
         print(f"[ManagerApp] 📤 Gửi input event: {event.get('type')}")
         seq = self._next_seq()
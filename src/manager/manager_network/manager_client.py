@@ -2,6 +2,7 @@
 
 import socket
 import ssl
+from src.common.network.constants import FRAMING_V1
 from src.common.network.x224_handshake import X224Handshake, CONFIRM_MAGIC
 from src.common.network.security_layer_tls import create_client_context, client_wrap_socket
 
@@ -16,6 +17,7 @@ class ManagerClient:
         self.port = port
         self.manager_id = manager_id
         self.sock = None # Sẽ là SSLSocket sau khi kết nối
+        self.framing = FRAMING_V1 # Framing thỏa thuận với server (v2 nếu server hỗ trợ)
 
     def connect(self, cafile: str, timeout: float = 10.0) -> bool:
         raw_sock = None
@@ -26,14 +28,14 @@ class ManagerClient:
             raw_sock.connect((self.host, self.port))
 
             # 2. Thực hiện X224 Handshake (trên socket thô)
-            resp = X224Handshake.client_send_connect(raw_sock, self.manager_id, timeout=timeout)
+            resp, self.framing = X224Handshake.client_negotiate(raw_sock, self.manager_id, timeout=timeout)
             
             if not (isinstance(resp, bytes) and resp.startswith(CONFIRM_MAGIC)):
                 print("[ManagerClient] Handshake X224 thất bại, resp:", resp)
                 raw_sock.close()
                 return False
 
-            print("[ManagerClient] Handshake X224 thành công.")
+            print(f"[ManagerClient] Handshake X224 thành công (framing v{self.framing}).")
 
             # 3. Tạo TLS Context
             tls_context = create_client_context(cafile=cafile, check_hostname=False)
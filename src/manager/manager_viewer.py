@@ -1,51 +1,130 @@
 # manager/manager_viewer.py
 
 import threading
+import zlib
 from PIL import Image
-import io
 import time
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Union
+from src.common.video_codec import decode_region, CODEC_NAMES
+from src.common.network.constants import (
+    CODEC_JPEG, CACHE_OP_RESET, CACHE_OP_HIT, CACHE_OP_STORE,
+    CURSOR_SHAPE_DEFINE, CURSOR_SHAPE_HIDDEN,
+)
+
+# Ảnh nền / bitmap cache được giữ riêng cho từng màn hình của client
+StreamKey = Tuple[str, int]  # (client_id, monitor_id)
+
+# Thiếu ảnh nền: gửi lại yêu cầu keyframe nếu sau khoảng này vẫn chưa nhận được FULL
+KEYFRAME_RETRY = 2.0
 
 class ManagerViewer:
     """
     Quản lý ảnh nền (base image) và xử lý logic vá (patch) các vùng thay đổi.
+    Mỗi màn hình của client là một luồng video độc lập (ảnh nền + bitmap cache riêng);
+    ảnh trả về là màn hình đang chọn, hoặc ghép tất cả màn hình theo bố cục của client.
     """
 
     def __init__(self):
         self.lock = threading.Lock()
         # Lưu trữ ảnh nền đầy đủ (base image)
-        self.current_base_image: Dict[str, Optional[Image.Image]] = {} 
-        self.current_base_size: Dict[str, Tuple[int, int]] = {}
-        
+        self.current_base_image: Dict[StreamKey, Optional[Image.Image]] = {}
+        self.current_base_size: Dict[StreamKey, Tuple[int, int]] = {}
+        # Bitmap cache: slot -> ô ảnh đã giải mã (client quyết định slot nào bị thay thế)
+        self.tile_cache: Dict[StreamKey, List[Optional[Image.Image]]] = {}
+        # Màn hình đang xem của từng client: id, hoặc None = tất cả (mặc định 0 = màn hình chính)
+        self.selected_monitor: Dict[str, Optional[int]] = {}
+        # Bố cục màn hình client gửi: [{"id", "left", "top", "width", "height"}]
+        self.monitor_layout: Dict[str, List[Dict[str, int]]] = {}
+        # callback(client_id, monitor) khi phải bỏ RECT/COPY/CACHE vì thiếu ảnh nền -> xin keyframe
+        self.on_keyframe_needed = None
+        self._keyframe_requested: Dict[StreamKey, float] = {}
+        self._keyframe_pending: List[StreamKey] = []
+        # Vùng màn hình mà ảnh nền thể hiện (FULL kèm viewport): (l, u, r, b, native_w, native_h); không có = cả màn hình
+        self.viewport: Dict[StreamKey, Tuple[int, int, int, int, int, int]] = {}
+        # Cache hình dạng con trỏ của từng client: id -> (ảnh RGBA, hotspot); client chọn id bị ghi đè
+        self.cursor_shapes: Dict[str, Dict[int, Tuple[Image.Image, Tuple[int, int]]]] = {}
+
+    def set_monitor_layout(self, client_id: str, layout: List[Dict[str, int]]):
+        with self.lock:
+            self.monitor_layout[client_id] = layout
+
+    def select_monitor(self, client_id: str, monitor: Union[int, str, None]) -> Optional[Image.Image]:
+        """Chọn màn hình hiển thị ("all"/None = tất cả). Trả về ảnh hiện có của lựa chọn mới (nếu có)."""
+        with self.lock:
+            self.selected_monitor[client_id] = None if monitor in (None, "all") else int(monitor)
+            if self.selected_monitor[client_id] is None:
+                return self._compose(client_id)
+            base = self.current_base_image.get((client_id, self.selected_monitor[client_id]))
+            return base.copy() if base is not None else None
+
     def process_video_pdu(self, client_id: str, pdu: dict) -> Optional[Image.Image]:
         """
-        Xử lý PDU video (full/rect), vá ảnh nếu cần, và trả về ảnh nền mới nhất.
+        Xử lý PDU video (full/rect/copy/cache) của một màn hình, vá ảnh nếu cần,
+        và trả về ảnh mới nhất của màn hình đang xem (None nếu PDU thuộc màn hình khác).
+        PDU bị bỏ vì thiếu ảnh nền -> gọi on_keyframe_needed (ngoài lock, tối đa 1 lần / KEYFRAME_RETRY).
         """
+        img = self._process_video_pdu(client_id, pdu)
+        if self._keyframe_pending:
+            with self.lock:
+                pending, self._keyframe_pending = self._keyframe_pending, []
+            if self.on_keyframe_needed is not None:
+                for c_id, monitor in pending:
+                    self.on_keyframe_needed(c_id, monitor)
+        return img
+
+    def _need_keyframe(self, key: StreamKey):
+        # Gọi trong self.lock
+        now = time.time()
+        if now - self._keyframe_requested.get(key, 0.0) >= KEYFRAME_RETRY:
+            self._keyframe_requested[key] = now
+            self._keyframe_pending.append(key)
+
+    def _process_video_pdu(self, client_id: str, pdu: dict) -> Optional[Image.Image]:
         jpg = pdu.get("jpg")
         ptype = pdu.get("type")
-        
-        if not jpg: 
+        monitor = pdu.get("monitor", 0)
+        key = (client_id, monitor)
+
+        if ptype in ("cache", "copy"):
+            with self.lock:
+                if ptype == "cache":
+                    base = self._process_cache_pdu(key, pdu)
+                else:
+                    base = self._process_copy_pdu(key, pdu)
+                return self._present(client_id, monitor, base)
+
+        if not jpg:
             return None
-        
+
+        codec = pdu.get("codec", CODEC_JPEG)
+        if ptype == "rect":
+            size = (pdu.get("w"), pdu.get("h"))
+        else:
+            size = (pdu.get("width"), pdu.get("height"))
+
         try:
-            # Giải mã JPEG của vùng/ảnh mới
-            # Rất quan trọng: Sử dụng io.BytesIO để giải mã in-memory
-            new_img = Image.open(io.BytesIO(jpg)).convert("RGB")
+            # Giải mã vùng/ảnh mới theo codec client đã chọn (JPEG / PNG / PALETTE / RGB565) về RGB, in-memory
+            new_img = decode_region(jpg, codec, size)
         except Exception as e:
             # Nếu giải mã lỗi (ảnh hỏng), bỏ qua frame này
-            print(f"[ManagerViewer] Lỗi giải mã JPEG: {e}")
+            print(f"[ManagerViewer] Lỗi giải mã {CODEC_NAMES.get(codec, codec)}: {e}")
             return None
 
         with self.lock:
-            current_base = self.current_base_image.get(client_id)
-            
+            current_base = self.current_base_image.get(key)
+
             # --- XỬ LÝ PDU FULL (LÀM MỚI TOÀN BỘ) ---
             if ptype == "full":
-                print(f"[Viewer] ===> NHẬN FULL FRAME! Size: {new_img.size}. Client: {client_id}")
-                self.current_base_image[client_id] = new_img
-                self.current_base_size[client_id] = new_img.size
-                return new_img.copy() 
-            
+                print(f"[Viewer] ===> NHẬN FULL FRAME! Size: {new_img.size}. Client: {client_id}, màn hình {monitor}")
+                self.current_base_image[key] = new_img
+                self.current_base_size[key] = new_img.size
+                if pdu.get("viewport"):
+                    self.viewport[key] = tuple(pdu["viewport"])
+                else:
+                    self.viewport.pop(key, None)
+                self._keyframe_requested.pop(key, None)
+                return self._present(client_id, monitor, new_img)
+
             # --- XỬ LÝ PDU RECT (VÁ ẢNH) ---
             elif ptype == "rect":
                 x, y, w, h = pdu.get("x"), pdu.get("y"), pdu.get("w"), pdu.get("h")
@@ -54,8 +133,9 @@ class ManagerViewer:
                 # 1. Kiểm tra ảnh nền: NẾU THIẾU HOẶC KHÔNG KHỚP KÍCH THƯỚC -> BỎ QUA RECT
                 if current_base is None or current_base.size != (full_w, full_h):
                     print(f"[Viewer] Bỏ qua RECT: Thiếu Base Image hoặc size thay đổi ({current_base.size if current_base else 'None'} -> {full_w}x{full_h}). Cần PDU FULL.")
+                    self._need_keyframe(key)
                     return None # Bỏ qua frame RECT này
-                    
+
                 # 2. Vá (paste) vùng thay đổi lên ảnh nền
                 try:
                     # new_img: Vùng ảnh JPEG đã được cắt
@@ -65,14 +145,146 @@ class ManagerViewer:
                     return None
 
                 # 3. Trả về ảnh đã vá
-                return current_base.copy()
-            
-            return current_base.copy() if current_base else None
+                return self._present(client_id, monitor, current_base)
+
+            return self._present(client_id, monitor, current_base)
+
+    def _present(self, client_id: str, monitor: int, base: Optional[Image.Image]) -> Optional[Image.Image]:
+        # Gọi trong self.lock: chỉ trả ảnh khi màn hình vừa cập nhật đang được xem
+        if base is None:
+            return None
+        selected = self.selected_monitor.get(client_id, 0)
+        if selected is None:
+            return self._compose(client_id)
+        return base.copy() if monitor == selected else None
+
+    def _compose(self, client_id: str) -> Optional[Image.Image]:
+        """
+        Ghép ảnh nền của mọi màn hình theo tọa độ desktop ảo của client.
+        Chưa có bố cục -> xếp cạnh nhau theo id. Gọi trong self.lock.
+        """
+        bases = {m: img for (c, m), img in self.current_base_image.items() if c == client_id and img is not None}
+        if not bases:
+            return None
+        layout = {m["id"]: m for m in self.monitor_layout.get(client_id, []) if m["id"] in bases}
+        if len(layout) != len(bases):
+            layout, x = {}, 0
+            for m_id in sorted(bases):
+                w, h = bases[m_id].size
+                layout[m_id] = {"id": m_id, "left": x, "top": 0, "width": w, "height": h}
+                x += w
+
+        # Màn hình có thể bị client thu nhỏ (max_dimension) -> dùng tỉ lệ nhỏ nhất cho cả canvas
+        scale = min(bases[m_id].width / float(m["width"]) for m_id, m in layout.items())
+        left = min(m["left"] for m in layout.values())
+        top = min(m["top"] for m in layout.values())
+        right = max(m["left"] + m["width"] for m in layout.values())
+        bottom = max(m["top"] + m["height"] for m in layout.values())
+        canvas = Image.new("RGB", (max(1, int((right - left) * scale)), max(1, int((bottom - top) * scale))))
+        for m_id, m in layout.items():
+            img = bases[m_id]
+            size = (max(1, int(m["width"] * scale)), max(1, int(m["height"] * scale)))
+            if img.size != size:
+                img = img.resize(size)
+            canvas.paste(img, (int((m["left"] - left) * scale), int((m["top"] - top) * scale)))
+        return canvas
+
+    def _process_copy_pdu(self, key: StreamKey, pdu: dict) -> Optional[Image.Image]:
+        """Cuộn / kéo: chép vùng nguồn của ảnh nền tới điểm đích (crop tạo bản sao nên vùng chồng nhau vẫn đúng)."""
+        x, y, w, h = pdu.get("x"), pdu.get("y"), pdu.get("w"), pdu.get("h")
+        base = self.current_base_image.get(key)
+        if base is None or base.size != (pdu.get("full_w"), pdu.get("full_h")):
+            print("[Viewer] Bỏ qua COPY: Thiếu Base Image hoặc size thay đổi. Cần PDU FULL.")
+            self._need_keyframe(key)
+            return None
+        base.paste(base.crop((x, y, x + w, y + h)), (pdu.get("dst_x"), pdu.get("dst_y")))
+        return base
+
+    def _process_cache_pdu(self, key: StreamKey, pdu: dict) -> Optional[Image.Image]:
+        """
+        Áp dụng các op bitmap cache theo đúng thứ tự client gửi:
+        RESET cấp lại bảng slot, HIT dán ô đã lưu, STORE lưu ô từ ảnh nền (đã vá xong frame này).
+        """
+        ts = pdu.get("tile_size")
+        full_size = (pdu.get("full_w"), pdu.get("full_h"))
+        changed = False
+        base = self.current_base_image.get(key)
+        if base is not None and base.size != full_size:
+            base = None  # Ảnh nền cũ khác kích thước -> không vá, chờ FULL
+        if base is None:
+            self._need_keyframe(key)
+        table = self.tile_cache.get(key, [])
+
+        for op, slot, x, y in pdu.get("ops", []):
+            if op == CACHE_OP_RESET:
+                table = self.tile_cache[key] = [None] * slot
+            elif slot >= len(table):
+                continue
+            elif op == CACHE_OP_HIT:
+                tile = table[slot]
+                if base is not None and tile is not None:
+                    base.paste(tile, (x, y))
+                    changed = True
+            elif op == CACHE_OP_STORE:
+                table[slot] = base.crop((x, y, min(x + ts, base.width), min(y + ts, base.height))) \
+                    if base is not None else None
+
+        return base if changed else None
+
+    def process_cursor_pdu(self, client_id: str, pdu: dict) -> dict:
+        """
+        Giải phần hình dạng của CURSOR PDU theo cache: DEFINE lưu ảnh vào id, USE lấy lại ảnh đã lưu.
+        Hình dạng đổi -> trả về PDU kèm "shape_image" (None = con trỏ ẩn) và "shape_hotspot".
+        Không đổi / id chưa biết -> trả nguyên PDU (GUI giữ hình đang vẽ).
+        """
+        op = pdu.get("shape_op")
+        if op is None:
+            return pdu
+        with self.lock:
+            shapes = self.cursor_shapes.setdefault(client_id, {})
+            if op == CURSOR_SHAPE_DEFINE:
+                size = pdu.get("shape_size")
+                try:
+                    img = Image.frombytes("RGBA", size, zlib.decompress(pdu.get("shape_rgba", b"")))
+                    shapes[pdu["shape_id"]] = (img, pdu.get("shape_hotspot", (0, 0)))
+                except (ValueError, zlib.error) as e:
+                    print(f"[Viewer] Lỗi giải hình dạng con trỏ: {e}")
+            entry = (None, (0, 0)) if op == CURSOR_SHAPE_HIDDEN else shapes.get(pdu.get("shape_id"))
+        if entry is None:
+            return pdu
+        return {**pdu, "shape_image": entry[0], "shape_hotspot": entry[1]}
+
+    def _selected_viewport(self, client_id: str):
+        # Gọi trong self.lock: viewport của màn hình đang xem (ảnh ghép "all" luôn là cả desktop)
+        selected = self.selected_monitor.get(client_id, 0)
+        return None if selected is None else self.viewport.get((client_id, selected))
+
+    def to_screen_norm(self, client_id: str, x: float, y: float) -> Tuple[float, float]:
+        """Tọa độ chuẩn hóa trên ảnh đang hiển thị -> chuẩn hóa trên cả màn hình (input gửi client)."""
+        with self.lock:
+            vp = self._selected_viewport(client_id)
+        if vp is None:
+            return x, y
+        l, u, r, b, w, h = vp
+        return (l + x * (r - l)) / float(w), (u + y * (b - u)) / float(h)
+
+    def from_screen_norm(self, client_id: str, x: float, y: float) -> Tuple[float, float]:
+        """Ngược lại của to_screen_norm (vị trí con trỏ client gửi); ngoài viewport -> < 0 hoặc > 1."""
+        with self.lock:
+            vp = self._selected_viewport(client_id)
+        if vp is None:
+            return x, y
+        l, u, r, b, w, h = vp
+        return (x * w - l) / float(r - l), (y * h - u) / float(b - u)
 
     def clear_frames(self):
         with self.lock:
             self.current_base_image.clear()
             self.current_base_size.clear()
-            
+            self.viewport.clear()
+            self.tile_cache.clear()
+            self.cursor_shapes.clear()
+            self._keyframe_requested.clear()
+
     def stop(self):
-        self.clear_frames()
\ No newline at end of file
+        self.clear_frames()
@@ -71,8 +71,8 @@ class ControlSession(threading.Thread):
                 if from_id == self.client_id:
                     target_id = self.manager_id
                     
-                    if ptype in ("full", "rect"):
-                        # Video frame
+                    if ptype in ("full", "rect", "copy", "cache"):
+                        # Video frame (kèm op bitmap cache, cùng kênh để giữ thứ tự)
                         mcs_frame = MCSLite.build(CHANNEL_VIDEO, raw_payload)
                     elif ptype == "cursor":
                         # Cursor position
@@ -87,7 +87,8 @@ class ControlSession(threading.Thread):
                         # File transfer
                         mcs_frame = MCSLite.build(CHANNEL_FILE, raw_payload)
                     
-                    self.broadcaster.enqueue(target_id, mcs_frame)
+                    # Con trỏ không chờ sau frame video
+                    self.broadcaster.enqueue(target_id, mcs_frame, urgent=ptype == "cursor")
                 
                 # === Từ Manager → Client ===
                 elif from_id == self.manager_id:
@@ -100,13 +101,14 @@ class ControlSession(threading.Thread):
                     elif ptype == "control":
                         # Control command
                         mcs_frame = MCSLite.build(CHANNEL_CONTROL, raw_payload)
-                    elif ptype not in ("full", "rect", "cursor"):
+                    elif ptype not in ("full", "rect", "copy", "cache", "cursor"):
                         # File transfer
                         mcs_frame = MCSLite.build(CHANNEL_FILE, raw_payload)
                     else:
                         continue
                     
-                    self.broadcaster.enqueue(target_id, mcs_frame)
+                    # Input điều khiển không chờ sau các gói khác
+                    self.broadcaster.enqueue(target_id, mcs_frame, urgent=ptype == "input")
         
         except Exception as e:
             reason = f"Error: {e}"
@@ -21,7 +21,7 @@ from src.server.server_constants import (
     CMD_CONNECT_CLIENT, CMD_SESSION_STARTED, CMD_SESSION_ENDED,
     CMD_VIEW_CLIENT, CMD_CONTROL_CLIENT, CMD_STOP_VIEW, CMD_STOP_CONTROL,
     CMD_VIEW_STARTED, CMD_VIEW_STOPPED, CMD_CONTROL_STARTED, CMD_CONTROL_STOPPED, CMD_CONTROL_DENIED,
-    CMD_ERROR, CHANNEL_CONTROL, CHANNEL_INPUT
+    CMD_BITMAP_CACHE, CMD_SELECT_MONITOR, CMD_MONITOR_LIST, CMD_WATCHERS, CMD_KEYFRAME, CMD_COLOR_MODE, CMD_VIEWPORT, CMD_ERROR, CHANNEL_CONTROL, CHANNEL_INPUT
 )
 from src.server.core.auth_handler import (
     sign_in as auth_sign_in, 
@@ -32,6 +32,7 @@ from src.server.core.session import ServerSession
 
 from src.common.network.pdu_builder import PDUBuilder
 from src.common.network.mcs_layer import MCSLite
+from src.common.network.constants import COLOR_MODES
 
 # Import ViewSession và ControlSession
 from src.server.core.view_session import ViewSession
@@ -75,6 +76,21 @@ class SessionManager(threading.Thread):
         
         # Pending connection requests (Case 1: Manager connects before Client starts)
         self.pending_requests = {}  # { client_username: manager_id }
+
+        # Số ô bitmap cache mỗi manager giữ được (manager báo sau khi đăng ký)
+        self.bitmap_cache_caps = {}  # { manager_id -> entries }
+        # Dung lượng cache đã gửi cho client (không đổi thì không gửi lại -> không buộc keyframe mới)
+        self.negotiated_cache = {}  # { client_id -> entries }
+        # Màn hình mỗi manager muốn xem trên từng client (chưa chọn -> màn hình chính)
+        self.monitor_requests = {}  # { client_id -> { manager_id -> "all" | [monitor_ids] } }
+        # Chế độ màu mỗi manager chọn (đường truyền yếu) và chế độ client đang dùng (mặc định "full")
+        self.color_mode_requests = {}  # { client_id -> { manager_id -> mode } }
+        self.applied_color_mode = {}  # { client_id -> mode }
+        # Viewport mỗi manager đang hiển thị và viewport đã gửi cho client (không đổi thì không gửi lại)
+        self.viewport_requests = {}  # { client_id -> { manager_id -> (monitor, (x0, y0, x1, y1), (w, h) | None) } }
+        self.applied_viewport = {}  # { client_id -> text }
+        # Client đang có ít nhất một manager xem/điều khiển (client không ai xem thì dừng chụp màn hình)
+        self.watched_clients = set()
         
         self.lock = threading.Lock()
 
@@ -119,6 +135,7 @@ class SessionManager(threading.Thread):
         with self.lock:
             role = self.clients.pop(client_id, ROLE_UNKNOWN)
             username = self.authenticated_users.pop(client_id, None)
+            self.watched_clients.discard(client_id)
 
         if username:
             print(f"[Auth] User {username} logged out implicitly.")
@@ -132,6 +149,7 @@ class SessionManager(threading.Thread):
             # Cleanup manager_sessions
             with self.lock:
                 self.manager_sessions.pop(client_id, None)
+                self.bitmap_cache_caps.pop(client_id, None)
         
         elif role == ROLE_CLIENT:
             # Client disconnect → Dừng tất cả sessions liên quan đến client
@@ -139,6 +157,12 @@ class SessionManager(threading.Thread):
             
             # Dừng view session
             with self.lock:
+                self.monitor_requests.pop(client_id, None)
+                self.color_mode_requests.pop(client_id, None)
+                self.applied_color_mode.pop(client_id, None)
+                self.viewport_requests.pop(client_id, None)
+                self.applied_viewport.pop(client_id, None)
+                self.negotiated_cache.pop(client_id, None)
                 if client_id in self.view_sessions:
                     view_session = self.view_sessions[client_id]
                     viewers = list(view_session.viewers)
@@ -241,7 +265,7 @@ class SessionManager(threading.Thread):
         # === XỬ LÝ PDU TỪ CLIENT (authenticated) ===
         if role == ROLE_CLIENT:
             # Client gửi video/cursor/control
-            if pdu_type in ("full", "rect", "cursor"):
+            if pdu_type in ("full", "rect", "copy", "cache", "cursor"):
                 # Video/Cursor frames → Broadcast tới viewers VÀ controller
                 raw_payload = pdu.get("_raw_payload")
                 if not raw_payload:
@@ -249,15 +273,21 @@ class SessionManager(threading.Thread):
                 
                 with self.lock:
                     # 1. Broadcast tới tất cả viewers (nếu có)
-                    if client_id in self.view_sessions:
-                        view_session = self.view_sessions[client_id]
-                        view_session.broadcast_frame(pdu_type, raw_payload)
+                    view_session = self.view_sessions.get(client_id)
+                    if view_session:
+                        view_session.broadcast_frame(pdu_type, raw_payload, pdu)
                     
-                    # 2. Gửi tới controller (nếu có)
+                    # 2. Gửi tới controller (nếu có) - trừ khi controller đã nhận qua ViewSession
+                    # (CONTROL luôn tự tạo VIEW; gửi 2 lần sẽ áp op bitmap cache 2 lần)
                     if client_id in self.control_sessions:
                         control_session = self.control_sessions[client_id]
-                        control_session.enqueue_pdu(client_id, pdu)
+                        if not (view_session and view_session.is_viewing(control_session.manager_id)):
+                            control_session.enqueue_pdu(client_id, pdu)
             
+            elif pdu_type == "control" and self._control_message(pdu).startswith(CMD_MONITOR_LIST):
+                # Bố cục màn hình → tất cả manager đang xem (không chỉ controller)
+                self._forward_monitor_list(client_id, self._control_message(pdu)[len(CMD_MONITOR_LIST):])
+
             elif pdu_type == "control":
                 # Control message → Gửi tới controller (nếu có)
                 with self.lock:
@@ -289,8 +319,11 @@ class SessionManager(threading.Thread):
             elif pdu_type == "control":
                 # Control command
                 with self.lock:
+                    # Chọn màn hình / yêu cầu keyframe luôn do server xử lý (mọi viewer), kể cả khi đang control
+                    if self._control_message(pdu).startswith((CMD_SELECT_MONITOR, CMD_KEYFRAME, CMD_COLOR_MODE, CMD_VIEWPORT)):
+                        self.pdu_queue.put((client_id, pdu))
                     # Nếu đang trong control session, forward
-                    if client_id in self.manager_sessions and self.manager_sessions[client_id]["control"]:
+                    elif client_id in self.manager_sessions and self.manager_sessions[client_id]["control"]:
                         target_client_id = self.manager_sessions[client_id]["control"]
                         if target_client_id in self.control_sessions:
                             control_session = self.control_sessions[target_client_id]
@@ -354,6 +387,8 @@ class SessionManager(threading.Thread):
                         
                         # Hậu xử lý: Nếu là Client login -> Báo cho Manager biết
                         if requested_role == ROLE_CLIENT:
+                            # Chưa ai xem -> client chỉ bắt đầu chụp khi có viewer / controller
+                            self._update_watchers(client_id, force=True)
                             self._broadcast_client_list()
                         elif requested_role == ROLE_MANAGER:
                             self._send_client_list(client_id)
@@ -435,6 +470,91 @@ class SessionManager(threading.Thread):
                 else:
                     self._send_control_pdu(client_id, f"{CMD_ERROR}:Thiếu thông tin đăng ký")
 
+            # Manager báo dung lượng bitmap cache (gửi ngay sau khi đăng ký)
+            elif msg.startswith(CMD_BITMAP_CACHE):
+                if self.clients.get(client_id) != ROLE_MANAGER:
+                    return
+                try:
+                    entries = max(0, int(msg.split(":", 1)[1]))
+                except ValueError:
+                    entries = 0
+                with self.lock:
+                    self.bitmap_cache_caps[client_id] = entries
+
+            # Manager chọn màn hình đang xem: "monitor:<client_id>:<0,1|all>"
+            elif msg.startswith(CMD_SELECT_MONITOR):
+                if self.clients.get(client_id) != ROLE_MANAGER:
+                    return
+                try:
+                    target_client_id, selection = msg[len(CMD_SELECT_MONITOR):].rsplit(":", 1)
+                except ValueError:
+                    return
+                selection = selection.strip()
+                if selection != "all":
+                    selection = [int(p) for p in selection.split(",") if p.strip().isdigit()]
+                with self.lock:
+                    view_session = self.view_sessions.get(target_client_id)
+                    if not (view_session and view_session.is_viewing(client_id)):
+                        return
+                    self.monitor_requests.setdefault(target_client_id, {})[client_id] = selection
+                self._update_monitor_selection(target_client_id)
+
+            # Manager chọn chế độ màu (đường truyền yếu): "colormode:<client_id>:<full|rgb16|palette8|gray>"
+            elif msg.startswith(CMD_COLOR_MODE):
+                if self.clients.get(client_id) != ROLE_MANAGER:
+                    return
+                try:
+                    target_client_id, mode = msg[len(CMD_COLOR_MODE):].rsplit(":", 1)
+                except ValueError:
+                    return
+                mode = mode.strip()
+                if mode not in COLOR_MODES:
+                    return
+                with self.lock:
+                    view_session = self.view_sessions.get(target_client_id)
+                    if not (view_session and view_session.is_viewing(client_id)):
+                        return
+                    self.color_mode_requests.setdefault(target_client_id, {})[client_id] = mode
+                self._update_color_mode(target_client_id)
+
+            # Manager báo viewport: "viewport:<client_id>:<monitor|all>:<x0>,<y0>,<x1>,<y1>:<w>x<h>"
+            elif msg.startswith(CMD_VIEWPORT):
+                if self.clients.get(client_id) != ROLE_MANAGER:
+                    return
+                try:
+                    target_client_id, monitor, region, size = msg[len(CMD_VIEWPORT):].rsplit(":", 3)
+                    monitor = "all" if monitor.strip() == "all" else int(monitor)
+                    region = tuple(max(0.0, min(1.0, float(v))) for v in region.split(","))
+                    w, h = (int(v) for v in size.lower().split("x"))
+                except ValueError:
+                    return
+                if len(region) != 4 or region[2] <= region[0] or region[3] <= region[1]:
+                    return
+                with self.lock:
+                    view_session = self.view_sessions.get(target_client_id)
+                    if not (view_session and view_session.is_viewing(client_id)):
+                        return
+                    self.viewport_requests.setdefault(target_client_id, {})[client_id] = \
+                        (monitor, region, (w, h) if w > 0 and h > 0 else None)
+                self._update_viewport(target_client_id)
+
+            # Viewer thiếu ảnh nền (bỏ RECT) -> chuyển yêu cầu keyframe tới client: "keyframe:<client_id>:<monitor>"
+            # Client gộp các yêu cầu dồn dập (nhiều viewer cùng vào) thành một FULL frame
+            elif msg.startswith(CMD_KEYFRAME):
+                if self.clients.get(client_id) != ROLE_MANAGER:
+                    return
+                try:
+                    target_client_id, monitor = msg[len(CMD_KEYFRAME):].rsplit(":", 1)
+                except ValueError:
+                    return
+                with self.lock:
+                    view_session = self.view_sessions.get(target_client_id)
+                    control_session = self.control_sessions.get(target_client_id)
+                    watching = (view_session is not None and view_session.is_viewing(client_id)) or \
+                        (control_session is not None and control_session.manager_id == client_id)
+                if watching:
+                    self._send_control_pdu(target_client_id, f"{CMD_KEYFRAME}{monitor.strip() or 'all'}")
+
             # 3. Xử lý Lấy danh sách (nếu Manager yêu cầu thủ công)
             elif msg == CMD_LIST_CLIENTS:
                 if self.clients.get(client_id) == ROLE_MANAGER:
@@ -566,6 +686,7 @@ class SessionManager(threading.Thread):
 
         # Gửi thông báo SESSION_STARTED cho cả 2 để Client bắt đầu gửi ảnh
         self._send_control_pdu(manager_id, f"{CMD_SESSION_STARTED}:{client_id}")
+        self._update_watchers(client_id)
         self._send_control_pdu(client_id, f"{CMD_SESSION_STARTED}:{manager_id}")
         
         # Cập nhật danh sách (Client này giờ đã bận)
@@ -583,6 +704,7 @@ class SessionManager(threading.Thread):
         # Thông báo cho 2 bên
         self._send_control_pdu(session.manager_id, f"{CMD_SESSION_ENDED}:{session.client_id}")
         self._send_control_pdu(session.client_id, f"{CMD_SESSION_ENDED}:{session.manager_id}")
+        self._update_watchers(session.client_id)
         
         # Client rảnh trở lại -> Cập nhật list
         self._broadcast_client_list()
@@ -750,6 +872,9 @@ class SessionManager(threading.Thread):
                     
                     success = True
                     already_viewing = False
+                    # Server đã phát lại ảnh hiện tại (keyframe cache) -> không cần client encode lại
+                    selection = self.monitor_requests.get(client_id, {}).get(manager_id, [0])
+                    replayed = selection != "all" and all(view_session.has_keyframe(m) for m in selection)
                 else:
                     success = False
                     already_viewing = True
@@ -768,6 +893,21 @@ class SessionManager(threading.Thread):
                 print(f"[ViewSession] Sending view_started commands (OUTSIDE lock)...")
                 self._send_control_pdu(manager_id, f"{CMD_VIEW_STARTED}:{client_id}")
                 print(f"[ViewSession] ✅ Sent view_started to manager {manager_id}")
+                # Thương lượng lại; dung lượng đổi -> client RESET cache ở keyframe kế tiếp
+                # (không đổi: viewer mới đã có cache qua phần phát lại từ RESET gần nhất)
+                capacity = self._negotiate_bitmap_cache(client_id)
+                with self.lock:
+                    changed = self.negotiated_cache.get(client_id) != capacity
+                    self.negotiated_cache[client_id] = capacity
+                if changed:
+                    self._send_control_pdu(client_id, f"{CMD_BITMAP_CACHE}{capacity}")
+                self._update_monitor_selection(client_id)
+                self._update_color_mode(client_id)
+                self._update_viewport(client_id)
+                self._update_watchers(client_id)
+                if not replayed:
+                    # Viewer mới chưa có ảnh nền -> cần keyframe (client gộp nhiều viewer vào cùng lúc)
+                    self._send_control_pdu(client_id, f"{CMD_KEYFRAME}all")
                 self._send_control_pdu(client_id, f"{CMD_VIEW_STARTED}:{manager_id}")
                 print(f"[ViewSession] ✅ Sent view_started to client {client_id}")
                 print(f"[ViewSession] Manager {manager_id} started viewing {client_id}")
@@ -780,10 +920,133 @@ class SessionManager(threading.Thread):
         
         return False
     
+    def _negotiate_bitmap_cache(self, client_id):
+        """Dung lượng bitmap cache chung = nhỏ nhất trong các viewer (viewer chưa báo -> 0 = tắt)."""
+        with self.lock:
+            view_session = self.view_sessions.get(client_id)
+            viewers = view_session.get_viewers() if view_session else []
+            if not viewers:
+                return 0
+            return min(self.bitmap_cache_caps.get(m, 0) for m in viewers)
+
+    @staticmethod
+    def _control_message(pdu):
+        msg = pdu.get("message", "")
+        return msg.decode("utf-8", errors="ignore") if isinstance(msg, bytes) else msg
+
+    def _update_monitor_selection(self, client_id):
+        """
+        Gửi cho client hợp các màn hình mà các viewer đang xem (viewer chưa chọn = màn hình chính).
+        Client chỉ chụp/encode các màn hình này.
+        """
+        with self.lock:
+            view_session = self.view_sessions.get(client_id)
+            viewers = view_session.get_viewers() if view_session else []
+            requests = self.monitor_requests.get(client_id, {})
+            wanted = set()
+            for m in viewers:
+                selection = requests.get(m, [0])
+                if selection == "all":
+                    wanted = None
+                    break
+                wanted.update(selection)
+        if not viewers:
+            return
+        text = "all" if wanted is None else ",".join(str(i) for i in sorted(wanted or {0}))
+        self._send_control_pdu(client_id, f"{CMD_SELECT_MONITOR}{text}")
+
+    def _update_color_mode(self, client_id):
+        """
+        Client chỉ có một luồng encode -> dùng chế độ hạn chế nhất trong các viewer (viewer chưa chọn = "full"):
+        một viewer ở chi nhánh đường truyền yếu kéo cả phiên xuống. Chỉ gửi khi đổi (mỗi lần đổi client gửi keyframe).
+        """
+        with self.lock:
+            view_session = self.view_sessions.get(client_id)
+            viewers = view_session.get_viewers() if view_session else []
+            if not viewers:
+                return
+            requests = self.color_mode_requests.get(client_id, {})
+            mode = max((requests.get(m, "full") for m in viewers), key=COLOR_MODES.index)
+            if self.applied_color_mode.get(client_id, "full") == mode:
+                return
+            self.applied_color_mode[client_id] = mode
+        self._send_control_pdu(client_id, f"{CMD_COLOR_MODE}{mode}")
+
+    def _update_viewport(self, client_id):
+        """
+        Client chỉ có một luồng encode cho mỗi màn hình -> gửi viewport bao được mọi viewer:
+        hợp các vùng, ở mật độ điểm ảnh cao nhất mà một viewer cần. Viewer khác màn hình / chưa báo
+        -> bỏ giới hạn (cả màn hình, chỉ max_dimension). Chỉ gửi khi đổi (mỗi lần đổi client gửi keyframe).
+        """
+        with self.lock:
+            view_session = self.view_sessions.get(client_id)
+            viewers = view_session.get_viewers() if view_session else []
+            if not viewers:
+                return
+            requests = [self.viewport_requests.get(client_id, {}).get(m) for m in viewers]
+            if any(r is None for r in requests) or len({r[0] for r in requests}) > 1:
+                text = "all:0,0,1,1:0x0"
+            else:
+                x0, y0 = min(r[1][0] for r in requests), min(r[1][1] for r in requests)
+                x1, y1 = max(r[1][2] for r in requests), max(r[1][3] for r in requests)
+                w = h = 0
+                if all(r[2] is not None for r in requests):
+                    # Số px hiển thị trên toàn bộ chiều rộng / cao màn hình, lấy viewer cần nét nhất
+                    w = int(max(r[2][0] / (r[1][2] - r[1][0]) for r in requests) * (x1 - x0) + 0.5)
+                    h = int(max(r[2][1] / (r[1][3] - r[1][1]) for r in requests) * (y1 - y0) + 0.5)
+                text = f"{requests[0][0]}:{x0:.4f},{y0:.4f},{x1:.4f},{y1:.4f}:{w}x{h}"
+            if self.applied_viewport.get(client_id, "all:0,0,1,1:0x0") == text:
+                return
+            self.applied_viewport[client_id] = text
+        self._send_control_pdu(client_id, f"{CMD_VIEWPORT}{text}")
+
+    def _watcher_count(self, client_id):
+        # Số manager đang xem / điều khiển client. Gọi trong self.lock
+        watchers = set()
+        view_session = self.view_sessions.get(client_id)
+        if view_session:
+            watchers.update(view_session.get_viewers())
+        control_session = self.control_sessions.get(client_id)
+        if control_session:
+            watchers.add(control_session.manager_id)
+        session = self.client_session_map.get(client_id)
+        if session and session.client_id == client_id:
+            watchers.add(session.manager_id)
+        return len(watchers)
+
+    def _update_watchers(self, client_id, force=False):
+        """
+        Báo client khi số người xem chuyển 0 <-> khác 0: client tạm dừng chụp / encode khi không ai xem
+        và gửi FULL frame khi có người xem trở lại. force: luôn gửi (lúc client vừa đăng nhập).
+        """
+        with self.lock:
+            if self.clients.get(client_id) != ROLE_CLIENT:
+                return
+            count = self._watcher_count(client_id)
+            if not force and (count > 0) == (client_id in self.watched_clients):
+                return
+            if count:
+                self.watched_clients.add(client_id)
+            else:
+                self.watched_clients.discard(client_id)
+        self._send_control_pdu(client_id, f"{CMD_WATCHERS}{count}")
+
+    def _forward_monitor_list(self, client_id, layout_json):
+        """Chuyển bố cục màn hình của client tới các manager đang xem / điều khiển."""
+        with self.lock:
+            view_session = self.view_sessions.get(client_id)
+            targets = set(view_session.get_viewers()) if view_session else set()
+            control_session = self.control_sessions.get(client_id)
+            if control_session:
+                targets.add(control_session.manager_id)
+        for manager_id in targets:
+            self._send_control_pdu(manager_id, f"{CMD_MONITOR_LIST}{client_id}:{layout_json}")
+
     def _stop_view_session(self, manager_id):
         """
         Dừng tất cả VIEW sessions của manager
         """
+        stopped = []
         with self.lock:
             if manager_id not in self.manager_sessions:
                 return
@@ -791,6 +1054,9 @@ class SessionManager(threading.Thread):
             viewing_clients = self.manager_sessions[manager_id]["view"].copy()
             
             for client_id in viewing_clients:
+                self.monitor_requests.get(client_id, {}).pop(manager_id, None)
+                self.color_mode_requests.get(client_id, {}).pop(manager_id, None)
+                self.viewport_requests.get(client_id, {}).pop(manager_id, None)
                 if client_id in self.view_sessions:
                     view_session = self.view_sessions[client_id]
                     is_empty = view_session.remove_viewer(manager_id)
@@ -798,14 +1064,22 @@ class SessionManager(threading.Thread):
                     # Nếu không còn viewer nào, xóa ViewSession
                     if is_empty:
                         del self.view_sessions[client_id]
+                        self.negotiated_cache.pop(client_id, None)
                         print(f"[ViewSession] Deleted ViewSession for {client_id} (no viewers)")
-                    
-                    # Thông báo
-                    self._send_control_pdu(manager_id, f"{CMD_VIEW_STOPPED}:{client_id}")
-                    self._send_control_pdu(client_id, f"{CMD_VIEW_STOPPED}:{manager_id}")
+                    stopped.append(client_id)
             
             # Clear danh sách view của manager
             self.manager_sessions[manager_id]["view"] = []
+
+        # Thông báo NGOÀI lock (_send_control_pdu lấy self.lock để cấp seq)
+        for client_id in stopped:
+            self._send_control_pdu(manager_id, f"{CMD_VIEW_STOPPED}:{client_id}")
+            self._send_control_pdu(client_id, f"{CMD_VIEW_STOPPED}:{manager_id}")
+            # Viewer còn lại có thể xem ít màn hình hơn -> client dừng chụp màn hình thừa
+            self._update_monitor_selection(client_id)
+            self._update_color_mode(client_id)
+            self._update_viewport(client_id)
+            self._update_watchers(client_id)
     
     def _start_control_session(self, manager_id, client_id):
         """
@@ -875,6 +1149,7 @@ class SessionManager(threading.Thread):
             print(f"[ControlSession] Sending control_started commands (OUTSIDE lock)...")
             self._send_control_pdu(manager_id, f"{CMD_CONTROL_STARTED}:{client_id}")
             print(f"[ControlSession] ✅ Sent control_started to manager {manager_id}")
+            self._update_watchers(client_id)
             self._send_control_pdu(client_id, f"{CMD_CONTROL_STARTED}:{manager_id}")
             print(f"[ControlSession] ✅ Sent control_started to client {client_id}")
             print(f"[ControlSession] Successfully notified both parties")
@@ -926,6 +1201,7 @@ class SessionManager(threading.Thread):
         if client_id:
             self._send_control_pdu(manager_id, f"{CMD_CONTROL_STOPPED}:{client_id}")
             self._send_control_pdu(client_id, f"{CMD_CONTROL_STOPPED}:{manager_id}")
+            self._update_watchers(client_id)
             print(f"[ControlSession] Stopped control for manager {manager_id}, but VIEW session remains active")
             
             # Cập nhật danh sách client
@@ -963,6 +1239,7 @@ class SessionManager(threading.Thread):
         if cleaned_up:
             self._send_control_pdu(control_session.manager_id, f"{CMD_CONTROL_STOPPED}:{control_session.client_id}")
             self._send_control_pdu(control_session.client_id, f"{CMD_CONTROL_STOPPED}:{control_session.manager_id}")
+            self._update_watchers(control_session.client_id)
             
             # Cập nhật danh sách client
             self._broadcast_client_list()
\ No newline at end of file
@@ -3,7 +3,89 @@
 import threading
 from queue import Queue, Empty
 from src.server.server_constants import CHANNEL_VIDEO, CHANNEL_CURSOR
-from src.common.network.mcs_layer import MCSLite
+from src.common.network.pdu_parser import PDUParser
+from src.common.network.constants import (
+    FRAGMENT_FLAG, MONITOR_SHIFT, MONITOR_MASK, CACHE_OP_RESET, CURSOR_SHAPE_DEFINE,
+)
+
+
+class KeyframeLog:
+    """
+    Các PDU video của MỘT màn hình kể từ keyframe gần nhất, để viewer mới nhận ngay ảnh hiện tại
+    (phát lại đúng thứ tự) thay vì chờ client encode lại FULL frame.
+    - Điểm đồng bộ: FULL khi bitmap cache tắt; FULL + CACHE có RESET ở đầu khi cache bật
+      (op HIT/STORE sau đó phụ thuộc toàn bộ lịch sử từ RESET nên không cắt ở FULL thường được)
+    - Nén: RECT bị một RECT sau che hoàn toàn thì bỏ (nếu giữa chúng không có COPY / CACHE)
+    - Vượt MAX_BYTES: bỏ log tới FULL kế tiếp, viewer mới dùng đường xin keyframe như cũ
+    """
+
+    MAX_BYTES = 8 * 1024 * 1024
+
+    def __init__(self):
+        self.entries = []        # [(pdu_type, rect hoặc None, raw_payload)], bắt đầu bằng một FULL
+        self.nbytes = 0
+        self.valid = False       # Log bắt đầu ở điểm đồng bộ -> phát lại được
+        self.cache_active = False
+        self._full_seq = None    # seq của FULL gần nhất (FULL bị chia fragment có chung seq)
+        self._full_start = 0     # Vị trí FULL gần nhất trong log
+        self._barrier = 0        # RECT trước vị trí này không được nén (đã có COPY / CACHE phía sau)
+        self._parser = PDUParser()  # Ghép fragment của CACHE để đọc op
+
+    def _truncate(self, start):
+        self.entries = self.entries[start:]
+        self.nbytes = sum(len(raw) for _, _, raw in self.entries)
+        self._full_start = 0
+        self._barrier = 0
+
+    def record(self, pdu_type, pdu, raw):
+        fragment = bool(pdu.get("flags", 0) & FRAGMENT_FLAG)
+        rect = None
+        if pdu_type == "full":
+            if pdu.get("seq") != self._full_seq:
+                self._full_seq = pdu.get("seq")
+                self._full_start = len(self.entries)
+                if not self.valid or not self.cache_active:
+                    # Cache bật thì chỉ hợp lệ lại khi thấy RESET ngay sau FULL này
+                    self._truncate(self._full_start)
+                    self.valid = not self.cache_active
+        elif self._full_seq is None:
+            return  # Chưa có FULL nào (hoặc vừa bỏ log vì quá lớn)
+        elif pdu_type == "cache":
+            parsed = self._parser.parse(raw) if fragment else pdu
+            ops = parsed.get("ops") or []
+            if ops and ops[0][0] == CACHE_OP_RESET:
+                # Keyframe: cache của viewer mới được dựng lại từ FULL ngay trước RESET
+                self.cache_active = ops[0][1] > 0
+                self._truncate(self._full_start)
+                self.valid = True
+            self._barrier = len(self.entries) + 1
+        elif pdu_type == "copy":
+            self._barrier = len(self.entries) + 1
+        elif pdu_type == "rect" and not fragment:
+            rect = (pdu["x"], pdu["y"], pdu["x"] + pdu["w"], pdu["y"] + pdu["h"])
+            self._compact(rect)
+
+        self.entries.append((pdu_type, rect, raw))
+        self.nbytes += len(raw)
+        if self.nbytes > self.MAX_BYTES:
+            self.entries = []
+            self.nbytes = 0
+            self.valid = False
+            self._full_seq = None
+
+    def _compact(self, rect):
+        l, u, r, b = rect
+        start = max(self._barrier, self._full_start)
+        kept = self.entries[:start]
+        for entry in self.entries[start:]:
+            old = entry[1]
+            if entry[0] == "rect" and old is not None and \
+                    l <= old[0] and u <= old[1] and r >= old[2] and b >= old[3]:
+                self.nbytes -= len(entry[2])
+                continue
+            kept.append(entry)
+        self.entries = kept
+
 
 class ViewSession:
     """
@@ -17,18 +99,55 @@ class ViewSession:
         self.broadcaster = broadcaster
         self.viewers = set()  # Set of manager_ids đang view
         self.lock = threading.Lock()
+        # Keyframe cache: PDU video từ keyframe gần nhất của từng màn hình (phát lại cho viewer mới)
+        self.keyframes = {}  # { monitor_id -> KeyframeLog }
+        # Cache hình dạng con trỏ của client: DEFINE mới nhất của từng id + CURSOR PDU cuối (phát lại cho viewer mới)
+        self.cursor_shapes = {}  # { shape_id -> raw_payload }
+        self.last_cursor = None
         self.running = True
         
         print(f"[ViewSession] Created for client {client_id}")
     
     def add_viewer(self, manager_id):
-        """Thêm manager vào danh sách viewers"""
+        """
+        Thêm manager vào danh sách viewers và phát lại keyframe cache cho manager đó
+        (gọi trong lock của SessionManager, cùng lock với broadcast_frame -> không lẫn thứ tự với frame mới)
+        """
         with self.lock:
             if manager_id not in self.viewers:
                 self.viewers.add(manager_id)
                 print(f"[ViewSession] Manager {manager_id} joined viewing {self.client_id}. Total viewers: {len(self.viewers)}")
+                self._replay(manager_id)
                 return True
             return False
+
+    def _replay(self, manager_id):
+        # Gọi trong self.lock
+        for monitor, log in self.keyframes.items():
+            if not log.valid:
+                continue
+            for _, _, raw in log.entries:
+                try:
+                    self.broadcaster.enqueue_pdu(manager_id, CHANNEL_VIDEO, raw)
+                except Exception as e:
+                    print(f"[ViewSession] Error replaying keyframe to {manager_id}: {e}")
+                    return
+            print(f"[ViewSession] Replayed {len(log.entries)} PDU ({log.nbytes} bytes) of monitor {monitor} to {manager_id}")
+        cursor = list(self.cursor_shapes.values())
+        if self.last_cursor is not None:
+            cursor.append(self.last_cursor)
+        for raw in cursor:
+            try:
+                self.broadcaster.enqueue_pdu(manager_id, CHANNEL_CURSOR, raw, urgent=True)
+            except Exception as e:
+                print(f"[ViewSession] Error replaying cursor to {manager_id}: {e}")
+                return
+
+    def has_keyframe(self, monitor=0):
+        """Có ảnh hiện tại của màn hình để phát lại cho viewer mới (không cần client gửi keyframe)."""
+        with self.lock:
+            log = self.keyframes.get(monitor)
+            return log is not None and log.valid
     
     def remove_viewer(self, manager_id):
         """Xóa manager khỏi danh sách viewers"""
@@ -44,38 +163,52 @@ class ViewSession:
         with self.lock:
             return manager_id in self.viewers
     
+    def get_viewers(self):
+        """Bản sao danh sách viewers"""
+        with self.lock:
+            return list(self.viewers)
+    
     def has_viewers(self):
         """Kiểm tra xem có viewer nào không"""
         with self.lock:
             return len(self.viewers) > 0
     
-    def broadcast_frame(self, pdu_type, raw_payload):
+    def broadcast_frame(self, pdu_type, raw_payload, pdu=None):
         """
         Broadcast video/cursor frame tới tất cả viewers
-        pdu_type: "full", "rect", "cursor"
+        pdu_type: "full", "rect", "copy", "cache", "cursor"
         raw_payload: PDU bytes đã build
+        pdu: PDU đã parse (có thì frame video được ghi vào keyframe cache)
         """
         with self.lock:
             viewer_list = list(self.viewers)  # Copy để tránh modification during iteration
+            if pdu_type in ("full", "rect", "copy", "cache") and pdu is not None:
+                monitor = (pdu.get("flags", 0) & MONITOR_MASK) >> MONITOR_SHIFT
+                try:
+                    self.keyframes.setdefault(monitor, KeyframeLog()).record(pdu_type, pdu, raw_payload)
+                except Exception as e:
+                    print(f"[ViewSession] Keyframe cache error: {e}")
+                    self.keyframes.pop(monitor, None)
+            elif pdu_type == "cursor" and pdu is not None:
+                if pdu.get("shape_op") == CURSOR_SHAPE_DEFINE:
+                    self.cursor_shapes[pdu["shape_id"]] = raw_payload
+                self.last_cursor = raw_payload
         
         if not viewer_list:
             return
         
         # Chọn channel dựa trên pdu_type
-        if pdu_type in ("full", "rect"):
+        if pdu_type in ("full", "rect", "copy", "cache"):
             channel_id = CHANNEL_VIDEO
         elif pdu_type == "cursor":
             channel_id = CHANNEL_CURSOR
         else:
             return
         
-        # Build MCS frame một lần
-        mcs_frame = MCSLite.build(channel_id, raw_payload)
-        
-        # Gửi tới tất cả viewers
+        # Gửi tới tất cả viewers (cùng một raw_payload, header MCS/TPKT do broadcaster thêm lúc gửi)
         for manager_id in viewer_list:
             try:
-                self.broadcaster.enqueue(manager_id, mcs_frame)
+                self.broadcaster.enqueue_pdu(manager_id, channel_id, raw_payload, urgent=channel_id == CHANNEL_CURSOR)
             except Exception as e:
                 print(f"[ViewSession] Error broadcasting to {manager_id}: {e}")
     
@@ -89,4 +222,7 @@ class ViewSession:
         self.running = False
         with self.lock:
             self.viewers.clear()
+            self.keyframes.clear()
+            self.cursor_shapes.clear()
+            self.last_cursor = None
         print(f"[ViewSession] Stopped for client {self.client_id}")
@@ -1,29 +1,43 @@
 # server/network/server_broadcaster.py
 
+import itertools
 import threading
-from queue import Queue, Empty
-from src.common.network.tpkt_layer import TPKTLayer
+from queue import PriorityQueue, Empty, Full
+from src.common.network.constants import (
+    FRAMING_V1, FRAMING_V2, TPKT_OVERHEAD, MCS_HDR_SIZE, MAX_TPKT_LENGTH, V1_FRAGMENT_SIZE,
+)
+from src.common.network.mcs_layer import MCSLite
+from src.common.network.pdu_builder import PDUBuilder
+from src.common.network.tpkt_layer import TPKTLayer, SegmentWriter
 
-""" Nhận (target_id, mcs_frame) từ queue, đóng gói TPKT và gửi đi.
-    mcs_frame: đã bao gồm (channel header + pdu payload). """
+""" Nhận (target_id, channel_id, payload) từ queue, gửi header TPKT/MCS + payload theo kiểu scatter-gather
+    (không nối payload vào header; cùng một payload dùng chung cho mọi viewer).
+    Gói urgent (vị trí con trỏ, input điều khiển) được gửi trước các gói thường (frame video)
+    đang chờ trong hàng đợi; thứ tự giữa các gói cùng loại được giữ nguyên.
+    MCS frame lớn (framing v2) gửi cho kết nối framing v1 được chia lại thành fragment 64000 byte. """
 class ServerBroadcaster(threading.Thread):
     def __init__(self):
         super().__init__(daemon=True, name="Broadcaster")
         self.running = True
-        self.queue = Queue(maxsize=4096) # Tăng queue size để xử lý input events
+        self.queue = PriorityQueue(maxsize=4096) # (ưu tiên, thứ tự, target_id, channel_id, payload)
+        self._order = itertools.count()
         self.clients = {}  # client_id -> ssl_socket
+        self.framing = {}  # client_id -> framing đã thỏa thuận
         self.lock = threading.Lock()
+        self.writer = SegmentWriter() # Chỉ luồng broadcaster dùng
 
     # Lưu socket vào danh sách client
-    def register(self, client_id: str, ssl_sock):
+    def register(self, client_id: str, ssl_sock, framing: int = FRAMING_V1):
         with self.lock:
             self.clients[client_id] = ssl_sock
+            self.framing[client_id] = framing
         print(f"[Broadcaster] Đã đăng ký {client_id}")
 
     # Xóa socket khỏi danh sách client
     def unregister(self, client_id: str):
         with self.lock:
             self.clients.pop(client_id, None)
+            self.framing.pop(client_id, None)
         print(f"[Broadcaster] Đã hủy đăng ký {client_id}")
     
     # Lấy socket của client (để lấy IP address)
@@ -32,31 +46,45 @@ class ServerBroadcaster(threading.Thread):
         with self.lock:
             return self.clients.get(client_id)
 
-    # Đưa (target_id, mcs_frame) vào hàng đợi self.queue
-    def enqueue(self, target_id: str, mcs_frame: bytes):
+    # Đưa MCS frame đã build vào hàng đợi self.queue (urgent: không xếp sau frame video)
+    def enqueue(self, target_id: str, mcs_frame: bytes, urgent: bool = False):
+        channel_id, payload = MCSLite.unpack_frame(mcs_frame)
+        self.enqueue_pdu(target_id, channel_id, payload, urgent=urgent)
+
+    # Đưa PDU (chưa có header MCS) vào hàng đợi, không copy payload
+    def enqueue_pdu(self, target_id: str, channel_id: int, payload, urgent: bool = False):
         if not self.running:
             return
         try:
-            self.queue.put((target_id, mcs_frame), block=False)
-        except Queue.Full:
+            self.queue.put((0 if urgent else 1, next(self._order), target_id, channel_id, payload), block=False)
+        except Full:
             print(f"[Broadcaster] Hàng đợi gửi bị đầy! Bỏ qua gói tin cho {target_id}")
 
+    # Gửi một PDU; kết nối framing v1 nhận PDU quá 64 KB (từ client v2) dưới dạng fragment 64000 byte
+    def _send(self, ssl_sock, framing: int, channel_id: int, payload):
+        if framing == FRAMING_V2 or TPKT_OVERHEAD + MCS_HDR_SIZE + len(payload) <= MAX_TPKT_LENGTH:
+            self.writer.sendall(ssl_sock, [TPKTLayer.frame_header(channel_id, len(payload), framing), payload])
+            return
+        for _, segments in PDUBuilder.iter_fragments([payload], V1_FRAGMENT_SIZE):
+            size = sum(len(seg) for seg in segments)
+            self.writer.sendall(ssl_sock, [TPKTLayer.frame_header(channel_id, size, framing)] + segments)
+
     def run(self):
         while self.running:
             try:
-                target_id, mcs_frame = self.queue.get(timeout=0.5)
+                _, _, target_id, channel_id, payload = self.queue.get(timeout=0.5)
             except Empty:
                 continue
 
             ssl_sock = None
             with self.lock:
                 ssl_sock = self.clients.get(target_id) 
+                framing = self.framing.get(target_id, FRAMING_V1)
 
             if ssl_sock:
                 try:
-                    # --- Đóng gói TPKT và gửi ---
-                    tpkt_packet = TPKTLayer.pack(mcs_frame) # Đóng gói thêm header TPKT (4 bytes) vào trước dữ liệu
-                    ssl_sock.sendall(tpkt_packet) # Gửi toàn bộ dữ liệu qua mạng 
+                    # --- Header TPKT/MCS + payload, gửi không nối chuỗi ---
+                    self._send(ssl_sock, framing, channel_id, payload)
                     
                 except Exception as e:
                     # Nếu gửi lỗi (ví dụ: client ngắt kết nối, ...). ServerReceiver sẽ tự phát hiện và dọn dẹp
@@ -69,4 +97,5 @@ class ServerBroadcaster(threading.Thread):
             self.queue.queue.clear()
         with self.lock:
             self.clients.clear()
+            self.framing.clear()
         print("[Broadcaster] Đã dừng.")
\ No newline at end of file
@@ -74,7 +74,8 @@ class ServerNetwork:
             ssl_sock = None
             try:
                 # --- Handshake X224 (trên socket thô) ---
-                ok, cid = X224Handshake.server_do_handshake(raw_sock, timeout=10)
+                # framing: v2 (độ dài 24/32 bit) nếu client đề nghị, client cũ giữ v1
+                ok, cid, framing = X224Handshake.server_negotiate(raw_sock, timeout=10)
                 if not ok or not cid:
                     print(f"[ServerNetwork] Handshake X224 thất bại từ {addr}.")
                     raw_sock.close()
@@ -99,7 +100,8 @@ class ServerNetwork:
                     ssl_sock, 
                     cid, 
                     pdu_push_callback=self.on_pdu_cb,
-                    done_callback=self._on_receiver_done
+                    done_callback=self._on_receiver_done,
+                    framing=framing
                 )
                 receiver.start()
 
@@ -113,7 +115,7 @@ class ServerNetwork:
                 
                 # Đăng ký với Broadcaster để có thể gửi tin
                 if self.broadcaster:
-                    self.broadcaster.register(cid, ssl_sock)
+                    self.broadcaster.register(cid, ssl_sock, framing=framing)
                 
                 # Báo cho SessionManager biết có client mới
                 if self.on_connect_cb:
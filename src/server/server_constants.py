@@ -92,6 +92,17 @@ CMD_STOP_VIEW = "stop_view"        # Manager dừng view
 CMD_STOP_CONTROL = "stop_control"  # Manager dừng control
 CMD_DISCONNECT = "disconnect"      # Manager/Client báo ngắt kết nối phiên (deprecated)
 CMD_SECURITY_ALERT = "security_alert" # Cấu trúc: "security_alert:Loại vi phạm|Nội dung chi tiết"
+CMD_BITMAP_CACHE = "bitmap_cache:" # Manager báo số ô bitmap cache giữ được: "bitmap_cache:2048"
+                                   # Server -> Client: dung lượng đã thương lượng (min của các viewer, 0 = tắt)
+CMD_SELECT_MONITOR = "monitor:"    # Manager chọn màn hình: "monitor:client_pc_1:1" / "monitor:client_pc_1:all"
+                                   # Server -> Client: hợp các màn hình đang được xem: "monitor:0,1" / "monitor:all"
+CMD_MONITOR_LIST = "monitors:"     # Client -> Server: "monitors:[{...}]"; Server -> Manager: "monitors:client_pc_1:[{...}]"
+CMD_KEYFRAME = "keyframe:"         # Manager cần FULL frame (thiếu ảnh nền): "keyframe:client_pc_1:0"
+                                   # Server -> Client: "keyframe:0" / "keyframe:all" (cả khi có viewer mới)
+CMD_COLOR_MODE = "colormode:"      # Manager chọn chế độ màu: "colormode:client_pc_1:gray"
+                                   # Server -> Client: chế độ hạn chế nhất trong các viewer: "colormode:gray"
+CMD_VIEWPORT = "viewport:"         # Manager báo vùng / kích thước đang hiển thị: "viewport:client_pc_1:0:0.25,0,0.75,0.5:960x540"
+                                   # Server -> Client: hợp các viewport của viewer: "viewport:0:0.25,0,0.75,0.5:960x540"
 
 # Các lệnh điều khiển screen sharing và remote control
 CMD_ENABLE_SCREEN_SHARING = "enable_screen_sharing"
@@ -109,4 +120,5 @@ CMD_CONTROL_STARTED = "control_started"       # Báo control bắt đầu: "cont
 CMD_CONTROL_STOPPED = "control_stopped"       # Báo control kết thúc: "control_stopped:client_pc_1"
 CMD_CONTROL_DENIED = "control_denied"         # Báo control bị từ chối (đã có người khác control)
 CMD_SESSION_ENDED = "session_ended"           # Báo phiên kết thúc: "session_ended:client_pc_1" (deprecated)
+CMD_WATCHERS = "watchers:"                    # Server -> Client: số manager đang xem/điều khiển khi chuyển 0 <-> khác 0
 CMD_ERROR = "error"                           # Báo lỗi: "error:Client not found"
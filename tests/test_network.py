@@ -0,0 +1,418 @@
+"""
+Test tầng mạng: PDU, tách luồng, TPKT/MCS, thỏa thuận framing (không cần server thật)
+"""
+
+import os
+import socket
+import ssl
+import struct
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import pytest
+
+from src.common.network.constants import (
+    SHARE_CTRL_HDR_FMT, SHARE_HDR_SIZE, VIEWPORT_FLAG, FRAMING_V1, FRAMING_V2, MAX_TPKT_LENGTH,
+    FRAGMENT_FLAG, FRAGMENT_HDR_FMT, FRAGMENT_ASSEMBLY_TIMEOUT, PDU_TYPE_CONTROL,
+)
+from src.common.network.mcs_layer import MCSLite
+from src.common.network.pdu_builder import PDUBuilder
+from src.common.network.pdu_parser import PDUParser
+from src.common.network.stream_decoder import PDUStreamDecoder, pdu_total_length
+from src.common.network.tpkt_layer import SegmentWriter, TPKTLayer, TPKTReader
+from src.common.network.x224_handshake import X224Handshake
+from src.server.network.server_broadcaster import ServerBroadcaster
+
+
+def test_viewport_trailer_is_flagged_and_framed():
+    """FULL kèm viewport bật VIEWPORT_FLAG; độ dài PDU gồm cả phần đuôi (không để lại 24 byte thừa)"""
+    viewport = (10, 20, 330, 260, 1920, 1080)
+    full = PDUBuilder.build_full_frame_pdu(1, b"\xff" * 100, 320, 240, viewport=viewport)
+    plain = PDUBuilder.build_full_frame_pdu(2, b"\xff" * 100, 320, 240)
+    control = PDUBuilder.build_control_pdu(3, b"ping")
+
+    assert full[13] & VIEWPORT_FLAG and not plain[13] & VIEWPORT_FLAG
+    assert pdu_total_length(full + control) == len(full)
+    assert pdu_total_length(plain + control) == len(plain)
+
+    pdus = PDUStreamDecoder().feed(full + control + plain)
+    assert pdus == [full, control, plain]
+    parser = PDUParser()
+    assert parser.parse(pdus[0])["viewport"] == viewport
+    assert "viewport" not in parser.parse(pdus[2])
+    assert parser.parse(pdus[1])["message"] == "ping"
+
+
+def _all_pdus():
+    """Một PDU mỗi loại theo đúng builder"""
+    return [
+        PDUBuilder.build_full_frame_pdu(1, b"\x01" * 300, 640, 480, codec=2, monitor=1),
+        PDUBuilder.build_full_frame_pdu(2, b"\x02" * 10, 640, 480, viewport=(0, 0, 640, 480, 1920, 1080)),
+        PDUBuilder.build_rect_frame_pdu(3, b"\x03" * 77, 64, 64, 32, 32, 640, 480),
+        PDUBuilder.build_control_pdu(4, b"hello"),
+        PDUBuilder.build_input_pdu(5, {"type": "mouse", "x": 1, "y": 2}),
+        PDUBuilder.build_cursor_pdu(6, 10, 20),
+        PDUBuilder.build_cursor_pdu(7, 10, 20, b"\x00\x00\x01"),
+        PDUBuilder.build_cache_pdu(8, 640, 480, 64, [(1, 2, 0, 64), (2, 3, 64, 0)]),
+        PDUBuilder.build_copy_rect_pdu(9, 0, 64, 640, 416, 0, 0, 640, 480),
+        PDUBuilder.build_file_start(10, "tệp.txt", 1234, 512, 7),
+        PDUBuilder.build_file_chunk(11, 512, b"data" * 50),
+        PDUBuilder.build_file_end(12, 0xDEADBEEF),
+        PDUBuilder.build_file_ack(13, 1234),
+        PDUBuilder.build_file_nak(14, 512, b"checksum"),
+    ]
+
+
+def test_pdu_total_length_every_type():
+    pdus = _all_pdus()
+    assert len({pdu[12] for pdu in pdus}) == 12  # đủ mọi loại PDU
+    for pdu in pdus:
+        assert pdu_total_length(pdu + b"\x00" * 40) == len(pdu)
+        assert pdu_total_length(b"\x00" * 5 + pdu, 5) == len(pdu)
+        # Chưa đủ header chung / trường độ dài -> None, không đoán độ dài
+        assert pdu_total_length(pdu[:13]) is None
+        assert pdu_total_length(pdu[:SHARE_HDR_SIZE + 1]) in (None, len(pdu))
+
+    # Fragment không có trường độ dài: chiếm trọn phần đã nhận (mỗi fragment một MCS frame)
+    big_full = PDUBuilder.build_full_frame_pdu(99, os.urandom(5000), 64, 64)
+    frag = PDUBuilder.fragmentize(big_full, 2000)[1][1]
+    assert pdu_total_length(frag) == len(frag)
+    assert pdu_total_length(frag, 0, SHARE_HDR_SIZE + 4) is None
+
+
+def test_decoder_several_pdus_per_feed():
+    pdus = _all_pdus()
+    decoder = PDUStreamDecoder()
+    assert decoder.feed(b"".join(pdus)) == pdus
+    assert decoder.pending == 0
+
+
+def test_decoder_pdus_split_across_feeds():
+    pdus = _all_pdus()
+    stream = b"".join(pdus)
+    for chunk in (1, 7, 13, 100, 1460):
+        decoder = PDUStreamDecoder()
+        out = []
+        for i in range(0, len(stream), chunk):
+            out += decoder.feed(memoryview(stream)[i:i + chunk])
+        assert out == pdus, chunk
+        assert decoder.pending == 0
+
+
+def test_decoder_keeps_partial_tail():
+    control = PDUBuilder.build_control_pdu(1, b"abc")
+    full = PDUBuilder.build_full_frame_pdu(2, b"\x00" * 1000, 10, 10)
+    decoder = PDUStreamDecoder()
+    assert decoder.feed(control + full[:500]) == [control]
+    assert decoder.pending == 500
+    assert decoder.feed(full[500:]) == [full]
+    assert decoder.pending == 0
+
+
+def test_decoder_drops_unknown_type():
+    garbage = struct.pack(SHARE_CTRL_HDR_FMT, 1, 0, 200, 0) + b"\x00" * 30
+    control = PDUBuilder.build_control_pdu(2, b"ok")
+    decoder = PDUStreamDecoder()
+    assert decoder.feed(garbage) == []
+    assert decoder.pending == 0
+    # Kênh không bị kẹt: PDU kế tiếp vẫn tách được
+    assert decoder.feed(control) == [control]
+
+
+def test_decoder_drops_oversized_pdu():
+    decoder = PDUStreamDecoder(max_pdu=1000)
+    huge = PDUBuilder.build_full_frame_pdu(1, b"\x00" * 2000, 10, 10)
+    assert decoder.feed(huge[:100]) == []
+    assert decoder.pending == 0
+    small = PDUBuilder.build_full_frame_pdu(2, b"\x00" * 100, 10, 10)
+    assert decoder.feed(small) == [small]
+
+    decoder.feed(small[:30])
+    decoder.reset()
+    assert decoder.pending == 0
+
+
+def test_tpkt_reader_buffer_returns_to_default_size():
+    """Buffer của reader mặc định 64 KB; TPKT lớn (v2) nới tạm thời, đọc xong thì trả về 64 KB"""
+    small = [TPKTLayer.pack(bytes([i]) * (100 + i), FRAMING_V2) for i in range(50)]
+    big_body = os.urandom(1_000_000)
+    stream = b"".join(small[:25]) + TPKTLayer.pack(big_body, FRAMING_V2) + b"".join(small[25:])
+
+    a, b = socket.socketpair()
+    try:
+        sender = threading.Thread(target=a.sendall, args=(stream,))
+        sender.start()
+        reader = TPKTReader(b, timeout=5, framing=FRAMING_V2)
+        assert len(reader._buf) == MAX_TPKT_LENGTH
+        for i in range(25):
+            assert bytes(reader.recv_one()) == bytes([i]) * (100 + i)
+        assert bytes(reader.recv_one()) == big_body
+        assert len(reader._buf) >= len(big_body)
+        for i in range(25, 50):
+            assert bytes(reader.recv_one()) == bytes([i]) * (100 + i)
+            assert len(reader._buf) == MAX_TPKT_LENGTH
+        sender.join()
+    finally:
+        a.close()
+        b.close()
+
+
+
+class _ShortWriteSocket:
+    """sendmsg mỗi lần chỉ nhận tối đa vài byte (như socket non-blocking / buffer gửi đầy)"""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.calls = 0
+        self.out = bytearray()
+
+    def sendmsg(self, buffers):
+        assert all(len(buf) for buf in buffers)  # Không gửi đoạn rỗng
+        assert self.calls < 100_000  # Không tiến được (cắt sai đoạn dở) -> lỗi thay vì treo
+        n = min(self.limits[self.calls % len(self.limits)], sum(len(buf) for buf in buffers))
+        self.calls += 1
+        data = b"".join(bytes(buf) for buf in buffers)[:n]
+        self.out += data
+        return n
+
+
+class _SendallSocket:
+    """Socket không có sendmsg (Windows): chỉ sendall"""
+
+    def __init__(self):
+        self.out = []
+
+    def sendall(self, data):
+        self.out.append(bytes(data))
+
+
+class _FakeSSLSocket(ssl.SSLSocket):
+    def sendall(self, data):
+        self.out.append(bytes(data))
+
+    def sendmsg(self, buffers):
+        raise AssertionError("SSLSocket không hỗ trợ sendmsg")
+
+
+def _segments():
+    payload = os.urandom(5000)
+    return [struct.pack(">BBH", 3, 0, 5014), b"", struct.pack(">HH", 1003, 5006),
+            bytearray(b"\x01\x02"), memoryview(payload)[100:], memoryview(payload)[:100], b"\xff"]
+
+
+@pytest.mark.parametrize("limits", [[1], [3, 7, 1], [4], [4 + 4 + 2], [1 << 20]])
+def test_segment_writer_partial_sendmsg(limits):
+    """sendmsg gửi thiếu (cắt giữa đoạn hoặc đúng biên đoạn): luồng byte vẫn đúng, đủ, không lặp"""
+    segments = _segments()
+    sock = _ShortWriteSocket(limits)
+    SegmentWriter().sendall(sock, segments)
+    assert bytes(sock.out) == b"".join(bytes(seg) for seg in segments)
+
+
+def test_segment_writer_falls_back_to_join():
+    """SSLSocket / socket không có sendmsg: nối vào buffer dùng lại và gửi một lần"""
+    writer = SegmentWriter(buffer_size=16)
+    plain = _SendallSocket()
+    tls = socket.socket.__new__(_FakeSSLSocket)
+    tls.out = []
+    big, small = _segments(), [b"abc", memoryview(b"defg")]
+    for sock in (plain, tls):
+        writer.sendall(sock, big)
+        writer.sendall(sock, small)
+        assert sock.out == [b"".join(bytes(seg) for seg in big), b"abcdefg"]
+    assert len(writer._buf) >= sum(len(seg) for seg in big)  # Buffer nới ra và được giữ lại
+
+    view = writer.join([b"xy", b"", b"z"])
+    assert isinstance(view, memoryview) and bytes(view) == b"xyz"
+
+def _handshake(client_fn, server_fn):
+    """Chạy handshake client / server trên một cặp socket, trả về (kết quả client, kết quả server)"""
+    a, b = socket.socketpair()
+    result = {}
+    server = threading.Thread(target=lambda: result.setdefault("server", server_fn(b)))
+    server.start()
+    try:
+        client = client_fn(a)
+        server.join(5)
+        return client, result["server"]
+    finally:
+        a.close()
+        b.close()
+
+
+def test_negotiate_v2_both_sides():
+    (body, client_framing), (ok, cid, server_framing) = _handshake(
+        lambda s: X224Handshake.client_negotiate(s, "pc-1"), lambda s: X224Handshake.server_negotiate(s))
+    assert body.endswith(b":OK") and ok and cid == "pc-1"
+    assert client_framing == server_framing == FRAMING_V2
+
+
+def test_negotiate_v2_client_old_server():
+    """Server cũ trả reserved = 0 -> client v2 quay về v1"""
+    (body, client_framing), (ok, cid) = _handshake(
+        lambda s: X224Handshake.client_negotiate(s, "pc-1"), lambda s: X224Handshake.server_do_handshake(s))
+    assert ok and cid == "pc-1" and body.endswith(b":OK")
+    assert client_framing == FRAMING_V1
+
+
+def test_negotiate_old_client_v2_server():
+    """Client cũ gửi reserved = 0 -> server v2 dùng v1 cho kết nối đó"""
+    body, (ok, cid, server_framing) = _handshake(
+        lambda s: X224Handshake.client_send_connect(s, "pc-1"), lambda s: X224Handshake.server_negotiate(s))
+    assert ok and cid == "pc-1" and body.endswith(b":OK")
+    assert server_framing == FRAMING_V1
+
+
+def test_v2_framing_large_mcs_frame():
+    """MCS frame > 64 KB: header MCS mở rộng + độ dài TPKT 24 bit; v1 không đóng gói được"""
+    payload = os.urandom(200_000)
+    frame = MCSLite.build(2, payload)
+    with pytest.raises(ValueError):
+        TPKTLayer.pack(frame)
+    packet = TPKTLayer.pack(frame, FRAMING_V2)
+    assert packet[1] == len(packet) >> 16
+
+    small = MCSLite.build(3, b"abc")
+    stream = packet + TPKTLayer.pack(small, FRAMING_V2)
+    a, b = socket.socketpair()
+    try:
+        sender = threading.Thread(target=a.sendall, args=(stream,))
+        sender.start()
+        reader = TPKTReader(b, timeout=5, framing=FRAMING_V2)
+        mcs = MCSLite()
+        mcs.feed(reader.recv_one())
+        mcs.feed(reader.recv_one())
+        sender.join()
+        assert dict(mcs.drain()) == {2: payload, 3: b"abc"}
+    finally:
+        a.close()
+        b.close()
+
+    # Header mở rộng bị cắt giữa hai lần feed vẫn được ghép đúng
+    mcs = MCSLite()
+    for i in range(0, len(frame), 3):
+        mcs.feed(frame[i:i + 3])
+    assert dict(mcs.drain()) == {2: payload}
+
+
+def _receive_pdus(sock, framing, count):
+    reader = TPKTReader(sock, timeout=5, framing=framing)
+    mcs, parser = MCSLite(), PDUParser()
+    decoders = {}
+    out = []
+    while len(out) < count:
+        mcs.feed(reader.recv_one())  # v1: TPKT > 64 KB -> ValueError
+        for ch, data in mcs.drain():
+            for pdu in decoders.setdefault(ch, PDUStreamDecoder()).feed(data):
+                parsed = parser.parse(pdu)
+                if parsed and parsed["type"] != "fragment_pending":
+                    out.append((ch, parsed))
+    return out
+
+
+def test_broadcaster_refragments_for_v1_viewers():
+    """FULL nguyên khối (client v2) đến manager v1 dưới dạng fragment, manager v2 nhận nguyên khối"""
+    jpg = os.urandom(300_000)
+    full = PDUBuilder.build_full_frame_pdu(7, jpg, 1920, 1080, viewport=(0, 0, 960, 540, 1920, 1080))
+    control = PDUBuilder.build_control_pdu(8, b"x")
+
+    broadcaster = ServerBroadcaster()
+    broadcaster.start()
+    socks = {name: socket.socketpair() for name in ("v1", "v2")}
+    broadcaster.register("v1", socks["v1"][0])
+    broadcaster.register("v2", socks["v2"][0], framing=FRAMING_V2)
+    result = {}
+    threads = [threading.Thread(target=lambda n=name, f=framing: result.setdefault(n, _receive_pdus(socks[n][1], f, 2)))
+               for name, framing in (("v1", FRAMING_V1), ("v2", FRAMING_V2))]
+    try:
+        for t in threads:
+            t.start()
+        for target in ("v1", "v2"):
+            broadcaster.enqueue_pdu(target, 2, full)
+            broadcaster.enqueue(target, MCSLite.build(3, control))
+        for t in threads:
+            t.join(10)
+        for name in ("v1", "v2"):
+            (ch_full, got_full), (ch_ctrl, got_ctrl) = result[name]
+            assert ch_full == 2 and bytes(got_full["jpg"]) == jpg, name
+            assert got_full["viewport"] == (0, 0, 960, 540, 1920, 1080)
+            assert ch_ctrl == 3 and got_ctrl["message"] == "x"
+    finally:
+        broadcaster.stop()
+        for a, b in socks.values():
+            a.close()
+            b.close()
+
+
+def _fragments(seq=1, size=10_000, max_payload=1000):
+    jpg = os.urandom(size)
+    full = PDUBuilder.build_full_frame_pdu(seq, jpg, 100, 100)
+    return jpg, [frag for _, frag in PDUBuilder.fragmentize(full, max_payload)]
+
+
+def _fragment(seq, offset, total, payload):
+    """Fragment của một CONTROL PDU, offset tùy ý (không theo fragmentize)"""
+    return (struct.pack(SHARE_CTRL_HDR_FMT, seq, 0, PDU_TYPE_CONTROL, FRAGMENT_FLAG)
+            + struct.pack(FRAGMENT_HDR_FMT, offset, total) + payload)
+
+
+def test_reassembly_out_of_order_and_duplicates():
+    jpg, frags = _fragments()
+    order = frags[::-1]
+    parser = PDUParser()
+    results = [parser.parse(frag) for frag in order[:-1]]
+    assert all(r["type"] == "fragment_pending" for r in results)
+    # Fragment lặp (gửi lại) không được tính thêm
+    assert parser.parse(order[0])["type"] == "fragment_pending"
+    assert parser.parse(order[3])["type"] == "fragment_pending"
+    done = parser.parse(order[-1])
+    assert done["type"] == "full" and bytes(done["jpg"]) == jpg
+    assert parser.fragment_buffer == {}
+
+
+def test_reassembly_rejects_overlapping_fragments():
+    """Fragment chồng lên dữ liệu đã nhận (offset khác) không được làm PDU 'xong' với lỗ trống"""
+    body = PDUBuilder.build_control_pdu(5, b"A" * 96)[SHARE_HDR_SIZE:]
+    total = len(body)  # 100
+    parser = PDUParser()
+    assert parser.parse(_fragment(5, 0, total, body[:60]))["type"] == "fragment_pending"
+    # [40, 80) chồng lên [0, 60): bỏ qua, không cộng 40 byte -> chưa "đủ" 100
+    assert parser.parse(_fragment(5, 40, total, body[40:80]))["type"] == "fragment_pending"
+    assert parser.fragment_buffer[5]["received"] == 60
+    # Fragment nằm trong đoạn đã có cũng bị bỏ qua
+    assert parser.parse(_fragment(5, 10, total, body[10:20]))["type"] == "fragment_pending"
+    # Phần còn thiếu [60, 100) hoàn tất PDU đúng nội dung
+    done = parser.parse(_fragment(5, 60, total, body[60:]))
+    assert done["type"] == "control" and done["message"] == "A" * 96
+
+    # Chồng lên fragment đứng SAU (đến trước do lệch thứ tự)
+    parser = PDUParser()
+    parser.parse(_fragment(6, 50, total, body[50:]))
+    assert parser.parse(_fragment(6, 0, total, body[:70]))["type"] == "fragment_pending"
+    assert parser.fragment_buffer[6]["received"] == 50
+
+
+def test_reassembly_expires_stale_fragments(monkeypatch):
+    from src.common.network import pdu_parser
+
+    clock = [1000.0]
+    monkeypatch.setattr(pdu_parser.time, "monotonic", lambda: clock[0])
+    jpg, frags = _fragments(seq=9)
+    parser = PDUParser()
+    for frag in frags[:-1]:
+        parser.parse(frag)
+    assert 9 in parser.fragment_buffer
+
+    # Quá hạn lắp ráp: phần đã nhận bị bỏ, fragment cuối không ghép với dữ liệu cũ
+    clock[0] += FRAGMENT_ASSEMBLY_TIMEOUT + 1
+    assert parser.parse(frags[-1])["type"] == "fragment_pending"
+    assert parser.fragment_buffer[9]["received"] == len(frags[-1]) - SHARE_HDR_SIZE - struct.calcsize(FRAGMENT_HDR_FMT)
+
+    # Gửi lại đủ trong hạn -> lắp ráp được
+    for frag in frags[:-1]:
+        result = parser.parse(frag)
+    assert result["type"] == "full" and bytes(result["jpg"]) == jpg
@@ -0,0 +1,310 @@
+"""
+Test chụp màn hình / phát hiện thay đổi (không cần màn hình thật: SyntheticCaptureBackend)
+"""
+
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.client.client_capture import CapturedFrame, SyntheticCaptureBackend
+from src.client.client_pipeline import LatestWinsQueue
+from src.client.client_regions import TileChangeDetector, find_row_shift
+from src.client.client_scaling import FrameScaler
+from src.client.client_screenshot import ClientScreenshot, _FrameJob
+from src.common.network.constants import CACHE_OP_RESET, CACHE_OP_HIT, CACHE_OP_STORE, CODEC_PNG
+from src.common.network.pdu_builder import PDUBuilder
+from src.common.network.pdu_parser import PDUParser
+from src.common.video_codec import encode_region
+from src.manager.manager_viewer import ManagerViewer
+
+
+def test_no_delta_reports_no_dirty_rects():
+    """Tắt delta (mặc định): không có vùng thay đổi nào -> không gửi gì, FULL chỉ theo lịch"""
+    shot = ClientScreenshot()
+    assert shot.detect_delta is False
+    assert shot.compute_dirty_rects(None) == []
+
+
+def _screenshot(width=320, height=200, **kwargs):
+    return ClientScreenshot(fps=30, backend=SyntheticCaptureBackend(width, height), **kwargs)
+
+
+def test_no_delta_sends_only_scheduled_full():
+    """Tắt delta (mặc định): chỉ frame đầu / ép buộc là FULL, các tick còn lại không gửi gì"""
+    shot = _screenshot()
+    job = shot._capture_stage()
+    assert job is not None and job.regions[0][0] is None
+    for _ in range(3):
+        assert shot._capture_stage() is None
+
+    shot.force_full_frame()
+    job = shot._capture_stage()
+    assert job is not None and job.regions[0][0] is None
+    assert shot._capture_stage() is None
+
+
+def test_delta_sends_dirty_rects():
+    shot = _screenshot(detect_delta=True)
+    assert shot._capture_stage().regions[0][0] is None
+    job = shot._capture_stage()
+    assert job is not None
+    assert job.regions and all(rect is not None for rect, _ in job.regions)
+
+
+
+def _scrolled(dx, dy, width=320, height=256, seed=0):
+    """Ảnh nhiễu (mọi hàng / cột khác nhau) và bản cuộn của nó: cur[y, x] = prev[y - dy, x - dx], phần lộ ra là nhiễu mới"""
+    rng = np.random.default_rng(seed)
+    prev = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    cur = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    ys, yd = slice(max(0, -dy), height - max(0, dy)), slice(max(0, dy), height - max(0, -dy))
+    xs, xd = slice(max(0, -dx), width - max(0, dx)), slice(max(0, dx), width - max(0, -dx))
+    cur[yd, xd] = prev[ys, xs]
+    return prev, cur
+
+
+def _assert_move(detector, prev, cur, move, shift):
+    (sl, su, sr, sb), (dx, dy) = move
+    assert (dx - sl, dy - su) == shift
+    assert np.array_equal(cur[dy:dy + sb - su, dx:dx + sr - sl], prev[su:sb, sl:sr])
+    # Ảnh tham chiếu đã được dịch giống manager -> vùng đích khớp frame mới
+    assert np.array_equal(detector._prev[dy:dy + sb - su, dx:dx + sr - sl], cur[dy:dy + sb - su, dx:dx + sr - sl])
+
+
+def test_find_row_shift_vertical():
+    prev, cur = _scrolled(0, -40)
+    d, y0, y1 = find_row_shift(prev, cur, min_run=128)
+    assert (d, y0, y1) == (-40, 0, 256 - 40)
+    assert find_row_shift(prev, prev[::-1].copy(), min_run=128) is None
+
+
+@pytest.mark.parametrize("shift", [(0, -40), (0, 56), (-24, 0), (72, 0)])
+def test_detect_move_scroll(shift):
+    """Cuộn dọc / ngang: tìm đúng độ dịch, vùng nguồn chép tới đích khớp frame mới"""
+    prev, cur = _scrolled(*shift)
+    detector = TileChangeDetector(tile_size=64)
+    detector.reset(None, frame=prev)
+    _assert_move(detector, prev, cur, detector.detect_move(cur), shift)
+
+
+def test_detect_move_alignment():
+    """align > 1: độ dịch lệch lưới bị bỏ qua, dịch đúng lưới cho vùng có biên là bội số của align"""
+    prev, cur = _scrolled(0, -40)
+    detector = TileChangeDetector(tile_size=64)
+    detector.reset(None, frame=prev)
+    assert detector.detect_move(cur, align=16) is None
+    assert np.array_equal(detector._prev, prev)  # Không tìm thấy -> ảnh tham chiếu giữ nguyên
+
+    prev, cur = _scrolled(-24, 0, seed=1)
+    detector.reset(None, frame=prev)
+    assert detector.detect_move(cur, align=16) is None
+
+    prev, cur = _scrolled(0, -48, seed=2)
+    detector.reset(None, frame=prev)
+    move = detector.detect_move(cur, align=16)
+    assert all(v % 16 == 0 for v in move[0] + move[1])
+    _assert_move(detector, prev, cur, move, (0, -48))
+
+def test_monitor_list_falls_back_to_default(monkeypatch):
+    """mss lỗi / không có màn hình: vẫn tạo được ClientDisplays với một màn hình mặc định"""
+    from src.client import client_capture
+    from src.client.client_displays import ClientDisplays
+
+    def broken_mss():
+        raise RuntimeError("no display")
+
+    monkeypatch.setattr(client_capture, "mss", broken_mss)
+    assert [m["id"] for m in client_capture.list_monitors()] == [0]
+
+    displays = ClientDisplays(monitors=[], backend_factory=lambda m: SyntheticCaptureBackend(320, 200))
+    assert displays.primary_id == 0 and list(displays.streams) == [0]
+
+
+
+def test_restart_waits_for_previous_loop(monkeypatch):
+    """Bỏ xem rồi xem lại ngay: không chạy vòng chụp thứ hai khi vòng cũ của màn hình chưa thoát"""
+    from src.client.client_displays import ClientDisplays
+
+    monitors = [{"id": i, "left": 320 * i, "top": 0, "width": 320, "height": 200} for i in range(2)]
+    displays = ClientDisplays(monitors=monitors, backend_factory=lambda m: SyntheticCaptureBackend(320, 200))
+    stream = displays.streams[0]
+    active, runs, lock = [0], [0, 0], threading.Lock()
+
+    def slow_loop(callback):
+        with lock:
+            active[0] += 1
+            runs[0] += 1
+            runs[1] = max(runs[1], active[0])
+        while not stream.stop:
+            time.sleep(0.01)
+        time.sleep(0.3)  # Dọn dẹp chậm (đóng backend, chờ luồng encode)
+        with lock:
+            active[0] -= 1
+
+    monkeypatch.setattr(stream, "capture_loop", slow_loop)
+    runner = threading.Thread(target=displays.capture_loop, args=(lambda *a: None,), daemon=True)
+    runner.start()
+    try:
+        deadline = time.time() + 2
+        while runs[0] < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        displays.set_watched([1])
+        rewatch = threading.Thread(target=displays.set_watched, args=([0, 1],))
+        rewatch.start()
+        time.sleep(0.05)
+        # Đang chờ luồng cũ thoát nhưng không giữ lock -> luồng điều khiển khác không bị chặn
+        assert rewatch.is_alive() and displays._lock.acquire(timeout=0.1)
+        displays._lock.release()
+        rewatch.join(timeout=5)
+        deadline = time.time() + 2
+        while runs[0] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert runs == [2, 1]
+    finally:
+        displays.stop = True
+        runner.join(timeout=5)
+
+
+def _tiles(keys, width=256):
+    """{ô 64x64 -> hash} theo thứ tự hàng: keys là chuỗi, mỗi ký tự một ô ("." = không có hash)"""
+    return {(i * 64 % width, i * 64 // width * 64, i * 64 % width + 64, i * 64 // width * 64 + 64): k.encode()
+            for i, k in enumerate(keys) if k != "."}
+
+
+def _noise(w, h, seed=0):
+    return Image.fromarray(np.random.default_rng(seed).integers(0, 256, (h, w, 3), dtype=np.uint8), "RGB")
+
+
+def test_bitmap_cache_op_order_and_duplicates():
+    """Keyframe: RESET trước mọi op; ô trùng nhau trong một frame chỉ STORE một lần; HIT luôn đứng trước STORE"""
+    shot = _screenshot()
+    shot.set_bitmap_cache(8)
+    img = _noise(256, 128)
+    regions, ops = shot._apply_bitmap_cache(_FrameJob(256, 128, [(None, img)], 0, 85, _tiles("abacdefg"), True))
+    assert regions == [(None, img)]  # Không có HIT -> FULL giữ nguyên
+    assert ops[0] == (CACHE_OP_RESET, 8, 0, 0)
+    assert ops[1:] == [(CACHE_OP_STORE, slot, x, y) for slot, (x, y) in
+                       enumerate([(0, 0), (64, 0), (192, 0), (0, 64), (64, 64), (128, 64), (192, 64)])]
+
+    regions, ops = shot._apply_bitmap_cache(_FrameJob(256, 128, [((0, 0, 256, 64), img.crop((0, 0, 256, 64)))],
+                                                      0, 85, _tiles("axbx")))
+    assert ops == [(CACHE_OP_HIT, 0, 0, 0), (CACHE_OP_HIT, 1, 128, 0), (CACHE_OP_STORE, 7, 64, 0)]
+    # Ô "x" thứ hai vẫn phải encode (manager chỉ có nó trong cache sau khi cả frame được vá)
+    assert [rect for rect, _ in regions] == [(64, 0, 128, 64), (192, 0, 256, 64)]
+
+
+def test_bitmap_cache_splits_regions_around_hits():
+    """Vùng chứa ô HIT được cắt thành các hình chữ nhật còn lại, ảnh cắt đúng vị trí"""
+    shot = _screenshot()
+    shot.set_bitmap_cache(16)
+    img = _noise(256, 192, seed=1)
+    shot._apply_bitmap_cache(_FrameJob(256, 192, [(None, img)], 0, 85, _tiles("....k......."), True))
+
+    rect = (0, 0, 192, 192)
+    job = _FrameJob(256, 192, [(rect, img.crop(rect))], 0, 85, _tiles(".....k......"))
+    regions, ops = shot._apply_bitmap_cache(job)
+    assert ops == [(CACHE_OP_HIT, 0, 64, 64)]
+    assert sorted(r for r, _ in regions) == [(0, 0, 192, 64), (0, 64, 64, 128), (0, 128, 192, 192),
+                                             (128, 64, 192, 128)]
+    for r, part in regions:
+        assert part.size == (r[2] - r[0], r[3] - r[1])
+        assert np.array_equal(np.asarray(part), np.asarray(img.crop(r)))
+
+
+def test_viewer_applies_cache_ops_in_order():
+    """Manager: HIT dán ô đang lưu trước khi STORE cùng PDU ghi đè slot; RESET xóa bảng slot"""
+    viewer, parser = ManagerViewer(), PDUParser()
+    old, new = _noise(64, 64, seed=2), _noise(64, 64, seed=3)
+    base = _noise(256, 128, seed=4)
+    base.paste(old, (0, 0))
+
+    def feed(raw):
+        return viewer.process_video_pdu("c", parser.parse(raw))
+
+    feed(PDUBuilder.build_full_frame_pdu(1, encode_region(base, CODEC_PNG), 256, 128, codec=CODEC_PNG))
+    feed(PDUBuilder.build_cache_pdu(2, 256, 128, 64, [(CACHE_OP_RESET, 4, 0, 0), (CACHE_OP_STORE, 0, 0, 0)]))
+    feed(PDUBuilder.build_rect_frame_pdu(3, encode_region(new, CODEC_PNG), 0, 0, 64, 64, 256, 128, codec=CODEC_PNG))
+    feed(PDUBuilder.build_cache_pdu(4, 256, 128, 64, [(CACHE_OP_HIT, 0, 64, 0), (CACHE_OP_STORE, 0, 0, 0)]))
+    feed(PDUBuilder.build_cache_pdu(5, 256, 128, 64, [(CACHE_OP_HIT, 0, 128, 0)]))
+    img = np.asarray(viewer.current_base_image[("c", 0)])
+    assert np.array_equal(img[:64, 64:128], np.asarray(old))
+    assert np.array_equal(img[:64, 128:192], np.asarray(new))
+
+    assert feed(PDUBuilder.build_cache_pdu(6, 256, 128, 64, [(CACHE_OP_RESET, 4, 0, 0), (CACHE_OP_HIT, 0, 192, 0)])) \
+        is None
+    assert np.array_equal(np.asarray(viewer.current_base_image[("c", 0)]), img)
+
+
+def _round_trip_tick(shot, viewer):
+    """Một tick của pipeline client (capture -> cache -> encode -> send) đi thẳng vào ManagerViewer qua PDU"""
+    parser, sent = PDUParser(), []
+
+    def on_frame(w, h, data, bbox, img, seq, ts_ms, codec, monitor, viewport=None):
+        if bbox is None:
+            raw = PDUBuilder.build_full_frame_pdu(seq, data, w, h, codec=codec, monitor=monitor, viewport=viewport)
+        else:
+            l, u, r, b = bbox
+            raw = PDUBuilder.build_rect_frame_pdu(seq, data, l, u, r - l, b - u, w, h, codec=codec, monitor=monitor)
+        viewer.process_video_pdu("c", parser.parse(raw))
+
+    def on_cache_ops(w, h, tile_size, ops, seq, monitor):
+        sent.extend(op for op, _, _, _ in ops)
+        viewer.process_video_pdu("c", parser.parse(PDUBuilder.build_cache_pdu(seq, w, h, tile_size, ops, monitor)))
+
+    shot.on_cache_ops = on_cache_ops
+    job = shot._capture_stage()
+    if job is not None:
+        job_q, send_q, done = LatestWinsQueue(), queue.Queue(), threading.Event()
+        job_q.put(job)
+        done.set()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            shot._encode_stage(job_q, send_q, pool, done)
+            shot._send_stage(on_frame, send_q)
+    return sent
+
+
+def test_bitmap_cache_round_trip_is_pixel_exact():
+    """Chụp (cache bật) -> PDUBuilder -> PDUParser -> ManagerViewer: ảnh manager giống hệt framebuffer"""
+    backend = SyntheticCaptureBackend(320, 200)
+    shot = ClientScreenshot(fps=30, backend=backend, detect_delta=True, target_bitrate=10 ** 9)
+    shot.set_bitmap_cache(64)
+    viewer = ManagerViewer()
+    ops = []
+    for _ in range(12):
+        ops += _round_trip_tick(shot, viewer)
+        expected = Image.frombytes("RGB", (320, 200), bytes(backend._buffer), "raw", "BGRX")
+        assert np.array_equal(np.asarray(viewer.current_base_image[("c", 0)]), np.asarray(expected))
+    assert ops.count(CACHE_OP_RESET) == 1 and CACHE_OP_HIT in ops and CACHE_OP_STORE in ops
+
+@pytest.mark.parametrize("size", [(342, 200), (341, 197), (1366, 768)])
+@pytest.mark.parametrize("k", range(1, 8))
+def test_scaled_region_matches_full_frame(size, k):
+    """Vùng (căn lưới ô, có thể chạm mép) thu nhỏ riêng giống hệt phần tương ứng của FULL đã thu nhỏ"""
+    w, h = size
+    pixels = np.random.default_rng(k).integers(0, 256, (h, w, 4), dtype=np.uint8)
+    frame = CapturedFrame(pixels.tobytes(), w, h, rawmode="BGRX", bpp=4)
+    scaler = FrameScaler(size, k)
+    _, full = scaler.region(frame)
+    assert full.size == scaler.size
+
+    rnd = random.Random(k)
+    rects = [(w // 64 * 64 - 64, 0, w, 64), (0, h // 64 * 64 - 64, 64, h), (w // 64 * 64 - 64, 64, w, 128)]
+    for _ in range(20):
+        l, u = rnd.randrange(w // 64) * 64, rnd.randrange(h // 64) * 64
+        rects.append((l, u, w if rnd.random() < 0.5 else min(w, l + 64 * rnd.randint(1, 3)),
+                      h if rnd.random() < 0.5 else min(h, u + 64 * rnd.randint(1, 3))))
+    for rect in rects:
+        scaled, img = scaler.region(frame, rect)
+        assert np.array_equal(np.asarray(img), np.asarray(full.crop(scaled))), rect
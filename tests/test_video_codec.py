@@ -0,0 +1,125 @@
+"""
+Test codec vùng ảnh: PALETTE / RGB565 lossless, phân loại nội dung, chế độ màu cho đường truyền yếu
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from src.common.network.constants import CODEC_JPEG, CODEC_PNG, CODEC_PALETTE, CODEC_RGB565
+from src.common.video_codec import apply_color_mode, classify_region, decode_region, encode_region
+
+
+def _flat_ui(size=(200, 120)):
+    """Cửa sổ phẳng: vài màu nền, thanh tiêu đề, nút"""
+    img = Image.new("RGB", size, (240, 240, 240))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, size[0], 20), fill=(30, 60, 120))
+    draw.rectangle((10, 40, 90, 70), fill=(255, 255, 255), outline=(120, 120, 120))
+    draw.rectangle((110, 90, 190, 110), fill=(0, 120, 215))
+    return img
+
+
+def _text(size=(256, 96)):
+    """Văn bản khử răng cưa: nhiều sắc độ quanh nét chữ nhưng vẫn ít màu so với ảnh chụp"""
+    img = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for i, y in enumerate(range(4, size[1] - 8, 14)):
+        draw.text((4, y), "The quick brown fox jumps over 0123456789",
+                  fill=[(0, 0, 0), (200, 30, 30), (20, 90, 200)][i % 3])
+    return img.filter(ImageFilter.GaussianBlur(0.7))
+
+
+def _photo(size=(160, 120)):
+    """Ảnh chụp: gradient mượt cộng nhiễu cảm biến"""
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w]
+    rgb = np.stack((x * 255 // w, y * 255 // h, (x + y) * 255 // (w + h)), axis=-1).astype(np.int16)
+    rgb += np.random.default_rng(0).integers(-12, 13, rgb.shape, dtype=np.int16)
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), "RGB")
+
+
+@pytest.mark.parametrize("make, codec", [(_flat_ui, CODEC_PALETTE), (_text, CODEC_PNG), (_photo, CODEC_JPEG)])
+def test_classify_region(make, codec):
+    assert classify_region(make()) == codec
+
+
+@pytest.mark.parametrize("img", [
+    _flat_ui(),
+    _text().quantize(256).convert("RGB"),  # Đúng 256 màu: chỉ số vẫn vừa 1 byte
+    Image.new("RGB", (1, 1), (1, 2, 3)),
+    Image.new("RGB", (33, 7), (255, 255, 255)),
+])
+def test_palette_round_trip_is_exact(img):
+    data = encode_region(img, CODEC_PALETTE)
+    out = decode_region(data, CODEC_PALETTE, img.size)
+    assert out.mode == "RGB" and out.size == img.size
+    assert np.array_equal(np.asarray(out), np.asarray(img))
+
+
+def test_palette_rejects_too_many_colors():
+    with pytest.raises(ValueError):
+        encode_region(_photo(), CODEC_PALETTE)
+
+
+def test_rgb565_round_trip():
+    """RGB565: sai số tối đa bằng bước lượng tử của từng kênh, trắng / đen giữ nguyên"""
+    img = _photo()
+    out = decode_region(encode_region(img, CODEC_RGB565), CODEC_RGB565, img.size)
+    assert out.mode == "RGB" and out.size == img.size
+    diff = np.abs(np.asarray(out, dtype=np.int16) - np.asarray(img, dtype=np.int16))
+    assert diff[..., 0].max() <= 7 and diff[..., 1].max() <= 3 and diff[..., 2].max() <= 7
+
+    bw = Image.new("RGB", (8, 2), (255, 255, 255))
+    bw.paste((0, 0, 0), (0, 0, 4, 2))
+    assert np.array_equal(np.asarray(decode_region(encode_region(bw, CODEC_RGB565), CODEC_RGB565, bw.size)),
+                          np.asarray(bw))
+
+
+def _through(img, codec, color_mode):
+    """apply_color_mode -> encode -> decode như manager nhận được"""
+    reduced, codec = apply_color_mode(img, codec, color_mode)
+    return codec, decode_region(encode_region(reduced, codec, 85), codec, img.size)
+
+
+@pytest.mark.parametrize("color_mode, make, expected", [
+    ("full", _flat_ui, CODEC_PALETTE),
+    ("full", _text, CODEC_PNG),
+    ("full", _photo, CODEC_JPEG),
+    ("gray", _flat_ui, CODEC_PALETTE),
+    ("gray", _text, CODEC_PALETTE),
+    ("gray", _photo, CODEC_JPEG),
+    ("palette8", _flat_ui, CODEC_PALETTE),
+    ("palette8", _text, CODEC_PALETTE),
+    ("palette8", _photo, CODEC_JPEG),
+    ("rgb16", _flat_ui, CODEC_PALETTE),
+    ("rgb16", _text, CODEC_RGB565),
+    ("rgb16", _photo, CODEC_JPEG),
+])
+def test_color_mode_codec_and_decoded_image(color_mode, make, expected):
+    """Mỗi chế độ màu chọn đúng codec; manager luôn giải mã ra ảnh RGB đúng kích thước"""
+    img = make()
+    codec, out = _through(img, classify_region(img), color_mode)
+    assert codec == expected
+    assert out.mode == "RGB" and out.size == img.size
+
+
+def test_gray_mode_is_lossless_on_gray_levels():
+    img = _text()
+    _, out = _through(img, classify_region(img), "gray")
+    gray = np.asarray(img.convert("L"))
+    assert np.array_equal(np.asarray(out), np.stack((gray,) * 3, axis=-1))
+
+
+def test_palette8_keeps_at_most_256_colors():
+    img = _text()
+    _, out = _through(img, classify_region(img), "palette8")
+    assert out.getcolors(256) is not None
+    assert np.abs(np.asarray(out, dtype=np.int16) - np.asarray(img, dtype=np.int16)).mean() < 8
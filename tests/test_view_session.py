@@ -0,0 +1,198 @@
+"""
+Test keyframe cache của ViewSession: điểm đồng bộ, nén RECT, giới hạn dung lượng, phát lại cho viewer mới
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image
+
+from src.common.network.constants import CODEC_PNG, CACHE_OP_RESET, CACHE_OP_HIT, CACHE_OP_STORE
+from src.common.network.pdu_builder import PDUBuilder
+from src.common.network.pdu_parser import PDUParser
+from src.common.video_codec import encode_region
+from src.manager.manager_viewer import ManagerViewer
+from src.server.core.view_session import KeyframeLog
+
+W, H, TS = 256, 192, 64
+
+
+class _Stream:
+    """Tạo PDU video của một màn hình như client (PNG để ảnh giải mã không lệch pixel nào)"""
+
+    def __init__(self, seed=0):
+        self.seq = 0
+        self.rng = np.random.default_rng(seed)
+
+    def _img(self, w, h):
+        return Image.fromarray(self.rng.integers(0, 256, (h, w, 3), dtype=np.uint8), "RGB")
+
+    def _next(self):
+        self.seq += 1
+        return self.seq
+
+    def full(self):
+        return PDUBuilder.build_full_frame_pdu(self._next(), encode_region(self._img(W, H), CODEC_PNG), W, H,
+                                               codec=CODEC_PNG)
+
+    def rect(self, x, y, w, h):
+        return PDUBuilder.build_rect_frame_pdu(self._next(), encode_region(self._img(w, h), CODEC_PNG),
+                                               x, y, w, h, W, H, codec=CODEC_PNG)
+
+    def copy(self, src, dst):
+        l, u, r, b = src
+        return PDUBuilder.build_copy_rect_pdu(self._next(), l, u, r - l, b - u, dst[0], dst[1], W, H)
+
+    def cache(self, *ops):
+        return PDUBuilder.build_cache_pdu(self._next(), W, H, TS, list(ops))
+
+
+def _record(log, raw):
+    pdu = PDUParser().parse(raw)
+    log.record(pdu["type"], pdu, raw)
+    return pdu
+
+
+def _types(log):
+    return [t for t, _, _ in log.entries]
+
+
+def test_sync_point_without_cache():
+    """Cache tắt: mỗi FULL là điểm đồng bộ, log bắt đầu lại từ FULL đó"""
+    s, log = _Stream(), KeyframeLog()
+    _record(log, s.rect(0, 0, 64, 64))
+    assert not log.valid and log.entries == []  # Chưa có FULL -> không ghi
+
+    for raw in (s.full(), s.rect(0, 0, 64, 64), s.copy((0, 0, 64, 64), (64, 0))):
+        _record(log, raw)
+    assert log.valid and _types(log) == ["full", "rect", "copy"]
+
+    full = s.full()
+    _record(log, full)
+    assert log.valid and log.entries == [("full", None, full)]
+    assert log.nbytes == len(full)
+
+
+def test_sync_point_with_cache():
+    """Cache bật: FULL thường không cắt log (op HIT/STORE phụ thuộc lịch sử), chỉ FULL + RESET mới cắt"""
+    s, log = _Stream(), KeyframeLog()
+    _record(log, s.full())
+    _record(log, s.cache((CACHE_OP_RESET, 8, 0, 0), (CACHE_OP_STORE, 0, 0, 0)))
+    assert log.valid and log.cache_active
+    for raw in (s.rect(0, 0, 64, 64), s.full(), s.cache((CACHE_OP_HIT, 0, 64, 64))):
+        _record(log, raw)
+    assert log.valid and _types(log) == ["full", "cache", "rect", "full", "cache"]
+
+    # Keyframe mới: FULL + RESET -> log bắt đầu lại từ FULL ngay trước RESET
+    _record(log, s.full())
+    _record(log, s.cache((CACHE_OP_RESET, 8, 0, 0)))
+    assert log.valid and _types(log) == ["full", "cache"]
+
+    # RESET 0 = tắt cache -> FULL kế tiếp lại là điểm đồng bộ
+    _record(log, s.rect(0, 0, 64, 64))
+    _record(log, s.cache((CACHE_OP_RESET, 0, 0, 0)))
+    assert log.valid and not log.cache_active and _types(log) == ["full", "cache", "rect", "cache"]
+    _record(log, s.full())
+    assert _types(log) == ["full"]
+
+
+def test_rect_compaction_stops_at_copy_and_cache():
+    """RECT bị RECT sau che hết thì bỏ, trừ khi giữa chúng có COPY / CACHE (đã dùng pixel của RECT cũ)"""
+    s, log = _Stream(), KeyframeLog()
+    _record(log, s.full())
+    small = s.rect(0, 0, 64, 64)
+    _record(log, small)
+    _record(log, s.rect(0, 0, 128, 128))
+    assert _types(log) == ["full", "rect"] and small not in [raw for _, _, raw in log.entries]
+
+    _record(log, s.rect(128, 0, 64, 64))
+    _record(log, s.copy((128, 0, 192, 64), (0, 128)))
+    _record(log, s.rect(0, 0, 256, 128))
+    assert _types(log) == ["full", "rect", "rect", "copy", "rect"]  # Không bỏ RECT trước COPY
+
+    _record(log, s.rect(0, 0, 64, 64))
+    _record(log, s.cache((CACHE_OP_HIT, 0, 64, 64)))
+    _record(log, s.rect(0, 0, 256, 192))
+    assert _types(log) == ["full", "rect", "rect", "copy", "rect", "rect", "cache", "rect"]
+
+    # Sau barrier vẫn nén bình thường
+    _record(log, s.rect(0, 0, 256, 192))
+    assert _types(log) == ["full", "rect", "rect", "copy", "rect", "rect", "cache", "rect"]
+    assert log.nbytes == sum(len(raw) for _, _, raw in log.entries)
+
+
+def test_log_dropped_past_max_bytes():
+    """Vượt MAX_BYTES: bỏ toàn bộ log tới FULL kế tiếp (viewer mới xin keyframe như cũ)"""
+    s, log = _Stream(), KeyframeLog()
+    full = s.full()
+    log.MAX_BYTES = len(full) + 2 * len(s.rect(0, 0, 64, 64))
+    _record(log, full)
+    _record(log, s.rect(0, 0, 64, 64))
+    _record(log, s.rect(64, 0, 64, 64))
+    assert log.valid and len(log.entries) == 3
+
+    _record(log, s.rect(128, 0, 64, 64))
+    assert not log.valid and log.entries == [] and log.nbytes == 0
+    _record(log, s.rect(0, 0, 64, 64))
+    assert log.entries == []
+
+    _record(log, s.full())
+    assert log.valid and _types(log) == ["full"]
+
+
+def test_dropped_log_with_cache_waits_for_reset():
+    """Cache bật mà log đã bị bỏ: FULL thường chưa phát lại được, phải chờ FULL + RESET"""
+    s, log = _Stream(), KeyframeLog()
+    _record(log, s.full())
+    _record(log, s.cache((CACHE_OP_RESET, 8, 0, 0)))
+    log.MAX_BYTES = log.nbytes + 1
+    _record(log, s.rect(0, 0, 64, 64))
+    assert not log.valid and log.cache_active
+
+    _record(log, s.full())
+    assert not log.valid
+    _record(log, s.cache((CACHE_OP_HIT, 0, 0, 0)))
+    assert not log.valid
+    _record(log, s.full())
+    _record(log, s.cache((CACHE_OP_RESET, 8, 0, 0)))
+    assert log.valid and _types(log) == ["full", "cache"]
+
+
+def test_replay_matches_live_viewer():
+    """Viewer mới nhận log phát lại có ảnh giống hệt viewer đã xem từ đầu, ở mọi thời điểm log hợp lệ"""
+    s, log = _Stream(seed=1), KeyframeLog()
+    stream = [
+        s.full(),
+        s.cache((CACHE_OP_RESET, 8, 0, 0), (CACHE_OP_STORE, 0, 0, 0), (CACHE_OP_STORE, 1, 64, 0)),
+        s.rect(0, 64, 64, 64),
+        s.rect(0, 64, 128, 64),
+        s.copy((0, 0, 128, 64), (128, 128)),
+        s.cache((CACHE_OP_HIT, 0, 192, 0), (CACHE_OP_HIT, 1, 0, 128), (CACHE_OP_STORE, 2, 0, 64)),
+        s.full(),
+        s.rect(64, 0, 128, 128),
+        s.cache((CACHE_OP_HIT, 2, 64, 64), (CACHE_OP_HIT, 0, 192, 128)),
+        s.full(),
+        s.cache((CACHE_OP_RESET, 0, 0, 0)),
+        s.rect(0, 0, 64, 192),
+        s.copy((0, 0, 64, 192), (192, 0)),
+        s.full(),
+        s.rect(128, 64, 64, 64),
+    ]
+    live = ManagerViewer()
+    replays = 0
+    for raw in stream:
+        live.process_video_pdu("c", _record(log, raw))
+        if not log.valid:
+            continue
+        viewer, parser = ManagerViewer(), PDUParser()
+        for _, _, entry in log.entries:
+            viewer.process_video_pdu("c", parser.parse(entry))
+        expected = np.asarray(live.current_base_image[("c", 0)])
+        assert np.array_equal(np.asarray(viewer.current_base_image[("c", 0)]), expected), log.entries
+        replays += 1
+    assert replays == len(stream)